@@ -2,15 +2,23 @@ import os, sys
 import aiorwlock
 from datetime import timedelta
 from quart import Quart
+from quart.utils import run_sync
 
 from Career_API import utils
 from Career_API.utils import *
+from Career_API import controller
 from Career_API.controller import backend
 
 
 async def init_server():
     if utils.LOCK_OCTREE is None:
         utils.LOCK_OCTREE = aiorwlock.RWLock()
+    await run_sync(controller.OCTREE_STORE.load)()
+
+
+async def shutdown_server():
+    await run_sync(controller.OCTREE_STORE.close)()
+    controller.close_parse_cache()
 
 
 def create_app():
@@ -26,5 +34,6 @@ def create_app():
     app.register_blueprint(backend)
 
     app.before_serving(init_server)
+    app.after_serving(shutdown_server)
     app.run(host='0.0.0.0', port=2334)
 
@@ -13,6 +13,7 @@ import aiofiles
 from quart import Blueprint, jsonify, request, redirect, render_template, make_response, url_for
 from quart_cors import route_cors
 import uuid
+import threading
 from datetime import datetime
 import Career_Platform.career_platform as CP
 from Career_API import utils
@@ -24,6 +25,34 @@ backend = Blueprint('backend', __name__)
 # 开发环境样例数据路径
 SAMPLE_DATA_FOLDER = os.path.join(os.path.dirname(__file__), "../Career_Platform/demo/sample_data/")
 
+# 经历解析结果缓存, 同一段经历原文只需解析一次, 服务重启后仍然有效. 第一次使用时才创建, 见get_parse_cache
+PARSE_CACHE_PATH = os.path.join(os.path.dirname(__file__), "parse_cache.sqlite3")
+_parse_cache = None
+_parse_cache_lock = threading.Lock()
+
+# 常驻内存的OCTree, 每次分析的经历增量插入其中, 只将变化写入neo4j. 启动时读取一次快照(init_server),
+# 每次分析只追加日志, 定期及停止服务时保存快照(shutdown_server)
+OCTREE_STORE = CP.algorithm.network.OCTreeStore(snapshot_path=os.path.join(os.path.dirname(__file__), "octree_snapshot.pkl"))
+
+
+def get_parse_cache():
+    """
+    返回经历解析结果缓存, 第一次调用时打开SQLite文件并计算规则和模型文件的版本
+    """
+    global _parse_cache
+    with _parse_cache_lock:
+        if _parse_cache is None:
+            _parse_cache = CP.algorithm.exp_parser.ParseCache(db_path=PARSE_CACHE_PATH)
+        return _parse_cache
+
+
+def close_parse_cache():
+    global _parse_cache
+    with _parse_cache_lock:
+        if _parse_cache is not None:
+            _parse_cache.close()
+            _parse_cache = None
+
 ''' ----------Demo APIs---------- '''
 
 
@@ -60,9 +89,7 @@ async def resume_analysis():
                                         text_raw=t,
                                         person_uuid=pid)
                 )
-        list_of_experience = CP.algorithm.exp_parser.refine(list_of_experience)
-        list_of_experience = CP.algorithm.exp_parser.segment(list_of_experience)
-        list_of_experience = CP.algorithm.exp_parser.rebuild(list_of_experience)
+        list_of_experience = CP.algorithm.exp_parser.parse(list_of_experience, processes=1, cache=get_parse_cache())
         result = []
         for e in list_of_experience:
             result.append(e.text_token)
@@ -72,7 +99,8 @@ async def resume_analysis():
             CP.algorithm.network.octree(
                 exp_list=list_of_experience,
                 person_list=list_of_person,
-                export_json=False)
+                export_json=False,
+                store=OCTREE_STORE)
 
         return jsonify({'result': result})
 
@@ -0,0 +1,386 @@
+"""
+数据结构与解析流程(不含NER模型)的性能测试, 在Career_Platform目录下运行: python benchmark.py [测试名...]
+模型相关的测试见career_platform/algorithm/exp_parser/segment/ner/benchmark.py
+"""
+import os, sys
+import re
+import time
+import copy
+import random
+import tempfile
+import datetime
+import importlib
+import tracemalloc
+from typing import *
+import pandas as pd
+from career_platform.common import Experience, ExperienceTable, Person
+from career_platform.algorithm.exp_parser import rebuild, refine_strings
+from career_platform.algorithm.exp_parser.refine import refine as refine_module
+from career_platform.algorithm.exp_parser.rebuild.location_recover.location_recover import LocDetHelper, location_recover
+from career_platform.algorithm.network.utils import user_pair, coincident_interval
+from career_platform.algorithm.network.octree import CTree
+
+octree_module = importlib.import_module("career_platform.algorithm.network.octree")  # network.octree是octree函数
+
+USER_DATA_PATH = os.path.join(os.path.dirname(__file__), "career_platform/algorithm/exp_parser/segment/ner/data/user_data.csv")
+
+
+def load_experiences(n:int=100000) -> List[Experience]:
+    """
+    由NER标注数据构造n条各字段都已填充的Experience, 每5条中有一条带兼职, 模拟segment之后、rebuild之前的数据
+    """
+    df = pd.read_csv(USER_DATA_PATH, encoding="gbk", header=None)
+    # "总参O 三部S 四局S 见习 学员P" -> "总参O 三部S 四局S 见习学员P"
+    token_list = [" ".join(re.findall("[^LOSPU]*[LOSPU]", str(s).replace(" ", ""))) for s in df[0]]
+
+    exp_list = []
+    for i in range(n):
+        rawtoken = token_list[i % len(token_list)]
+        if i % 5 == 0:
+            rawtoken = rawtoken + "|" + token_list[(i * 7) % len(token_list)]
+        raw = re.sub("[LOSPU ]", "", rawtoken.replace("|", "，兼"))
+        exp_list.append(Experience(uuid="%032d" % i, ordernum=i % 20, person_uuid="%032d" % (i // 20),
+                                   text_raw=raw, text_rawrefine=raw, text_rawsplit=raw, text_rawtoken=rawtoken,
+                                   time_start=datetime.date(1990, 1, 1), time_end=datetime.date(1995, 3, 1)))
+    return exp_list
+
+
+def timeit(func:Callable, repeat:int=3) -> float:
+    """返回repeat次运行中最短的耗时(秒)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_copy(n:int=100000):
+    """refine/segment复制输入、rebuild拆分经历时的复制开销: copy.deepcopy与Experience.copy对比"""
+    exp_list = load_experiences(n)
+    LocDetHelper()      # 加载词典不计入耗时
+
+    t_deep = timeit(lambda: copy.deepcopy(exp_list))
+    t_copy = timeit(lambda: [exp.copy() for exp in exp_list])
+    print("复制{}条Experience: deepcopy {:.3f}s, Experience.copy {:.3f}s ({:.1f}x)".format(n, t_deep, t_copy, t_deep / t_copy))
+
+    t_rebuild = timeit(lambda: rebuild(exp_list), repeat=1)
+    print("rebuild {}条Experience: {:.3f}s".format(n, t_rebuild))
+
+
+def legacy_refine_string(text:str) -> Tuple[str, str]:
+    """原refine中逐条执行的清洗去噪->缩略词还原->兼职拆分标记(不含需要HanLP的职位词补全), 仅作为benchmark的对照"""
+    result = re.sub("[\n\t \u00A0\u0020\u3000]", "", text)
+    result = re.sub(r"\n", "", result)
+    result = re.sub("学习[,，、]+|学习$", lambda m:m.group().replace("学习","学生"), result)
+    result = re.sub("任教[,，、]+|任教$", lambda m:m.group().replace("任教","教师"), result)
+    result = re.sub("职务[,，、]+|职务$", "", result)
+    result = re.sub("获.*?学位", "", result)
+    result = re.sub("[,，/.。、]?主持.*?工作[的]?", "", result)
+    result = re.sub("[,，/.。、]?从事.*?工作", "", result)
+    result = re.sub("(工作)?[，,][历]?任", "", result)
+    result = re.sub(r"[\(（\[【][^\(（\[【]*?[\)）\]】]", "", result)
+    result = re.sub(r"[\(（\[【].*[\)）\]】]", "", result)
+    result = re.sub("[0-9]{4}.?[0-9]{0,2}[—-]?", "", result)
+    if result == "":
+        return None, None
+
+    result = result.replace("委会", "委员会").replace("市委", "市委员会").replace("区委", "区委员会").replace("省委", "省委员会") \
+        .replace("县委", "县委员会").replace("镇委", "镇委员会").replace("村委", "村委员会").replace("委员会员会", "委员会")
+    if result.startswith('市'):
+        result = '深圳' + result
+    if result.startswith('省'):
+        result = '广东' + result
+    result = re.sub("E?MBA", "管理学硕士", result)
+    if result == "":
+        return None, None
+
+    split = result.replace("兼职", "")
+    split = re.sub(r"[\.,，。、；;兼]+任?", "|", split)
+    split = re.sub(r"(\|)+", "|", split).strip("|")
+    return result, (split if split != "" else None)
+
+
+def bench_refine(n:int=100000, batch_size:int=256):
+    """refine规则部分的吞吐量: 原逐条执行的正则与refine_strings批量执行对比. 只取不含兼职的经历, 不调用HanLP"""
+    text_list = []
+    for i, exp in enumerate(load_experiences(n)):
+        text = exp.text_raw
+        if i % 7 == 0:
+            text = text + "（主持全面工作）"
+        if i % 3 == 0:
+            text = "1990.01-1992.03 " + text
+        if "兼" not in text:
+            text_list.append(text)
+
+    def batched():
+        return [r for i in range(0, len(text_list), batch_size) for r in refine_strings(text_list[i:i+batch_size])]
+    assert batched() == [legacy_refine_string(text) for text in text_list], "refine_strings与原规则的结果不一致"
+
+    t_legacy = timeit(lambda: [legacy_refine_string(text) for text in text_list])
+    t_batched = timeit(batched)
+    print("refine {}条经历原文: 逐条 {:.3f}s, refine_strings(batch_size={}) {:.3f}s ({:.1f}x)".format(
+        len(text_list), t_legacy, batch_size, t_batched, t_legacy / t_batched))
+
+
+def bench_hanlp(n:int=100000, batch_size:int=256):
+    """adjunct_mark中HanLP分词的缓存命中情况: 对含兼职的经历原文, 分别在缓存为空和已预热时执行refine_strings"""
+    text_list = [exp.text_raw for exp in load_experiences(n) if "兼" in exp.text_raw]
+
+    def batched():
+        return [r for i in range(0, len(text_list), batch_size) for r in refine_strings(text_list[i:i+batch_size])]
+
+    refine_module._hanlp_last_term_cache.clear()
+    t_cold = timeit(batched, repeat=1)
+    cold_info = refine_module.hanlp_cache_info()
+    t_warm = timeit(batched, repeat=1)
+    print("refine {}条含兼职的经历原文: 缓存为空 {:.3f}s, 已预热 {:.3f}s, 批量分词接口{}".format(
+        len(text_list), t_cold, t_warm, "可用" if refine_module._HANLP_SEGMENT is not None else "不可用"))
+    print("首次执行的缓存情况: {}".format(cold_info))
+
+
+def bench_location(n:int=100000):
+    """Location补齐的吞吐量: 对每条经历的每个兼职子串执行location_recover"""
+    token_list = [split for exp in load_experiences(n) for split in exp.text_rawtoken.split("|")]
+    LocDetHelper()      # 加载词典不计入耗时
+
+    t_loc = timeit(lambda: [location_recover(token) for token in token_list])
+    print("location_recover {}个token字符串: {:.3f}s".format(len(token_list), t_loc))
+
+    info_before = LocDetHelper.nosuffix_info()
+    for token in token_list:
+        location_recover(token)
+    info_after = LocDetHelper.nosuffix_info()
+    hits, misses = info_after["hits"] - info_before["hits"], info_after["misses"] - info_before["misses"]
+    print("remove_loc_suffix每1万条经历: 查词典 {:.0f}次, 回退到正则 {:.0f}次 (词典大小{})".format(
+        hits * 10000 / n, misses * 10000 / n, info_after["size"]))
+
+
+def traced_memory(func:Callable) -> Tuple[Any, int]:
+    """返回func的返回值, 以及返回值仍占用的内存(字节)"""
+    tracemalloc.start()
+    result = func()
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, mem
+
+
+def bench_objects(n:int=1000000):
+    """Experience和Person的内存占用、构造、复制和attr2dict的耗时, 模拟为重建OCTree加载整个exp表"""
+    kwargs_list = [exp.attr2dict() for exp in load_experiences(min(n, 100000))]
+    kwargs_list = [kwargs_list[i % len(kwargs_list)] for i in range(n)]
+
+    t_init = timeit(lambda: [Experience(**kwargs) for kwargs in kwargs_list], repeat=1)
+    exp_list, mem = traced_memory(lambda: [Experience(**kwargs) for kwargs in kwargs_list])
+    print("构造{}条Experience: {:.3f}s, 占用{:.1f}MB (字段的字符串和日期与kwargs共享, 不计入)".format(n, t_init, mem / 2**20))
+    t_copy = timeit(lambda: [exp.copy() for exp in exp_list], repeat=1)
+    t_dict = timeit(lambda: [exp.attr2dict() for exp in exp_list], repeat=1)
+    print("Experience.copy {:.3f}s, attr2dict {:.3f}s".format(t_copy, t_dict))
+    del exp_list
+
+    n_person = n // 20
+    person_kwargs = dict(uuid="0" * 32, name="张三", name_pinyin="ZS", gender="1", minzu="汉族", origo="广东深圳", cur_position="主任",
+                         time_birth=datetime.date(1970, 1, 1), time_startwork=datetime.date(1990, 7, 1))
+    t_init = timeit(lambda: [Person(**person_kwargs) for _ in range(n_person)], repeat=1)
+    person_list, mem = traced_memory(lambda: [Person(**person_kwargs) for _ in range(n_person)])
+    print("构造{}个Person: {:.3f}s, 占用{:.1f}MB".format(n_person, t_init, mem / 2**20))
+
+    # 姓名拼音首字母: 数据库中没有保存拼音时, 构造时不再计算, 第一次访问时才计算, 重复的字和姓名命中缓存
+    surnames, given = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗", "伟芳娜敏静丽强磊军洋勇艳杰涛明超秀霞平刚桂英华建国"
+    name_list = [surnames[i % len(surnames)] + given[(i * 7) % len(given)] + given[(i * 13) % len(given)][:i % 2] for i in range(n_person)]
+    t_init = timeit(lambda: [Person(uuid="0" * 32, name=name) for name in name_list], repeat=1)
+    person_list = [Person(uuid="0" * 32, name=name) for name in name_list]
+    t_pinyin = timeit(lambda: [person.name_pinyin for person in person_list], repeat=1)
+    print("构造{}个只有姓名的Person: {:.3f}s, 首次访问name_pinyin: {:.3f}s".format(n_person, t_init, t_pinyin))
+
+
+def bench_table(n:int=1000000):
+    """ExperienceTable与Experience列表对比: 由数据库查询结果构造(同CareerDBExperienceMapper.getAll)、内存占用、按人员和时间排序(同store_user_resume_nodes)"""
+    attrs = list(ExperienceTable.ATTRS)
+    base_rows = [tuple(getattr(exp, attr) for attr in attrs) for exp in load_experiences(min(n, 100000))]
+    rows = [base_rows[i % len(base_rows)] for i in range(n)]
+
+    t_list = timeit(lambda: [Experience(**dict(zip(attrs, row))) for row in rows], repeat=1)
+    t_table = timeit(lambda: ExperienceTable.from_rows(rows, attrs), repeat=1)
+    exp_list, mem_list = traced_memory(lambda: [Experience(**dict(zip(attrs, row))) for row in rows])
+    table, mem_table = traced_memory(lambda: ExperienceTable.from_rows(rows, attrs))
+    print("由{}行查询结果构造: Experience列表 {:.3f}s {:.1f}MB, ExperienceTable {:.3f}s {:.1f}MB".format(
+        n, t_list, mem_list / 2**20, t_table, mem_table / 2**20))
+
+    def sort_list():
+        exp_list_sorted = sorted(exp_list, key=lambda x:datetime.date.min if x.time_start is None else x.time_start)
+        return sorted(exp_list_sorted, key=lambda x:"0" if x.person_uuid is None else x.person_uuid)
+    t_sort_list = timeit(sort_list, repeat=1)
+    t_sort_table = timeit(lambda: table.sort_by("person_uuid", "time_start"), repeat=1)
+    t_month_list = timeit(lambda: [exp.duration() for exp in exp_list], repeat=1)
+    t_month_table = timeit(lambda: table.durations(), repeat=1)
+    print("按(person_uuid, time_start)排序: 列表 {:.3f}s, ExperienceTable {:.3f}s".format(t_sort_list, t_sort_table))
+    print("经历持续月数: 逐条duration() {:.3f}s, ExperienceTable.durations() {:.3f}s".format(t_month_list, t_month_table))
+
+
+def legacy_user_pair(resume_la, resume_lb, start, end) -> List[Tuple]:
+    """原user_pair中逐对调用coincident_interval的实现, 仅作为benchmark的对照"""
+    results = []
+    for eid_a, uid_a, interval_as, interval_ae in resume_la:
+        for eid_b, uid_b, interval_bs, interval_be in resume_lb:
+            co_period = coincident_interval((interval_as, interval_ae), (interval_bs, interval_be), min_year=start, max_year=end)
+            if uid_a != uid_b and co_period != []:
+                results.append((eid_a, eid_b, co_period))
+    return results
+
+
+def bench_pairs(n:int=2000):
+    """构建社会关系网络时同一节点下经历两两求重合区间(同Neo4jAdapter.compute_csn): 逐对比较与user_pair对比"""
+    # 起止时间在1970~2021年间按下标错开, 每人20条经历
+    resumes = [("%032d+1" % i, "%032d" % (i // 20), "%d.%02d" % (1970 + i * 7 % 45, i % 12 + 1), "%d.%02d" % (1975 + i * 7 % 45 + i % 3, (i * 5) % 12 + 1))
+               for i in range(n)]
+    pairs = user_pair(resumes, resumes, 1949, 2022)
+    assert pairs == legacy_user_pair(resumes, resumes, 1949, 2022)
+    t_legacy = timeit(lambda: legacy_user_pair(resumes, resumes, 1949, 2022), repeat=1)
+    t_numpy = timeit(lambda: user_pair(resumes, resumes, 1949, 2022), repeat=1)
+    print("{}条经历两两比较({}对重合): 逐对 {:.3f}s, user_pair {:.3f}s".format(len(resumes), len(pairs), t_legacy, t_numpy))
+
+
+def synthetic_token_corpus(n:int, seed:int=0) -> List[str]:
+    """
+    n条与segment输出格式相同的text_token: 七成以"深圳市L"开头, 其余以300个地名之一开头,
+    其后为400个机构、50个部门、30个职位中的若干个, 根结点和"深圳市L"下的子结点数都在数百个
+    """
+    rng = random.Random(seed)
+    places = ["地名{}L".format(i) for i in range(300)]
+    orgs = ["机构{}O".format(i) for i in range(400)]
+    depts = ["部门{}S".format(i) for i in range(50)]
+    posts = ["职位{}P".format(i) for i in range(30)]
+    corpus = []
+    for _ in range(n):
+        tokens = ["深圳市L" if rng.random() < 0.7 else rng.choice(places), rng.choice(orgs)]
+        if rng.random() < 0.6:
+            tokens.append(rng.choice(depts))
+        tokens.append(rng.choice(posts))
+        corpus.append(" ".join(tokens))
+    return corpus
+
+
+def insert_corpus(tree:CTree, corpus:List[str]) -> CTree:
+    """与CTree.build_tree相同的插入循环, 不写出nid2resumes.json"""
+    for i, tokens in enumerate(corpus):
+        exp_id = "%032d+1" % i
+        tree.exp_nid[exp_id] = tree._add_sequence(resume_info=(exp_id, "%032d" % (i // 20), "1990.01", "1995.03"), tokens=tokens)
+    tree.alive_num = len(tree)
+    return tree
+
+
+def synthetic_resumes(n:int, seeds:Iterable[int]) -> List[List[Experience]]:
+    """
+    在n条经历(id为0到n-1)上增量插入的简历, 每个seed一份, 每份10条经历, 其中5条与已有的经历同id(移动到新的路径)
+    """
+    resumes = []
+    for seed in seeds:
+        resume = [Experience(uuid="%032d" % (n + 10 * seed + i), splitnum=1, person_uuid="%032d" % (n + seed),
+                             text=tokens.replace(" ", ""), text_token=tokens,
+                             time_start=datetime.date(2001, 3, 1), time_end=datetime.date(2004, 6, 1))
+                  for i, tokens in enumerate(synthetic_token_corpus(10, seed=seed))]
+        for exp in resume[5:]:
+            exp.uuid = "%032d" % random.randrange(n)
+        resumes.append(resume)
+    return resumes
+
+
+def bench_octree(n:int=1000000):
+    """
+    OCTree插入的吞吐量和内存占用(含resume_record等记录), record_node_interval的耗时,
+    以及在建好的树上增量插入简历(每份10条经历, 其中5条修改已有经历)、保存和读取快照、压缩的耗时
+    """
+    corpus = synthetic_token_corpus(n)
+    t_insert = timeit(lambda: insert_corpus(CTree(), corpus), repeat=1)
+    tree, mem = traced_memory(lambda: insert_corpus(CTree(), corpus))
+    print("插入{}条经历: {:.3f}s ({:.0f}条/s), {}个结点, 内存 {:.1f}MB".format(n, t_insert, n / t_insert, len(tree), mem / 2**20))
+    t_interval = timeit(tree.record_node_interval, repeat=1)
+    print("record_node_interval: {:.3f}s".format(t_interval))
+
+    tree.record_node_interval()
+    resumes = synthetic_resumes(n, seeds=(1, 2))
+    # 第一次增量插入需要建立子结点的索引, 之后的插入只在受影响的路径上进行
+    t_first = timeit(lambda: tree.build_tree(resumes[0], init=False), repeat=1)
+    t_delta = timeit(lambda: tree.build_tree(resumes[1], init=False), repeat=1)
+    snapshot_path = os.path.join(tempfile.mkdtemp(), "octree_snapshot.pkl")
+    t_save = timeit(lambda: tree.save_tree(snapshot_path), repeat=1)
+    t_load = timeit(lambda: CTree.load_tree(snapshot_path), repeat=1)
+    print("增量插入{}条经历: 首次 {:.4f}s, 之后 {:.4f}s; 快照{:.1f}MB, 保存 {:.3f}s, 读取 {:.3f}s".format(
+        len(resumes[1]), t_first, t_delta, os.path.getsize(snapshot_path) / 2**20, t_save, t_load))
+    os.remove(snapshot_path)
+    dead_num = tree.dead_num()
+    t_compact = timeit(tree.compact, repeat=1)
+    print("compact({}个结点中{}个死结点): {:.3f}s".format(len(tree), dead_num, t_compact))
+
+
+def bench_json(n:int=200000):
+    """tree_to_json导出"深圳市L"子树的耗时, 所有结点归为同一类(不经过get_classmap)"""
+    tree = insert_corpus(CTree(), synthetic_token_corpus(n))
+    tree.record_node_interval()
+    tree.uid_userName_map = {}
+    tree.rank_record = {exp_id: {"null": 62} for exp_id in tree.exp_nid}
+    class_map_all = dict.fromkeys(range(len(tree)), 1)
+    t_json = timeit(lambda: tree.tree_to_json(tree.shenzhen_nid, {}, {}, {}, [], class_map_all), repeat=1)
+    print("{}条经历, {}个结点导出json: {:.3f}s".format(n, len(tree), t_json))
+
+
+def bench_csn(n:int=100000):
+    """
+    需要neo4j_config中的neo4j, 会清空其中的数据, 只在指定时运行: python benchmark.py csn
+    由n条经历重新建树并计算社会关系网络(tree_to_neo4j + compute_csn)的耗时, 以及之后每份简历(同bench_octree)
+    增量插入(build_tree + apply_delta + compute_csn(delta=...))的耗时
+    """
+    rng = random.Random(0)
+    exp_list = []
+    for i, tokens in enumerate(synthetic_token_corpus(n)):
+        year = rng.randint(1990, 2015)
+        exp_list.append(Experience(uuid="%032d" % i, splitnum=1, person_uuid="%032d" % (i // 20),
+                                   text=tokens.replace(" ", ""), text_token=tokens,
+                                   adminrank=rng.choice([None, "正处级", "副处级"]), time_start=datetime.date(year, 1, 1),
+                                   time_end=datetime.date(year + rng.randint(1, 8), 1, 1)))
+    octree_module.data_path = tempfile.mkdtemp()    # build_tree(init=True)写出的nid2resumes.json
+    os.mkdir(os.path.join(octree_module.data_path, "temp"))
+    adapter = octree_module.Neo4jAdapter()
+    tree = CTree()
+    end = float(datetime.date.today().strftime("%Y.%m"))
+
+    def build():
+        adapter.tree_to_neo4j(tree.build_tree(exp_list), tree.interval_dict, init=True)
+        adapter.compute_csn(tree, exp_list, {}, start=1960, end=end)
+    t_build = timeit(build, repeat=1)
+    print("{}条经历重新建树并计算社会关系网络: {:.3f}s".format(n, t_build))
+
+    # 第一次增量插入需要建立子结点的索引
+    for resume in synthetic_resumes(n, seeds=(1, 2, 3)):
+        start_time = time.perf_counter()
+        delta = tree.build_tree(resume, init=False)
+        t_tree = time.perf_counter() - start_time
+        t_apply = timeit(lambda: adapter.apply_delta(delta, tree.interval_dict), repeat=1)
+        t_csn = timeit(lambda: adapter.compute_csn(tree, resume, {}, start=1960, end=end, delta=delta), repeat=1)
+        print("增量插入{}条经历({}个受影响的叶结点): build_tree {:.4f}s, apply_delta {:.3f}s, compute_csn {:.3f}s".format(
+            len(resume), len(adapter._touched_leaves(tree, delta)), t_tree, t_apply, t_csn))
+
+
+BENCHMARKS = {
+    "copy": bench_copy,
+    "refine": bench_refine,
+    "hanlp": bench_hanlp,
+    "location": bench_location,
+    "objects": bench_objects,
+    "table": bench_table,
+    "pairs": bench_pairs,
+    "octree": bench_octree,
+    "json": bench_json,
+}
+
+
+# 需要数据库的测试, 不在默认运行的测试中
+NEO4J_BENCHMARKS = {
+    "csn": bench_csn,
+}
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or BENCHMARKS.keys()):
+        {**BENCHMARKS, **NEO4J_BENCHMARKS}[name]()
@@ -4,4 +4,9 @@ from .segment.segment import *
 
 from .rebuild.rebuild import *
 
-__all__ = ["refine", "segment", "rebuild"]
\ No newline at end of file
+from .pipeline import *
+
+from .cache import *
+
+__all__ = ["refine", "segment", "rebuild", "parse",
+           "refine_iter", "segment_iter", "rebuild_iter", "refine_strings", "hanlp_cache_info", "ParseCache"]
\ No newline at end of file
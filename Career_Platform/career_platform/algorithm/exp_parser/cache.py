@@ -0,0 +1,187 @@
+import os
+import glob
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import *
+
+from ...common import Experience
+from ..utils import LRUCache, file_digest
+from .segment.segment import BCTokenizer
+
+__all__ = ["ParseCache"]   # 只对外暴露ParseCache类
+
+PARSE_CACHE_VERSION = "1"   # 解析规则版本号. HanLP词典等未纳入下面摘要的依赖发生变化时需要手动加1
+PARSE_CACHE_SIZE = 100000   # 进程内LRU缓存的容量
+SQLITE_BATCH_SIZE = 500     # 每次从SQLite中查询的键数量, 不超过SQLite对参数个数的限制
+
+_EXP_PARSER_DIR = os.path.dirname(__file__)
+# 决定解析结果的源文件和数据文件, 其中任何一个发生变化, 缓存中的旧结果都不会再被命中
+RULE_FILES = [
+    os.path.join(_EXP_PARSER_DIR, "refine/refine.py"),
+    os.path.join(_EXP_PARSER_DIR, "segment/segment.py"),
+    os.path.join(_EXP_PARSER_DIR, "rebuild/rebuild.py"),
+    os.path.join(_EXP_PARSER_DIR, "rebuild/location_recover/location_recover.py"),
+    os.path.join(_EXP_PARSER_DIR, "rebuild/location_recover/loc.json"),
+] + sorted(glob.glob(os.path.join(_EXP_PARSER_DIR, "rebuild/location_recover/*.csv")))
+
+
+class ParseCache():
+    """
+    exp_parser解析结果的缓存. 履历中大量经历原文是重复的(如"深圳市福田区人民政府副区长"), 命中缓存的经历不需要再经过refine、NER和Location补齐.
+
+    键为 sha1(版本 + text_raw), 版本由PARSE_CACHE_VERSION、RULE_FILES和BCTokenizer所用模型文件的摘要以及是否量化共同决定,
+    规则或模型更新后旧结果自然失效. exp_parser.parse每次调用前通过refresh_version()检查这些文件的修改时间和大小, 有变化时重新计算版本.
+    值为refine->segment->rebuild之后的text_rawrefine, text_rawsplit, text_rawtoken, 以及重建得到的每一个Experience的text和text_token.
+
+    两级缓存: 进程内的LRUCache, 以及db_path不为None时的SQLite文件. 使用方法见exp_parser.parse的cache参数
+
+    Functions:
+        refresh_version(): 源文件有变化时重新计算版本
+        key(): 计算text_raw对应的键
+        get_many(): 批量查询
+        put_many(): 批量写入
+        make_entry(): 由一条经历的重建结果生成缓存项
+        apply(): 将缓存项应用到一条经历上, 返回重建结果
+        info(): 返回各级缓存的命中情况
+    """
+    def __init__(self, db_path:str=None, maxsize:int=PARSE_CACHE_SIZE, quantize:bool=False):
+        """
+        Params:
+            db_path: SQLite文件路径, 为None时只使用进程内缓存
+            maxsize: 进程内LRU缓存的容量
+            quantize: 缓存的是否为量化模型的解析结果, 需与调用parse时的quantize一致
+        """
+        self.quantize = quantize
+        self.version = None
+        self.__sources_stat = None   # 计算version时各源文件的(路径, 修改时间, 大小)
+        self.refresh_version()
+        self.db_hits = 0
+        self.db_misses = 0
+
+        self.__lru = LRUCache(maxsize)
+        self.__conn = None
+        self.__lock = threading.Lock()     # 进程内缓存、SQLite连接和命中计数可能被多个线程共享(如API服务中的run_sync)
+        if db_path is not None:
+            self.__conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.__conn.commit()
+
+    def refresh_version(self) -> str:
+        """
+        RULE_FILES和模型文件的修改时间或大小与上次计算版本时不同(包括BCTokenizer改用了其他模型文件)时重新计算版本, 返回当前版本
+        """
+        paths = RULE_FILES + BCTokenizer.model_paths(quantize=self.quantize)
+        sources_stat = [(path, self.__stat(path)) for path in paths]
+        if sources_stat != self.__sources_stat:
+            sha1 = hashlib.sha1(PARSE_CACHE_VERSION.encode("utf-8"))
+            for path in paths:
+                sha1.update(file_digest(path).encode("utf-8"))
+            sha1.update(b"quantize" if self.quantize else b"fp32")
+            self.version = sha1.hexdigest()
+            self.__sources_stat = sources_stat
+        return self.version
+
+    @staticmethod
+    def __stat(path:str) -> Tuple[float, int] or None:
+        """
+        返回文件的(修改时间, 大小), 与file_digest缓存摘要所用的相同. 文件不存在时返回None
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    def key(self, text_raw:str) -> str:
+        """
+        计算text_raw对应的缓存键
+        """
+        return hashlib.sha1((self.version + "\n" + text_raw).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys:Iterable[str]) -> Dict[str, Dict]:
+        """
+        批量查询, 返回命中的 键 -> 缓存项. 先查进程内缓存, 未命中的再查SQLite, SQLite中命中的会写入进程内缓存
+        """
+        result:Dict[str, Dict] = {}
+        miss_list:List[str] = []
+        with self.__lock:
+            for key in dict.fromkeys(keys):
+                entry = self.__lru.get(key)
+                if entry is None:
+                    miss_list.append(key)
+                else:
+                    result[key] = entry
+
+            if self.__conn is not None and len(miss_list) > 0:
+                for i in range(0, len(miss_list), SQLITE_BATCH_SIZE):
+                    batch = miss_list[i:i+SQLITE_BATCH_SIZE]
+                    sql = "SELECT key, value FROM parse_cache WHERE key IN ({})".format(",".join(["?"] * len(batch)))
+                    for key, value in self.__conn.execute(sql, batch):
+                        entry = json.loads(value)
+                        result[key] = entry
+                        self.__lru.put(key, entry)
+                db_hits = sum(1 for key in miss_list if key in result)
+                self.db_hits += db_hits
+                self.db_misses += len(miss_list) - db_hits
+
+        return result
+
+    def put_many(self, entries:Dict[str, Dict]):
+        """
+        批量写入 键 -> 缓存项
+        """
+        with self.__lock:
+            for key, entry in entries.items():
+                self.__lru.put(key, entry)
+            if self.__conn is not None and len(entries) > 0:
+                self.__conn.executemany("INSERT OR REPLACE INTO parse_cache (key, value) VALUES (?, ?)",
+                                        [(key, json.dumps(entry, ensure_ascii=False)) for key, entry in entries.items()])
+                self.__conn.commit()
+
+    @staticmethod
+    def make_entry(rebuilt_list:List[Experience]) -> Dict or None:
+        """
+        由一条经历重建得到的全部Experience(splitnum依次为1, 2, ...)生成缓存项.
+
+        text_rawsplit为None时segment不会修改text_rawtoken, 解析结果取决于经历原有的text_rawtoken而不只是text_raw, 这种情况不缓存, 返回None
+        """
+        exp = rebuilt_list[0]
+        if exp.text_rawsplit is None:
+            return None
+        return {
+            "text_rawrefine": exp.text_rawrefine,
+            "text_rawsplit": exp.text_rawsplit,
+            "text_rawtoken": exp.text_rawtoken,
+            "splits": [[e.text, e.text_token] for e in rebuilt_list],
+        }
+
+    @staticmethod
+    def apply(exp:Experience, entry:Dict) -> List[Experience]:
+        """
+        将缓存项应用到一条splitnum为0的经历上, 返回与对它执行refine->segment->rebuild相同的结果. 不会修改exp
+        """
+        result:List[Experience] = []
+        for idx, (text, text_token) in enumerate(entry["splits"]):
+            new_exp = exp.copy()
+            new_exp.text_rawrefine = entry["text_rawrefine"]
+            new_exp.text_rawsplit = entry["text_rawsplit"]
+            new_exp.text_rawtoken = entry["text_rawtoken"]
+            new_exp.splitnum = idx+1
+            new_exp.text = text
+            new_exp.text_token = text_token
+            result.append(new_exp)
+        return result
+
+    def info(self) -> Dict[str, Any]:
+        """
+        返回进程内缓存的命中情况, 以及SQLite的命中和未命中次数
+        """
+        return {"version": self.version, "lru": self.__lru.info(), "db_hits": self.db_hits, "db_misses": self.db_misses}
+
+    def close(self):
+        with self.__lock:
+            if self.__conn is not None:
+                self.__conn.close()
+                self.__conn = None
+
@@ -0,0 +1,174 @@
+import os
+import functools
+import multiprocessing
+from collections import deque
+from itertools import islice
+from typing import *
+import torch
+
+from ...common import Experience
+from .refine.refine import refine
+from .segment.segment import segment, BCTokenizer
+from .rebuild.rebuild import rebuild
+from .rebuild.location_recover.location_recover import LocDetHelper
+from .cache import ParseCache
+
+__all__ = ["parse"]   # 只对外暴露parse函数
+
+PIPELINE_CHUNK_SIZE = 256   # 每次交给一个进程处理的Experience数量
+
+
+def parse(exp_list:Iterable[Experience], processes:int=None, chunk_size:int=PIPELINE_CHUNK_SIZE, callback:Callable=None, quantize:bool=False,
+          cache:ParseCache=None) -> List[Experience]:
+    """
+    对经历进行完整的解析: refine->segment->rebuild, 结果与依次调用三者相同.
+
+    exp_list会被切分为不超过chunk_size的块, 分发到进程池中的各个进程并行解析, 结果按输入顺序拼接.
+    每个进程在启动时加载一次HanLP、LocDetHelper的词典和BiLSTM模型, 之后处理的所有块都复用它们.
+
+    Params:
+        exp_list: 传入的经历, 可以是任意可迭代对象. 传入的Experience不会被修改
+        processes: 进程数, 默认为CPU核数. 为1时不创建进程池, 直接在当前进程中解析
+        chunk_size: 每块的Experience数量
+        callback: 回调函数, 需要能够接收一个包含函数执行状态信息的dict, 可以用来查看执行进度
+        quantize: 是否使用动态int8量化的模型进行segment, 见segment
+        cache: 解析结果缓存. 不为None时text_raw已被缓存的经历直接由缓存得到结果, 只有其余经历进入解析流程(相同的text_raw只解析一次), 新的结果写入缓存
+
+    Returns:
+        重建后的Experience列表, 长度可能比exp_list长, 见rebuild
+    """
+    if cache is not None:
+        if cache.quantize != quantize:
+            raise ValueError("cache.quantize与quantize不一致, 缓存的结果与本次使用的模型不对应")
+        return _parse_cached(list(exp_list), cache, processes=processes, chunk_size=chunk_size, callback=callback, quantize=quantize)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # 用于传入callback的状态字典
+    __status_dict = {
+        "description": "[exp_parser]-parse",
+        "total": len(exp_list) if isinstance(exp_list, Sized) else None,
+        "iternum": 0
+    }
+
+    # 记录已经切分出的每一块的大小, 进程池按顺序返回结果, 每返回一块就取出对应的大小来更新进度
+    chunk_sizes:Deque[int] = deque()
+    chunks = _chunked(exp_list, chunk_size, chunk_sizes)
+    result:List[Experience] = []
+
+    if processes == 1:
+        parsed_iter = map(functools.partial(_parse_chunk, in_position=False, quantize=quantize), chunks)
+        for parsed in parsed_iter:
+            result.extend(parsed)
+            __status_dict["iternum"] += chunk_sizes.popleft()
+            if callback is not None:
+                callback(__status_dict)
+        return result
+
+    # 各进程中的Experience都是反序列化得到的副本, 可以原地修改. HanLP所在的JVM和torch都不能安全地fork, 因此使用spawn
+    worker = functools.partial(_parse_chunk, in_position=True, quantize=quantize)
+    with multiprocessing.get_context("spawn").Pool(processes, initializer=_init_worker, initargs=(quantize, )) as pool:
+        for parsed in pool.imap(worker, chunks):
+            result.extend(parsed)
+            __status_dict["iternum"] += chunk_sizes.popleft()
+            if callback is not None:
+                callback(__status_dict)
+
+    return result
+
+
+def _parse_cached(exp_list:List[Experience], cache:ParseCache, **parse_kwargs) -> List[Experience]:
+    """
+    带缓存的parse, 结果与不带缓存时相同
+    """
+    # 规则或模型文件有变化时更新版本, 之后的键都不会再命中旧结果
+    cache.refresh_version()
+    # rebuild会跳过splitnum不为0的经历, 它们没有解析结果; text_raw为None的经历不参与缓存
+    key_list = [cache.key(exp.text_raw) if exp.splitnum == 0 and exp.text_raw is not None else None for exp in exp_list]
+    entry_dict = cache.get_many(key for key in key_list if key is not None)
+
+    # 需要解析的经历: 缓存中没有的text_raw各取第一条经历, 以及不参与缓存的经历
+    todo_dict:Dict[int, str] = {}      # 需要解析的经历在exp_list中的下标 -> 键
+    first_idx_dict:Dict[str, int] = {}    # 键 -> 第一条该键的经历在exp_list中的下标
+    for idx, (exp, key) in enumerate(zip(exp_list, key_list)):
+        if exp.splitnum != 0:
+            continue
+        if key is None:
+            todo_dict[idx] = None
+        elif key not in entry_dict and key not in first_idx_dict:
+            first_idx_dict[key] = idx
+            todo_dict[idx] = key
+
+    parsed_dict = _parse_groups(exp_list, list(todo_dict.keys()), parse_kwargs)
+    new_entries:Dict[str, Dict] = {}
+    for idx, key in todo_dict.items():
+        if key is not None:
+            entry = ParseCache.make_entry(parsed_dict[idx])
+            if entry is not None:
+                new_entries[key] = entry
+                entry_dict[key] = entry
+    cache.put_many(new_entries)
+
+    # 与第一条经历text_raw相同却无法缓存的经历(见ParseCache.make_entry), 结果取决于经历本身, 需要单独解析
+    uncacheable_list = [idx for idx, key in enumerate(key_list)
+                        if key is not None and key not in entry_dict and first_idx_dict.get(key) != idx]
+    parsed_dict.update(_parse_groups(exp_list, uncacheable_list, parse_kwargs))
+
+    result:List[Experience] = []
+    for idx, (exp, key) in enumerate(zip(exp_list, key_list)):
+        if idx in parsed_dict:
+            result.extend(parsed_dict[idx])
+        elif key is not None:
+            result.extend(ParseCache.apply(exp, entry_dict[key]))
+    return result
+
+
+def _parse_groups(exp_list:List[Experience], idx_list:List[int], parse_kwargs:Dict) -> Dict[int, List[Experience]]:
+    """
+    解析exp_list中下标为idx_list的经历(splitnum均为0), 返回 下标 -> 该经历重建得到的Experience列表
+    """
+    if len(idx_list) == 0:
+        return {}
+    parsed_list = parse([exp_list[idx] for idx in idx_list], **parse_kwargs)
+
+    # 每条经历都会被重建为splitnum从1开始的一个或多个Experience, 按splitnum为1的位置切分
+    group_list:List[List[Experience]] = []
+    for exp in parsed_list:
+        if exp.splitnum == 1:
+            group_list.append([])
+        group_list[-1].append(exp)
+    return dict(zip(idx_list, group_list))
+
+
+def _chunked(exp_iter:Iterable[Experience], chunk_size:int, chunk_sizes:Deque[int]) -> Iterator[List[Experience]]:
+    """
+    将经历切分为不超过chunk_size的块, 并将每块的大小依次记录到chunk_sizes
+    """
+    exp_iter = iter(exp_iter)
+    while True:
+        chunk = list(islice(exp_iter, chunk_size))
+        if len(chunk) == 0:
+            return
+        chunk_sizes.append(len(chunk))
+        yield chunk
+
+
+def _init_worker(quantize:bool=False):
+    """
+    进程初始化: 加载各阶段用到的全局单例资源, 并限制torch只使用一个线程以免多个进程之间争抢CPU.
+    HanLP在导入refine时已随JVM一起加载; jieba在refine中未被实际调用, 不需要初始化
+    """
+    torch.set_num_threads(1)
+    LocDetHelper()
+    BCTokenizer(quantize=quantize)
+
+
+def _parse_chunk(exp_list:List[Experience], in_position:bool=False, quantize:bool=False) -> List[Experience]:
+    """
+    对一块经历依次进行refine->segment->rebuild
+    """
+    exp_list = refine(exp_list, in_position=in_position)
+    exp_list = segment(exp_list, in_position=True, quantize=quantize)
+    return rebuild(exp_list)
+
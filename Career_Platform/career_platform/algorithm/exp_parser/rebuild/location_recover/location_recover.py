@@ -1,14 +1,23 @@
 import os,sys
+import gc
 import json
+import pickle
+import hashlib
 import ahocorasick
 from typing import *
 import numpy as np
 import re
+from ....utils import file_digest
 __all__ = ["location_recover"]
 
 
 DATA_DIR = os.path.dirname(__file__)
 
+SNAPSHOT_PATH = DATA_DIR + "/loc_snapshot.pkl"    # LocDetHelper词典和AC自动机的快照, 首次初始化时自动生成
+SNAPSHOT_VERSION = "1"      # 快照格式版本号, 快照中保存的内容发生变化时加1
+# 快照对应的源文件, 其中任何一个发生变化快照都会失效并被重新生成
+SNAPSHOT_SOURCES = [__file__, DATA_DIR + "/loc.json", DATA_DIR + "/全国普通高等学校名单_2021.csv"]
+
 def location_recover(token:str) -> str:
     """
     将输入的token字符串中地点L标签补齐, 返回补齐后的token字符串. 
@@ -29,7 +38,6 @@ def location_recover(token:str) -> str:
     full_text = "".join([token[0:-1] for token in token_list])
     
     L_tokens = [token[0:-1] for token in token_list if token[-1]=='L']
-    L_tokens_nosuffix = [helper.remove_loc_suffix(token) for token in L_tokens]
     L_text = "".join(L_tokens)
 
     O_tokens = [token[0:-1] for token in token_list if token[-1] in ['O', 'S']]
@@ -38,18 +46,40 @@ def location_recover(token:str) -> str:
 
     explicit_prov:List[str] = []
     explicit_city:List[Tuple[str, str]] = []
+    explicit_city_nosuffix:List[Tuple[str, str]] = []
     O_inferenced_city:List[Tuple[int, str, Tuple[str, str]]] = []
     L_inferenced_city:List[Tuple[str, str]] = []
+    L_inferenced_city_nosuffix:List[Tuple[str, str]] = []
+    L_is_dist:List[bool] = []   # 每个L token是否为区县级行政区
+
+    # 1. 在L tokens里检测显式给出的省份和市级行政区, 同时记下区县级的匹配供第4、6步使用.
+    # 每个token只去一次后缀, 有后缀和无后缀各查一次loc2pc_dict即可得到所有层级的结果
+    for L_token in L_tokens:
+        entry = helper.loc2pc_dict.get(L_token, LocDetHelper.EMPTY_ENTRY)
+        entry_nosuffix = helper.loc2pc_dict.get(helper.remove_loc_suffix(L_token), LocDetHelper.EMPTY_ENTRY)
+        prov, city_pc, _, dist_pcs, _ = entry
+        prov_nosuffix, _, city_pc_nosuffix, _, dist_pcs_nosuffix = entry_nosuffix
+        if prov:
+            explicit_prov.append(prov)
+        if prov_nosuffix:
+            explicit_prov.append(prov_nosuffix)
+        if city_pc:
+            explicit_city.append(city_pc)
+        if city_pc_nosuffix:
+            explicit_city_nosuffix.append(city_pc_nosuffix)
+        if dist_pcs:
+            L_inferenced_city.extend(dist_pcs)
+        if dist_pcs_nosuffix:
+            L_inferenced_city_nosuffix.extend(dist_pcs_nosuffix)
+        L_is_dist.append(bool(dist_pcs or dist_pcs_nosuffix))
+
+    # 有后缀的没检测出来才用去掉后缀的结果
+    if len(explicit_city) == 0:
+        explicit_city = explicit_city_nosuffix
+    if len(L_inferenced_city) == 0:
+        L_inferenced_city = L_inferenced_city_nosuffix
 
-    # 1. 在L tokens里检测显式给出的省份
-    for t in range(len(L_tokens)):
-        if helper.prov2p_dict.get(L_tokens[t], False):
-            explicit_prov.append(helper.prov2p_dict[L_tokens[t]])
-        if helper.prov2p_dict.get(L_tokens_nosuffix[t], False):
-            explicit_prov.append(helper.prov2p_dict[L_tokens_nosuffix[t]])
-
-    # 2. 在L tokens里检测显式给出的市级行政区
-    explicit_city.extend(helper.detect_by_city2pc_dict(L_tokens, L_tokens_nosuffix))
+    # 2. 再用市级行政区AC自动机在L tokens拼接的文本里检测
     explicit_city.extend([e[2] for e in helper.detect_by_city2pc_AC(L_text)])
 
     # 3. 如果没找到L中显式的省份和市级行政区，则尝试从O和S中找
@@ -58,9 +88,9 @@ def location_recover(token:str) -> str:
         O_inferenced_city.extend(helper.detect_by_city2pc_AC(O_text))
         O_inferenced_city.sort(key=lambda x:x[0])   # 按匹配的位置排序
 
-    # 4. 如果上述步骤都没有找到市级行政区，则尝试用L匹配区县一级，反推省市
-    if (len(explicit_city)==0)  and (len(O_inferenced_city)==0):
-        L_inferenced_city.extend(helper.detect_by_dist2pc_dict(L_tokens, L_tokens_nosuffix))
+    # 4. 如果上述步骤都没有找到市级行政区，则使用第1步中L匹配区县一级的结果，反推省市
+    if (len(explicit_city)!=0) or (len(O_inferenced_city)!=0):
+        L_inferenced_city = []
 
     # 5. 在所有检测出的结果中确定最终的(省, 市)
     prov, city = None, None
@@ -91,8 +121,8 @@ def location_recover(token:str) -> str:
     for i in range(len(token_list)):
         cur_token = token_list[i]
         if cur_token[-1] == 'L':
-            # 如果是区县一级的L就加入新的token_list_new
-            if helper.dist2pc_dict.get(cur_token[0:-1], False) or helper.dist2pc_dict_nosuffix.get(helper.remove_loc_suffix(cur_token[0:-1]), False):
+            # 如果是区县一级的L就加入新的token_list_new. 开头连续的L token依次就是L_tokens的前i个
+            if L_is_dist[i]:
                 token_list_new.append(cur_token)
         if cur_token[-1] != 'L':    # 第一次遇到不是L的就把之后的全拼进新的token_list_new, 然后跳出循环
             rest_list = token_list[i:]
@@ -115,9 +145,15 @@ class LocDetHelper():
         dist2pc_dict:             区县级行政区回查[省,市]词典, 有后缀
         dist2pc_dict_nosuffix:    区县级行政区回查[省,市]词典, 无后缀
         school2pc_dict:           高校名回查[省,市]词典, 有后缀
+        loc2pc_dict:              地名回查各层级结果的合并词典, 见EMPTY_ENTRY
+        nosuffix_dict:            地名回查无后缀地名的词典, 供remove_loc_suffix使用
+
+    首次实例化时优先从SNAPSHOT_PATH的快照中加载全部词典和AC自动机, 快照不存在或与源文件不一致时从源文件构建, 并重新生成快照
 
     Function:
+        build_snapshot(): 将已初始化的词典和AC自动机保存为快照
         remove_loc_suffix(): 去除地名里的后缀, 返回无后缀的地名
+        nosuffix_info(): 返回remove_loc_suffix查词典命中和回退到正则的次数
         detect_by_school2pc_AC(): 用高校AC自动机检测句子中的高校名, 以推断地点, 返回所有匹配位置和对应[省市]
         detect_by_city2pc_AC(): 用市级行政区AC自动机检测句子中的地名, 以推断地点, 返回所有匹配位置和对应[省市]
     """
@@ -131,22 +167,82 @@ class LocDetHelper():
     dist2pc_dict = None             # 区县级行政区回查[省,市]词典, 有后缀
     dist2pc_dict_nosuffix = None    # 区县级行政区回查[省,市]词典, 无后缀
     school2pc_dict = None           # 高校名回查[省,市]词典, 有后缀
+    nosuffix_dict = None            # loc.json中的地名及其去后缀的结果 -> 无后缀地名
+    loc2pc_dict = None              # 地名 -> (省名, 有后缀[省,市], 无后缀[省,市], 有后缀区县[省,市]列表, 无后缀区县[省,市]列表), 合并了上面五个行政区词典
+
+    EMPTY_ENTRY = (None, None, None, None, None)    # loc2pc_dict中没有的地名对应的结果
 
     city2pc_AC = None               # 市级行政区回查[省,市]AC自动机
     school2pc_AC = None             # 高校名回查[省,市]AC自动机, 用于对包含高校名的字符串进行多模匹配    
 
 
+    # 保存在快照中的类变量, loc_dict放在最后, 它不为None即表示初始化已完成
+    __SNAPSHOT_ATTRS = ["nosuffix_dict", "prov2p_dict", "city2pc_dict", "city2pc_dict_nosuffix", "dist2pc_dict", "dist2pc_dict_nosuffix",
+                        "school2pc_dict", "loc2pc_dict", "city2pc_AC", "school2pc_AC", "loc_dict"]
+
     def __init__(self):
         # 只需初次实例化时初始化各类变量, 之后就不用了
-        if self.loc_dict is None:
+        if self.loc_dict is None and not self.__load_snapshot():
             self.__init_loc_dict()
+            self.__init_nosuffix_dict()
             self.__init_prov2p_dict()
             self.__init_city2pc_dict()
             self.__init_dist2pc_dict()
             self.__init_school2pc_dict()
+            self.__init_loc2pc_dict()
 
             self.__init_school2pc_AC()
             self.__init_city2pc_AC()
+
+            try:
+                self.build_snapshot()
+            except OSError:     # 目录不可写时只是无法加速下次启动, 不影响使用
+                pass
+
+    @staticmethod
+    def snapshot_version() -> str:
+        """
+        快照版本: SNAPSHOT_VERSION和SNAPSHOT_SOURCES中各文件的摘要
+        """
+        sha1 = hashlib.sha1(SNAPSHOT_VERSION.encode("utf-8"))
+        for path in SNAPSHOT_SOURCES:
+            sha1.update(file_digest(path).encode("utf-8"))
+        return sha1.hexdigest()
+
+    @classmethod
+    def build_snapshot(cls, path:str=SNAPSHOT_PATH):
+        """
+        将已初始化的词典和AC自动机保存为快照. 先写入临时文件再替换, 多个进程同时生成快照时也不会读到不完整的文件
+        """
+        snapshot = {"version": cls.snapshot_version(), "attrs": {attr: getattr(cls, attr) for attr in cls.__SNAPSHOT_ATTRS}}
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def __load_snapshot(cls, path:str=SNAPSHOT_PATH) -> bool:
+        """
+        从快照加载全部词典和AC自动机, 快照不存在、已损坏或与源文件不一致时返回False
+        """
+        if not os.path.exists(path):
+            return False
+        # 反序列化会一次性创建几十万个对象, 期间频繁触发的分代GC占了绝大部分耗时, 因此暂时关闭GC
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if not isinstance(snapshot, dict) or snapshot.get("version") != cls.snapshot_version():
+            return False
+        for attr in cls.__SNAPSHOT_ATTRS:
+            setattr(cls, attr, snapshot["attrs"][attr])
+        return True
     
     def detect_by_city2pc_dict(self, tokens:str, tokens_nosuffix:str) -> List[Tuple[str, str]]:
         """
@@ -213,10 +309,34 @@ class LocDetHelper():
                     "(?:(?:{})族?){{0,4}}?自治[区州县旗]".format("|".join(["(?:{})".format(m) for m in __MINORS+["各"]]))]
     __RE_OBJ = re.compile("({})$".format("|".join(__LOC_SUFFIX)))
 
+    __nosuffix_hits = 0     # remove_loc_suffix在nosuffix_dict中命中的次数
+    __nosuffix_misses = 0   # remove_loc_suffix回退到正则的次数
+
     @classmethod
     def remove_loc_suffix(cls, loc_str:str) -> str:
         """
-        去除地名里的后缀, 返回无后缀的地名
+        去除地名里的后缀, 返回无后缀的地名. 已知的地名直接查nosuffix_dict, 其余的才用正则
+        """
+        if cls.nosuffix_dict is not None:
+            loc_str_new = cls.nosuffix_dict.get(loc_str)
+            if loc_str_new is not None:
+                cls.__nosuffix_hits += 1
+                return loc_str_new
+        cls.__nosuffix_misses += 1
+        return cls.__remove_loc_suffix_re(loc_str)
+
+    @classmethod
+    def nosuffix_info(cls) -> Dict[str, int]:
+        """
+        返回remove_loc_suffix查词典命中(hits)和回退到正则(misses)的次数, 以及nosuffix_dict的大小
+        """
+        return {"hits": cls.__nosuffix_hits, "misses": cls.__nosuffix_misses,
+                "size": 0 if cls.nosuffix_dict is None else len(cls.nosuffix_dict)}
+
+    @classmethod
+    def __remove_loc_suffix_re(cls, loc_str:str) -> str:
+        """
+        用正则去除地名里的后缀
         """
         loc_str_new = cls.__RE_OBJ.sub(repl="", string=loc_str, count=1)
 
@@ -244,6 +364,26 @@ class LocDetHelper():
                 city = prov if city in ['市辖区','县'] else city
                 cls.loc_dict[prov][city] = list(dist_dict.keys())
 
+    @classmethod
+    def __init_nosuffix_dict(cls):
+        """
+        预先计算loc.json中所有省、市、区县名去后缀的结果. NER识别出的L token多为不带后缀的简称(如"深圳"), 因此去后缀的结果本身也加入词典
+        """
+        names = set()
+        for prov, city_dict in cls.loc_dict.items():
+            names.add(prov)
+            for city, dist_list in city_dict.items():
+                names.add(city)
+                names.update(dist_list)
+
+        nosuffix_dict:Dict[str, str] = {}
+        for name in names:
+            name_nosuffix = cls.__remove_loc_suffix_re(name)
+            nosuffix_dict[name] = name_nosuffix
+            if name_nosuffix not in nosuffix_dict:
+                nosuffix_dict[name_nosuffix] = cls.__remove_loc_suffix_re(name_nosuffix)
+        cls.nosuffix_dict = nosuffix_dict
+
     @classmethod
     def __init_prov2p_dict(cls):
         """
@@ -329,6 +469,23 @@ class LocDetHelper():
                 for name in school[0].split("/"):
                     cls.school2pc_dict[name] = school_loc
 
+    @classmethod
+    def __init_loc2pc_dict(cls):
+        """
+        合并省、市、区县三级的有后缀和无后缀词典, location_recover中每个地名只需查一次词典就能得到所有层级的结果.
+
+        高校和市级行政区的AC自动机不合并进来: 它们分别在不同的文本(全文, O/S tokens, L tokens)上用iter_long做最长匹配,
+        高校名中常含有市名(如"深圳大学"), 合并后最长匹配会互相吞掉对方的结果, 检测结果将与原来不同
+        """
+        cls.loc2pc_dict:Dict[str, Tuple] = {}
+        names = set(cls.prov2p_dict) | set(cls.city2pc_dict) | set(cls.city2pc_dict_nosuffix) | set(cls.dist2pc_dict) | set(cls.dist2pc_dict_nosuffix)
+        for name in names:
+            cls.loc2pc_dict[name] = (cls.prov2p_dict.get(name),
+                                     cls.city2pc_dict.get(name),
+                                     cls.city2pc_dict_nosuffix.get(name),
+                                     cls.dist2pc_dict.get(name),
+                                     cls.dist2pc_dict_nosuffix.get(name))
+
     @classmethod
     def __init_school2pc_AC(cls):
         """
@@ -1,10 +1,9 @@
 from typing import *
 import re
-import copy
 from ....common import Experience
 from .location_recover import location_recover
 
-__all__ = ["rebuild"]   # 只对外暴露rebuild函数
+__all__ = ["rebuild", "rebuild_iter"]   # 只对外暴露rebuild和rebuild_iter函数
 
 
 def rebuild(exp_list:List[Experience], callback:Callable=None) -> List[Experience]:
@@ -30,12 +29,7 @@ def rebuild(exp_list:List[Experience], callback:Callable=None) -> List[Experienc
     result:List[Experience] = []
 
     for iternum, exp in enumerate(exp_list):
-        # 跳过曾经拆分过的
-        if exp.splitnum != 0:
-            continue
-        recovered_rawtoken = adjunct_entity_recover(exp.text_rawtoken)              # 1. 兼职命名实体补齐
-        splitted_exps = adjunct_split(exp, recovered_rawtoken=recovered_rawtoken)   # 2. 兼职拆分、Location补齐
-        result.extend(splitted_exps)
+        result.extend(rebuild_one(exp))
 
          # 调用callback函数
         __status_dict["iternum"] = iternum
@@ -45,6 +39,28 @@ def rebuild(exp_list:List[Experience], callback:Callable=None) -> List[Experienc
     return result
 
 
+def rebuild_iter(exp_iter:Iterable[Experience]) -> Iterator[Experience]:
+    """
+    rebuild的生成器版本: 逐个重建exp_iter中的Experience并立即产出重建结果, 内存占用与输入规模无关
+
+    Params:
+        exp_iter: 传入的经历, 可以是任意可迭代对象
+    """
+    for exp in exp_iter:
+        yield from rebuild_one(exp)
+
+
+def rebuild_one(exp:Experience) -> List[Experience]:
+    """
+    重建一个Experience, 返回重建得到的Experience列表. 曾经拆分过的(splitnum不为0)返回空列表
+    """
+    # 跳过曾经拆分过的
+    if exp.splitnum != 0:
+        return []
+    recovered_rawtoken = adjunct_entity_recover(exp.text_rawtoken)              # 1. 兼职命名实体补齐
+    return adjunct_split(exp, recovered_rawtoken=recovered_rawtoken)            # 2. 兼职拆分、Location补齐
+
+
 def adjunct_entity_recover(rawtoken:str or None) -> str:
     """
     兼职命名实体补齐 + Location补齐.
@@ -70,7 +86,8 @@ def adjunct_entity_recover(rawtoken:str or None) -> str:
         return text_list[0] if len(text_list) == 1 else None
         
     entity_lists:List[List[str]] = [t.split(" ") for t in text_list] # [["深圳L", "广电集团O", "龙岗广电中心S", "主任P"], ["东部传媒公司O", "董事P"], ["总经理P"], ["广电中心O", "党组S", "书记P"]]
-    new_entity_lists:List[List[str]] = copy.deepcopy(entity_lists)
+    # 下面只会整体替换new_entity_lists中的元素(切片拼接得到新列表), 不会原地修改内层列表, 复制外层列表即可
+    new_entity_lists:List[List[str]] = list(entity_lists)
 
     # 首个兼职没有LOS的直接原样返回，没必要走接下来流程了
     if re.search("[SOL]+", text_list[0]) is None:
@@ -148,7 +165,7 @@ def adjunct_split(exp:Experience, recovered_rawtoken:str) -> List[Experience]:
     
     # 不用拆分的直接把text_rawtoken赋值给text_token，再把text_token合并赋值给text
     if (recovered_rawtoken is None) or ("|" not in recovered_rawtoken):
-        new_exp = copy.deepcopy(exp)
+        new_exp = exp.copy()
         new_exp.splitnum = 1
         new_exp.text_token = recovered_rawtoken
         new_exp.text = None if new_exp.text_token is None else "".join([t[0:-1] for t in new_exp.text_token.split(' ')])
@@ -158,7 +175,7 @@ def adjunct_split(exp:Experience, recovered_rawtoken:str) -> List[Experience]:
     # recovered_rawtoken按"|"分开生成新的Experience，生成各自的text_token和text，按每个Experience在rawtoken中的位置设置splitnum（从1开始）
     split_token_list = recovered_rawtoken.split("|")
     for idx, split_token in enumerate(split_token_list):
-        new_exp = copy.deepcopy(exp)
+        new_exp = exp.copy()
         new_exp.splitnum = idx+1
         new_exp.text_token = split_token
         new_exp.text = "".join([t[0:-1] for t in new_exp.text_token.split(' ')])
@@ -2,19 +2,24 @@ import os, sys
 import re
 import json
 import datetime
-import copy
 import logging
-from typing import List, Tuple, Dict, Callable
+from functools import lru_cache
+from typing import List, Tuple, Dict, Callable, Iterable, Iterator, Pattern, Any
+from itertools import islice
 import jieba
 from jieba import posseg
 from pyhanlp import *
 
-from ....common import Experience
+from ....common import Experience, ExperienceTable
+from ...utils import LRUCache
 
 
 jieba.setLogLevel(logging.INFO)
 
-__all__ = ["refine"] # 只向外暴露refine函数
+__all__ = ["refine", "refine_iter", "refine_strings", "hanlp_cache_info"] # 只向外暴露refine、refine_iter、refine_strings和hanlp_cache_info函数
+
+REFINE_BATCH_SIZE = 256     # refine_iter每次交给refine_strings处理的经历原文数量
+HANLP_CACHE_SIZE = 65536    # 兼职子串 -> HanLP分词结果最后一个词及其词性 的LRU缓存容量
 
 
 def refine(exp_list:List[Experience], in_position:bool=False, callback:Callable=None) -> List[Experience]:
@@ -26,12 +31,9 @@ def refine(exp_list:List[Experience], in_position:bool=False, callback:Callable=
 
     Params:
         exp_list: 传入的经历列表
-        in_position: True则在传入exp_list上原地修改并返回原exp_list. False则深拷贝后修改并返回新的
+        in_position: True则在传入exp_list中的Experience上原地修改. False则复制后修改
         callback: 回调函数，需要能够接收一个包含函数执行状态信息的dict，可以用来查看执行进度
     """
-    if not in_position:
-        exp_list = copy.deepcopy(exp_list)
-
     # 用于传入callback的状态字典
     __status_dict = {
         "description": "[exp_parser]-refine",
@@ -39,22 +41,115 @@ def refine(exp_list:List[Experience], in_position:bool=False, callback:Callable=
         "iternum": 0
     }
 
-    for iternum, exp in enumerate(exp_list):
-        if exp.text_raw is None:
-            continue
-        text_NR = noise_remove(exp.text_raw)          # 1. 清洗去噪
-        text_AR = abbreviation_recover(text_NR)     # 2. 缩略词还原
-        exp.text_rawrefine = text_AR
-
-        text_AS = adjunct_mark(text_AR)            # 3. 兼职拆分标记
-        exp.text_rawsplit =  text_AS
+    result:List[Experience] = []
+    for iternum, exp in enumerate(refine_iter(exp_list, in_position=in_position)):
+        result.append(exp)
 
         # 调用callback函数
         __status_dict["iternum"] = iternum
         if callback is not None:
             callback(__status_dict)
 
-    return exp_list
+    return result
+
+
+def refine_iter(exp_iter:Iterable[Experience], in_position:bool=False) -> Iterator[Experience]:
+    """
+    refine的生成器版本: 每次从exp_iter中取出REFINE_BATCH_SIZE个Experience交给refine_strings批量处理后产出, 内存占用与输入规模无关
+
+    Params:
+        exp_iter: 传入的经历, 可以是任意可迭代对象
+        in_position: True则在传入的Experience上原地修改. False则复制(Experience.copy)后修改
+    """
+    # ExperienceTable中取出的每一行都是新的Experience, 不需要再复制
+    if isinstance(exp_iter, ExperienceTable):
+        in_position = True
+    exp_iter = iter(exp_iter)
+    while True:
+        exp_batch = list(islice(exp_iter, REFINE_BATCH_SIZE))
+        if len(exp_batch) == 0:
+            return
+        if not in_position:
+            exp_batch = [exp.copy() for exp in exp_batch]
+
+        # 只处理text_raw不为None的经历, 其余原样产出
+        todo_list = [exp for exp in exp_batch if exp.text_raw is not None]
+        refined_list = refine_strings([exp.text_raw for exp in todo_list])
+        for exp, (text_rawrefine, text_rawsplit) in zip(todo_list, refined_list):
+            exp.text_rawrefine = text_rawrefine
+            exp.text_rawsplit = text_rawsplit
+        yield from exp_batch
+
+
+def refine_strings(text_list:List[str]) -> List[Tuple[str or None, str or None]]:
+    """
+    对一批经历原文依次进行: 清洗去噪->缩略词还原->兼职拆分标记
+
+    Returns:
+        与text_list等长的列表, 每个元素为(缩略词还原后的结果, 兼职拆分标记后的结果), 即Experience的text_rawrefine和text_rawsplit
+    """
+    text_NR_list = noise_remove_batch(text_list)                # 1. 清洗去噪
+    text_AR_list = abbreviation_recover_batch(text_NR_list)     # 2. 缩略词还原
+    text_AS_list = adjunct_mark_batch(text_AR_list)             # 3. 兼职拆分标记
+    return list(zip(text_AR_list, text_AS_list))
+
+
+# 批量处理时, 一批字符串以BATCH_SEPARATOR拼接为一个字符串, 每条规则只需在拼接后的字符串上执行一次, 见_batch_sub.
+# 下面的规则都不会匹配、产生或删除BATCH_SEPARATOR("."不匹配换行, 字符集中都不含换行, "$"以MULTILINE模式匹配每一行的行尾),
+# 因此拼接后执行与逐个执行的结果相同
+BATCH_SEPARATOR = "\n"
+
+# 清洗去噪中删除的空白字符
+NOISE_WHITESPACES = ("\n", "\t", "\u00A0", "\u0020", "\u3000")
+
+# 清洗去噪规则, 按顺序执行. 每条规则为(正则, 替换, 触发词):
+# 正则的每一个匹配都必然包含某个触发词, 整批字符串中都没有触发词时跳过该规则. 触发词为None表示总是执行
+# 以可选字符开头的正则(如"[,，/.。、]?主持")无法利用开头的字面量快速定位, 这类正则被展开为以字面量开头的多个分支, 匹配结果不变
+NOISE_RULES:List[Tuple[Pattern, str, Tuple[str, ...] or None]] = [(re.compile(pattern, re.M), repl, triggers) for pattern, repl, triggers in [
+    # 替换一些词
+    ("学习(?=[,，、]|$)", "学生", ("学习", )),
+    ("任教(?=[,，、]|$)", "教师", ("任教", )),
+    ("职务[,，、]+|职务$", "", ("职务", )),
+    # 去除一些无关句子
+    ("获.*?学位", "", ("学位", )),
+    ("|".join(["{}主持.*?工作[的]?".format(re.escape(c)) for c in ",，/.。、"] + ["主持.*?工作[的]?"]), "", ("主持", )),    # [,，/.。、]?主持.*?工作[的]?
+    ("|".join(["{}从事.*?工作".format(re.escape(c)) for c in ",，/.。、"] + ["从事.*?工作"]), "", ("从事", )),               # [,，/.。、]?从事.*?工作
+    ("工作，历?任|工作,历?任|，历?任|,历?任", "", ("，任", "，历任", ",任", ",历任")),                                    # (工作)?[，,][历]?任
+    ("[\\(（\\[【][^\\(（\\[【\\n]*?[\\)）\\]】]", "", ("(", "（", "[", "【")),
+    ("[\\(（\\[【].*[\\)）\\]】]", "", ("(", "（", "[", "【")),
+    ("[0-9][0-9]{3}.?[0-9]{0,2}[—-]?", "", tuple("0123456789")),                                                           # [0-9]{4}.?[0-9]{0,2}[—-]?
+]]
+
+# 缩略词还原中"x委"的替换, 按顺序执行. 如果要添加新的"x委", 需要放在"委员会员会"之前
+ABBREVIATION_REPLACEMENTS:List[Tuple[str, str]] = [
+    ("委会", "委员会"),
+    ("市委", "市委员会"),
+    ("区委", "区委员会"),
+    ("省委", "省委员会"),
+    ("县委", "县委员会"),
+    ("镇委", "镇委员会"),
+    ("村委", "村委员会"),
+    ("委员会员会", "委员会"),
+]
+# 上面替换前后的字符串都只由这些字符组成, 因此依次替换整个字符串, 等价于只对其中由这些字符组成的极大子串依次替换.
+# 每条替换都含有"委", 不含"委"的子串不会变化. 英文缩写"E?MBA"与这些字符不相交, 可以放在同一个正则里一次扫描完成
+_ABBREVIATION_CHARS = "".join(sorted(set("".join(old + new for old, new in ABBREVIATION_REPLACEMENTS))))
+ABBREVIATION_PATTERN:Pattern = re.compile("[{0}]*委[{0}]*|E?MBA".format(_ABBREVIATION_CHARS))
+
+# 兼职拆分标记: 将"兼任","兼",",兼",逗号,顿号之类的模式连同相邻的"|"一起替换为一个拆分标记"|"
+ADJUNCT_PATTERN:Pattern = re.compile("(?:[\\.,，。、；;兼]+任?|\\|)+")
+
+
+def _batch_sub(func:Callable[[str], str], text_list:List[str]) -> List[str]:
+    """
+    对text_list中的每个字符串执行func. 一般将整批字符串以BATCH_SEPARATOR拼接后只执行一次func再拆分,
+    有字符串本身含有BATCH_SEPARATOR时退化为逐个执行
+    """
+    if len(text_list) == 0:
+        return []
+    if any(BATCH_SEPARATOR in text for text in text_list):
+        return [func(text) for text in text_list]
+    return func(BATCH_SEPARATOR.join(text_list)).split(BATCH_SEPARATOR)
 
 
 def noise_remove(input_str:str) -> str or None:
@@ -62,11 +157,19 @@ def noise_remove(input_str:str) -> str or None:
     清洗去噪.
     去除经历语句中的无意义字符、干扰词等，input_str需为单条完整的经历语句
     """
-    result = input_str
+    return noise_remove_batch([input_str])[0]
+
 
+def noise_remove_batch(input_str_list:List[str]) -> List[str or None]:
+    """
+    批量清洗去噪, 结果与对每个字符串调用noise_remove相同
+    """
     # 去除空格等字符
-    result = re.sub("[\n\t \u00A0\u0020\u3000]", "", result)
-    result = re.sub(r"\n", "", result)
+    result_list = []
+    for result in input_str_list:
+        for whitespace in NOISE_WHITESPACES:
+            result = result.replace(whitespace, "")
+        result_list.append(result)
 
     # 去除连词、副词 
     ## TODO 这完全没用阿，全都去除错了
@@ -78,23 +181,17 @@ def noise_remove(input_str:str) -> str or None:
     #     else:
     #         print(list(posseg.cut(input_str)))
 
-    # 替换一些词
-    result = re.sub("学习[,，、]+|学习$", lambda m:m.group().replace("学习","学生"), result)
-    result = re.sub("任教[,，、]+|任教$", lambda m:m.group().replace("任教","教师"), result)
-    result = re.sub("职务[,，、]+|职务$", "", result)
+    # 替换一些词、去除一些无关句子, 见NOISE_RULES
+    result_list = _batch_sub(_noise_rules_sub, result_list)
 
-    # 去除一些无关句子
-    result = re.sub("获.*?学位", "", result)
-    result = re.sub("[,，/.。、]?主持.*?工作[的]?", "", result)
-    result = re.sub("[,，/.。、]?从事.*?工作", "", result)
-    result = re.sub("(工作)?[，,][历]?任", "", result)
-    result = re.sub("[\(（\[【][^\(（\[【]*?[\)）\]】]", "", result)
-    result = re.sub("[\(（\[【].*[\)）\]】]", "", result)
-    result = re.sub("[0-9]{4}.?[0-9]{0,2}[—-]?", "", result)
-    
-    if result == "":
-        return None
-    return result
+    return [result if result != "" else None for result in result_list]
+
+
+def _noise_rules_sub(text:str) -> str:
+    for pattern, repl, triggers in NOISE_RULES:
+        if triggers is None or any(trigger in text for trigger in triggers):
+            text = pattern.sub(repl, text)
+    return text
 
 
 def abbreviation_recover(input_str:str) -> str or None:
@@ -102,33 +199,48 @@ def abbreviation_recover(input_str:str) -> str or None:
     缩略词还原.
     将经历语句中的缩略词恢复为完整词, input_str需为单条完整的经历语句
     """
-    if input_str is None:
-        return None
-    result = input_str
-
-    # 部分“x委”恢复成“xx委员会”
-    result = result\
-        .replace("委会", "委员会") \
-        .replace("市委", "市委员会") \
-        .replace("区委", "区委员会") \
-        .replace("省委", "省委员会") \
-        .replace("县委", "县委员会") \
-        .replace("镇委", "镇委员会") \
-        .replace("村委", "村委员会") \
-        .replace("委员会员会", "委员会") # 如果要添加新的“x委”，这句replace需要放在最后
-
-    #  开头为“市”、“省”默认恢复成“深圳市”、“广东省”
-    if result.startswith('市'):
-        result = '深圳' + result
-    if result.startswith('省'):
-        result = '广东' + result
-
-    # 替换一些英文缩写
-    result = re.sub("E?MBA", "管理学硕士", result)
-
-    if result == "":
-        return None
-    return result
+    return abbreviation_recover_batch([input_str])[0]
+
+
+def abbreviation_recover_batch(input_str_list:List[str or None]) -> List[str or None]:
+    """
+    批量缩略词还原, 结果与对每个字符串调用abbreviation_recover相同
+    """
+    # 为None的直接返回None
+    idx_list = [i for i, input_str in enumerate(input_str_list) if input_str is not None]
+    result_list:List[str or None] = [None] * len(input_str_list)
+    if len(idx_list) == 0:
+        return result_list
+
+    # 部分“x委”恢复成“xx委员会”、替换一些英文缩写, 一次扫描完成
+    replaced_list = _batch_sub(lambda text: ABBREVIATION_PATTERN.sub(_abbreviation_repl, text), [input_str_list[i] for i in idx_list])
+
+    for i, result in zip(idx_list, replaced_list):
+        #  开头为“市”、“省”默认恢复成“深圳市”、“广东省”
+        if result.startswith('市'):
+            result = '深圳' + result
+        if result.startswith('省'):
+            result = '广东' + result
+        result_list[i] = result if result != "" else None
+
+    return result_list
+
+
+@lru_cache(maxsize=4096)
+def _abbreviation_recover_run(run:str) -> str:
+    """
+    对一个由_ABBREVIATION_CHARS组成的子串依次执行ABBREVIATION_REPLACEMENTS. 这样的子串种类很少, 结果缓存起来
+    """
+    for old, new in ABBREVIATION_REPLACEMENTS:
+        run = run.replace(old, new)
+    return run
+
+
+def _abbreviation_repl(match:re.Match) -> str:
+    text = match.group()
+    if text.endswith("MBA"):
+        return "管理学硕士"
+    return _abbreviation_recover_run(text)
 
 
 def adjunct_mark(input_str:str) -> str:
@@ -136,57 +248,133 @@ def adjunct_mark(input_str:str) -> str:
     兼职拆分标记.
     在经历语句中添加兼职拆分标记"|"，用于之后的重建. input_str需为单条完整的经历语句
     """
-    if input_str is None:
-        return None
-    result = input_str
-    
-    # 如"xxx兼职副主席"替换为"xxx副主席"
-    result = result.replace("兼职", "")
+    return adjunct_mark_batch([input_str])[0]
 
-    # 识别"兼任","兼",",兼",逗号,顿号之类的模式替换为拆分标记|
+
+def adjunct_mark_batch(input_str_list:List[str or None]) -> List[str or None]:
+    """
+    批量兼职拆分标记, 结果与对每个字符串调用adjunct_mark相同
+    """
+    # 为None的直接返回None
+    idx_list = [i for i, input_str in enumerate(input_str_list) if input_str is not None]
+    result_list:List[str or None] = [None] * len(input_str_list)
+    if len(idx_list) == 0:
+        return result_list
+    # 如"xxx兼职副主席"替换为"xxx副主席"
+    # 识别"兼任","兼",",兼",逗号,顿号之类的模式替换为拆分标记|, 同时将多个连在一起的|合并
     # 注意先替换长串再替换短串以保证正确性
-    result = re.sub("[\.,，。、；;兼]+任?", "|", result)
-
-    # 将多个连在一起的|合并、首尾的|去掉
-    result = re.sub("(\|)+", "|", result)
-    result = result.strip("|")
-    if result == "":
-        return None
-
-    # 如果有多个兼职
-    if "|" in result:
-        adj_list = result.split("|")
-        # 从后向前, 判断每个拆分子串的最后一个词是否为职位词,若不是则使用最近后继子串的职位词补全
-        # 例如：将"X机构、Y机构ZZ职位，A机构、B机构、C机构DD职位"补全为"X机构ZZ职位、Y机构ZZ职位，A机构DD职位、B机构DD职位、C机构DD职位"
-        cur_position_suffix = ""    # 当前（即最近后继子串的）职位词后缀
-        for i in range(len(adj_list)-1, -1, -1):
-            hanlp_seg = HanLP.segment(adj_list[i])
-            # 若最后一个词为职位词(nature是nn/nnd/nnt),则作为当前用于补全的cur_position_suffix
-            if str(hanlp_seg[-1].nature).startswith('nn'):
-                cur_position_suffix = hanlp_seg[-1].word
-            # 若最后一个词不是职位词,则用cur_position_suffix补全
-            else:
-                # 跳过一些例外情况
-                if len(adj_list[i])<3:                           # 太短的
-                    break
-                if adj_list[i][-3] == adj_list[i][-2]:           # 有时候hanlp会把"XXXXX局局长"之类的句子最后一个词分成"局局长"且词性错分为n
-                    break
-                
-                hanlp_mistake_list = [                           # hanlp会分错词性但实际上是职位词的词
-                    "书记","科员","指导员","治安员",
-                    "员工","成员","人选","主管","主办","主任","组长","单元长",
-                    "主操","副操","助工",
-                    "排长","营长","连长","旅长","师长","军长"
-                ]
-                ignore_is_ok_list = [                            # 我们选择无视的情况
-                    "工作", 
-                ]
-                if adj_list[i].endswith(tuple(hanlp_mistake_list+ignore_is_ok_list)):
-                    break
-
-                # 如果上面的例外情况都不属于，则终于可以用cur_position_suffix补全了
-                adj_list[i] = adj_list[i] + cur_position_suffix
-        
-        result = "|".join(adj_list)
-
-    return result
\ No newline at end of file
+    marked_list = _batch_sub(lambda text: ADJUNCT_PATTERN.sub("|", text.replace("兼职", "")), [input_str_list[i] for i in idx_list])
+
+    for i, result in zip(idx_list, marked_list):
+        # 首尾的|去掉
+        result = result.strip("|")
+        if result != "":
+            result_list[i] = result
+
+    # 如果有多个兼职, 补全职位词. 整批字符串的兼职子串一起查询HanLP分词结果
+    multi_idx_list = [i for i in idx_list if result_list[i] is not None and "|" in result_list[i]]
+    adj_lists = [result_list[i].split("|") for i in multi_idx_list]
+    last_term_dict = hanlp_last_terms([adj for adj_list in adj_lists for adj in adj_list])
+    for i, adj_list in zip(multi_idx_list, adj_lists):
+        result_list[i] = _adjunct_position_recover(adj_list, last_term_dict)
+
+    return result_list
+
+
+def _adjunct_position_recover(adj_list:List[str], last_term_dict:Dict[str, Tuple[str, str]]) -> str:
+    """
+    对含有多个兼职的字符串, 从后向前, 判断每个拆分子串的最后一个词是否为职位词,若不是则使用最近后继子串的职位词补全
+    例如：将"X机构、Y机构ZZ职位，A机构、B机构、C机构DD职位"补全为"X机构ZZ职位、Y机构ZZ职位，A机构DD职位、B机构DD职位、C机构DD职位"
+
+    Params:
+        adj_list: 按"|"拆分后的兼职子串列表
+        last_term_dict: 兼职子串 -> HanLP分词后最后一个词及其词性, 见hanlp_last_terms
+    """
+    cur_position_suffix = ""    # 当前（即最近后继子串的）职位词后缀
+    for i in range(len(adj_list)-1, -1, -1):
+        last_word, last_nature = last_term_dict[adj_list[i]]
+        # 若最后一个词为职位词(nature是nn/nnd/nnt),则作为当前用于补全的cur_position_suffix
+        if last_nature.startswith('nn'):
+            cur_position_suffix = last_word
+        # 若最后一个词不是职位词,则用cur_position_suffix补全
+        else:
+            # 跳过一些例外情况
+            if len(adj_list[i])<3:                           # 太短的
+                break
+            if adj_list[i][-3] == adj_list[i][-2]:           # 有时候hanlp会把"XXXXX局局长"之类的句子最后一个词分成"局局长"且词性错分为n
+                break
+            
+            hanlp_mistake_list = [                           # hanlp会分错词性但实际上是职位词的词
+                "书记","科员","指导员","治安员",
+                "员工","成员","人选","主管","主办","主任","组长","单元长",
+                "主操","副操","助工",
+                "排长","营长","连长","旅长","师长","军长"
+            ]
+            ignore_is_ok_list = [                            # 我们选择无视的情况
+                "工作", 
+            ]
+            if adj_list[i].endswith(tuple(hanlp_mistake_list+ignore_is_ok_list)):
+                break
+
+            # 如果上面的例外情况都不属于，则终于可以用cur_position_suffix补全了
+            adj_list[i] = adj_list[i] + cur_position_suffix
+
+    return "|".join(adj_list)
+
+
+# HanLP分词的批量接口: 以换行拼接的多个句子由seg2sentence分句后逐句分词, 与逐个调用HanLP.segment(即StandardTokenizer.SEGMENT.seg)
+# 的分词过程相同, 只需一次JVM调用. 开启了字符正规化时seg会先正规化而seg2sentence不会, 此时不使用批量接口
+try:
+    _HANLP_SEGMENT = SafeJClass("com.hankcs.hanlp.tokenizer.StandardTokenizer").SEGMENT
+    if HanLP.Config.Normalization:
+        _HANLP_SEGMENT = None
+except Exception:
+    _HANLP_SEGMENT = None
+
+# 兼职子串 -> HanLP分词后最后一个词及其词性. 同一个兼职子串(如"党组成员","副局长")在大量经历中重复出现
+_hanlp_last_term_cache = LRUCache(HANLP_CACHE_SIZE)
+
+
+def hanlp_cache_info() -> Dict[str, int]:
+    """
+    返回adjunct_mark中HanLP分词缓存的命中次数、未命中次数、容量上限和当前大小, 可以据此调整HANLP_CACHE_SIZE
+    """
+    return _hanlp_last_term_cache.info()
+
+
+def hanlp_last_terms(text_list:List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    对text_list中的每个字符串进行HanLP分词, 返回 字符串 -> (最后一个词, 最后一个词的词性) 的字典.
+    先查询缓存, 未命中的字符串去重后一次性批量分词并写入缓存
+    """
+    last_term_dict:Dict[str, Tuple[str, str]] = {}
+    miss_list:List[str] = []
+    for text in text_list:
+        if text in last_term_dict:
+            continue
+        last_term = _hanlp_last_term_cache.get(text)
+        if last_term is None:
+            last_term_dict[text] = None
+            miss_list.append(text)
+        else:
+            last_term_dict[text] = last_term
+
+    for text, terms in zip(miss_list, _hanlp_segment_batch(miss_list)):
+        last_term = (str(terms[-1].word), str(terms[-1].nature))
+        _hanlp_last_term_cache.put(text, last_term)
+        last_term_dict[text] = last_term
+
+    return last_term_dict
+
+
+def _hanlp_segment_batch(text_list:List[str]) -> List[List[Any]]:
+    """
+    批量HanLP分词, 返回与text_list等长的分词结果列表, 结果与逐个调用HanLP.segment相同.
+    批量接口不可用、或有字符串会被分句拆开(含有标点、换行、首尾空白等)导致结果无法一一对应时, 逐个调用HanLP.segment
+    """
+    if _HANLP_SEGMENT is not None and len(text_list) > 1:
+        sentence_list = list(_HANLP_SEGMENT.seg2sentence(BATCH_SEPARATOR.join(text_list), False))
+        if len(sentence_list) == len(text_list) and \
+                all("".join(str(term.word) for term in terms) == text for text, terms in zip(text_list, sentence_list)):
+            return [list(terms) for terms in sentence_list]
+    return [HanLP.segment(text) for text in text_list]
@@ -0,0 +1,239 @@
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import time
+from itertools import zip_longest
+import numpy as np
+import torch
+from ner.models.viterbi import viterbi_decode, viterbi_decode_np
+from ner.models.inference import ScriptedBiLSTM_CRF
+from ner.models.util import TokenEncoder
+from ner.utils import load_model, prepocess_data_for_lstmcrf
+from ner.evaluating import Metrics
+from ner.parser_check import prohibitions, restrictions
+
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024]
+TAGSET_SIZE = 24    # 20个BMES实体标记 + <unk> <pad> <start> <end>
+START_ID, END_ID, PAD_ID = 22, 23, 21
+CKPT_PATH = os.path.join(os.path.dirname(__file__), "ckpts")
+
+
+def legacy_viterbi_decode(emission, transition, lengths, start_id, end_id, pad):
+    """原BiLSTM_CRF.test中的解码实现(先由forward展开出 [B, L, T, T] 的crf_scores), 仅作为benchmark的对照"""
+    T = emission.size(2)
+    crf_scores = emission.unsqueeze(2).expand(-1, -1, T, -1) + transition.unsqueeze(0)
+    device = crf_scores.device
+    B, L, T, _ = crf_scores.size()
+    viterbi = torch.zeros(B, L, T).to(device)
+    backpointer = (torch.zeros(B, L, T).long() * end_id).to(device)
+    lengths = torch.LongTensor(lengths).to(device)
+    for step in range(L):
+        batch_size_t = (lengths > step).sum().item()
+        if step == 0:
+            viterbi[:batch_size_t, step, :] = crf_scores[: batch_size_t, step, start_id, :]
+            backpointer[: batch_size_t, step, :] = start_id
+        else:
+            max_scores, prev_tags = torch.max(
+                viterbi[:batch_size_t, step-1, :].unsqueeze(2) +
+                crf_scores[:batch_size_t, step, :, :],
+                dim=1
+            )
+            viterbi[:batch_size_t, step, :] = max_scores
+            backpointer[:batch_size_t, step, :] = prev_tags
+
+    backpointer = backpointer.view(B, -1)
+    tagids = []
+    tags_t = None
+    for step in range(L-1, 0, -1):
+        batch_size_t = (lengths > step).sum().item()
+        if step == L-1:
+            index = torch.ones(batch_size_t).long() * (step * T)
+            index = index.to(device)
+            index += end_id
+        else:
+            prev_batch_size_t = len(tags_t)
+            new_in_batch = torch.LongTensor([end_id] * (batch_size_t - prev_batch_size_t)).to(device)
+            offset = torch.cat([tags_t, new_in_batch], dim=0)
+            index = torch.ones(batch_size_t).long() * (step * T)
+            index = index.to(device)
+            index += offset.long()
+        tags_t = backpointer[:batch_size_t].gather(dim=1, index=index.unsqueeze(1).long())
+        tags_t = tags_t.squeeze(1)
+        tagids.append(tags_t.tolist())
+
+    tagids = list(zip_longest(*reversed(tagids), fillvalue=pad))
+    return torch.Tensor(tagids).long()
+
+
+def random_batch(batch_size, max_len=40, device="cpu"):
+    """随机生成按长度降序排列的一批发射分数, 句子长度在[2, max_len]之间"""
+    lengths = sorted(np.random.randint(2, max_len + 1, size=batch_size).tolist(), reverse=True)
+    emission = torch.randn(batch_size, lengths[0], TAGSET_SIZE, device=device)
+    return emission, lengths
+
+
+def timeit(func, repeat):
+    func()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_viterbi(device="cpu", repeat=5):
+    """对比原解码实现、张量化实现和numpy实现在不同batch大小下的耗时, 并检查三者结果一致.
+    scores一列为解码所需的分数张量大小: 原实现为 [B, L, T, T] 的crf_scores, 现在只有 [B, L, T] 的发射分数"""
+    print("Viterbi decode on {} (ms per batch)".format(device))
+    print("{:>6} {:>10} {:>10} {:>10} {:>8} {:>18}".format(
+        "batch", "legacy", "tensor", "numpy", "speedup", "scores (MB)"))
+    transition = torch.randn(TAGSET_SIZE, TAGSET_SIZE, device=device)
+    transition_np = transition.cpu().numpy()
+    for B in BATCH_SIZES:
+        emission, lengths = random_batch(B, device=device)
+        lengths_tensor = torch.LongTensor(lengths).to(device)
+        emission_np, lengths_np = emission.cpu().numpy(), np.asarray(lengths)
+
+        legacy = legacy_viterbi_decode(emission, transition, lengths, START_ID, END_ID, PAD_ID)
+        tensor = viterbi_decode(emission, transition, lengths_tensor, START_ID, END_ID, PAD_ID).cpu()
+        numpy_ = torch.from_numpy(viterbi_decode_np(emission_np, transition_np, lengths_np, START_ID, END_ID, PAD_ID))
+        assert torch.equal(legacy, tensor) and torch.equal(tensor, numpy_), "decoders disagree"
+
+        t_legacy = timeit(lambda: legacy_viterbi_decode(emission, transition, lengths, START_ID, END_ID, PAD_ID), repeat)
+        t_tensor = timeit(lambda: viterbi_decode(emission, transition, lengths_tensor, START_ID, END_ID, PAD_ID), repeat)
+        t_numpy = timeit(lambda: viterbi_decode_np(emission_np, transition_np, lengths_np, START_ID, END_ID, PAD_ID), repeat)
+        mb_legacy = emission.numel() * TAGSET_SIZE * emission.element_size() / 2 ** 20
+        mb_tensor = emission.numel() * emission.element_size() / 2 ** 20
+        print("{:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>7.1f}x {:>8.2f} -> {:<7.2f}".format(
+            B, t_legacy, t_tensor, t_numpy, t_legacy / t_tensor, mb_legacy, mb_tensor))
+
+
+def bench_export(batch_size=512, repeat=5):
+    """对比pickle模型与export.py导出的TorchScript模型的加载耗时、首个batch耗时和之后每个batch的耗时"""
+    model_path = os.path.join(CKPT_PATH, "bilstm_crf.pkl")
+    script_path = os.path.join(CKPT_PATH, "bilstm_crf_script.pt")
+    if not (os.path.exists(model_path) and os.path.exists(script_path)):
+        print("skip export benchmark: 需要 ckpts/bilstm_crf.pkl 和 ckpts/bilstm_crf_script.pt (运行export.py生成)")
+        return
+
+    def load_pickle():
+        word2id = load_model(os.path.join(CKPT_PATH, "crf_word2id.pkl"))
+        tag2id = load_model(os.path.join(CKPT_PATH, "crf_tag2id.pkl"))
+        model = load_model(model_path)
+        model.best_model.check_transmat(prohibitions, restrictions, tag2id)
+        word_encoder = TokenEncoder(word2id)    # 与BCTokenizer一样只构建一次查找表
+        return lambda word_lists: model.predict(word_lists, word_encoder, tag2id), word2id
+
+    def load_script():
+        model = ScriptedBiLSTM_CRF.load(script_path)
+        return model.predict, model.word2id
+
+    print("Pickle vs TorchScript (ms)")
+    print("{:>8} {:>10} {:>12} {:>12}".format("model", "load", "first batch", "per batch"))
+    for name, loader in [("pickle", load_pickle), ("script", load_script)]:
+        start = time.perf_counter()
+        predict, word2id = loader()
+        t_load = (time.perf_counter() - start) * 1000
+
+        chars = [w for w in word2id.keys() if len(w) == 1]
+        word_lists = [list(np.random.choice(chars, size=np.random.randint(1, 40))) + ["<end>"] for _ in range(batch_size)]
+        start = time.perf_counter()
+        predict(word_lists)
+        t_first = (time.perf_counter() - start) * 1000
+        t_batch = timeit(lambda: predict(word_lists), repeat)
+        print("{:>8} {:>10.1f} {:>12.1f} {:>12.1f}".format(name, t_load, t_first, t_batch))
+
+
+def load_test_split():
+    """parser.py中划分出的测试集(test_size=0.1, random_state=0)"""
+    from sklearn.model_selection import train_test_split
+    from ner.parser import data_process, load_data
+
+    all_data_X, all_data_Y, _, _ = data_process(load_data())
+    _, X_test, _, y_test = train_test_split(all_data_X, all_data_Y, test_size=0.1, random_state=0)
+    return prepocess_data_for_lstmcrf(X_test, y_test, test=True)
+
+
+def model_size(model):
+    """BILSTM_Model中model, best_model的参数以及优化器状态占用的内存(MB), 共享的张量只计一次"""
+    tensors = {}
+    for module in [model.model, model.best_model]:
+        for t in list(module.parameters()) + list(module.buffers()):
+            tensors[t.data_ptr()] = t
+    if model.optimizer is not None:
+        for state in model.optimizer.state.values():
+            for t in state.values():
+                if torch.is_tensor(t):
+                    tensors[t.data_ptr()] = t
+    return sum(t.numel() * t.element_size() for t in tensors.values()) / 2 ** 20
+
+
+def bench_freeze(repeat=5):
+    """对比BILSTM_Model.freeze前后的内存占用、在测试集上的预测结果和耗时"""
+    model_path = os.path.join(CKPT_PATH, "bilstm_crf.pkl")
+    if not os.path.exists(model_path):
+        print("skip freeze benchmark: 需要 ckpts/bilstm_crf.pkl")
+        return
+    test_word_lists, test_tag_lists = load_test_split()
+    word2id = load_model(os.path.join(CKPT_PATH, "crf_word2id.pkl"))
+    tag2id = load_model(os.path.join(CKPT_PATH, "crf_tag2id.pkl"))
+    model = load_model(model_path)
+    model.best_model.check_transmat(prohibitions, restrictions, tag2id)
+    word_encoder = TokenEncoder(word2id)
+
+    print("BILSTM_Model.freeze ({} sentences)".format(len(test_word_lists)))
+    print("{:>8} {:>10} {:>12}".format("", "size (MB)", "predict (ms)"))
+    results = []
+    for name in ["before", "after"]:
+        if name == "after":
+            model.freeze()
+        results.append(model.predict(test_word_lists, word_encoder, tag2id))
+        t = timeit(lambda: model.predict(test_word_lists, word_encoder, tag2id), repeat)
+        print("{:>8} {:>10.2f} {:>12.1f}".format(name, model_size(model), t))
+    same = sum(p == q for p, q in zip(*results))
+    print("freeze前后预测完全相同的句子: {}/{}".format(same, len(test_word_lists)))
+
+
+def bench_quantize(repeat=5):
+    """
+    在parser.py划分出的测试集(test_size=0.1, random_state=0)上, 对比原模型与动态int8量化模型的Metrics报告和吞吐
+    """
+    model_path = os.path.join(CKPT_PATH, "bilstm_crf.pkl")
+    if not os.path.exists(model_path):
+        print("skip quantize benchmark: 需要 ckpts/bilstm_crf.pkl")
+        return
+    test_word_lists, test_tag_lists = load_test_split()
+    chars_num = sum(len(word_list) for word_list in test_word_lists)
+
+    word2id = load_model(os.path.join(CKPT_PATH, "crf_word2id.pkl"))
+    tag2id = load_model(os.path.join(CKPT_PATH, "crf_tag2id.pkl"))
+    model = load_model(model_path)
+    model.best_model.check_transmat(prohibitions, restrictions, tag2id)
+    word_encoder = TokenEncoder(word2id)
+
+    models = [("fp32", model), ("int8", model.quantize())]
+    for name, file_name in [("script fp32", "bilstm_crf_script.pt"), ("script int8", "bilstm_crf_script_int8.pt")]:
+        if os.path.exists(os.path.join(CKPT_PATH, file_name)):
+            models.append((name, ScriptedBiLSTM_CRF.load(os.path.join(CKPT_PATH, file_name))))
+
+    results = {}
+    for name, m in models:
+        pred_tag_lists = m.predict(test_word_lists, word_encoder, tag2id)
+        results[name] = pred_tag_lists
+        print("==== {} ====".format(name))
+        Metrics(test_tag_lists, pred_tag_lists).report_scores()
+        t = timeit(lambda: m.predict(test_word_lists, word_encoder, tag2id), repeat)
+        print("{} sentences: {:.1f} ms, {:.0f} chars/s".format(len(test_word_lists), t, chars_num / t * 1000))
+    for name in results:
+        same = sum(p == q for p, q in zip(results["fp32"], results[name]))
+        print("{}与fp32预测完全相同的句子: {}/{}".format(name, same, len(test_word_lists)))
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    torch.manual_seed(0)
+    bench_viterbi("cpu")
+    if torch.cuda.is_available():
+        bench_viterbi("cuda")
+    bench_export()
+    bench_freeze()
+    bench_quantize()
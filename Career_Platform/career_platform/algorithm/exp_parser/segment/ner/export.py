@@ -0,0 +1,53 @@
+import os, sys
+import hashlib
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import torch
+from ner.utils import load_model
+from ner.models.inference import BiLSTM_CRF_Inference, ScriptedBiLSTM_CRF
+from ner.models.bilstm import quantize_dynamic
+from ner.parser_check import prohibitions, restrictions
+
+# 将训练得到的bilstm_crf.pkl导出为只包含推理部分的TorchScript模型, BCTokenizer会优先加载导出的模型
+CKPT_PATH = os.path.join(os.path.dirname(__file__), 'ckpts')
+BiLSTMCRF_MODEL_PATH = os.path.join(CKPT_PATH, 'bilstm_crf.pkl')
+SCRIPT_MODEL_PATH = os.path.join(CKPT_PATH, 'bilstm_crf_script.pt')
+QUANT_SCRIPT_MODEL_PATH = os.path.join(CKPT_PATH, 'bilstm_crf_script_int8.pt')
+
+
+def export(model_path=BiLSTMCRF_MODEL_PATH, script_path=SCRIPT_MODEL_PATH, quantize=False):
+    """quantize为True时导出动态int8量化(bilstm, lin)后的模型"""
+    crf_word2id = load_model(os.path.join(CKPT_PATH, 'crf_word2id.pkl'))
+    crf_tag2id = load_model(os.path.join(CKPT_PATH, 'crf_tag2id.pkl'))
+    bilstm_model = load_model(model_path)
+    bilstm_model.best_model.check_transmat(prohibitions, restrictions, crf_tag2id)
+
+    module = BiLSTM_CRF_Inference.from_model(bilstm_model.best_model, crf_tag2id)
+    if quantize:
+        module = quantize_dynamic(module)
+    # 记录pkl模型的sha1, 重新训练pkl模型后BCTokenizer会发现导出的模型已过时而改用pkl模型
+    with open(model_path, "rb") as f:
+        source_sha1 = hashlib.sha1(f.read()).hexdigest()
+    ScriptedBiLSTM_CRF.save(module, script_path, crf_word2id, crf_tag2id, source_sha1=source_sha1)
+
+    # 导出后在测试句子上核对两个模型的预测结果是否一致
+    word_lists = [list(s) + ["<end>"] for s in ["广东省第八建筑工程公司发电分公司技术员",
+                                                "致公党深圳市委会副主委",
+                                                "深圳市司法局社区矫正和安置帮教工作处副处长",
+                                                "哈尔滨工业大学深圳研究生院博士生导师"]]
+    expected = bilstm_model.predict(word_lists, crf_word2id, crf_tag2id)
+    scripted = ScriptedBiLSTM_CRF.load(script_path).predict(word_lists)
+    if quantize:
+        # 量化会带来少量误差, 只打印差异, 准确率用benchmark.py中的bench_quantize评估
+        for word_list, p, q in zip(word_lists, expected, scripted):
+            if p != q:
+                print("预测结果不一致: {}\n  fp32: {}\n  int8: {}".format("".join(word_list[:-1]), p, q))
+    else:
+        assert expected == scripted, "导出模型的预测结果与原模型不一致"
+    print("已导出: {} ({:.1f}MB -> {:.1f}MB)".format(
+        script_path, os.path.getsize(model_path) / 2 ** 20, os.path.getsize(script_path) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    export()
+    if "--quantize" in sys.argv:
+        export(script_path=QUANT_SCRIPT_MODEL_PATH, quantize=True)
@@ -1,9 +1,21 @@
 from re import L
+from copy import deepcopy
 import torch
 import torch.nn as nn
 from torch.nn.utils.rnn import pad_packed_sequence, pack_padded_sequence
 from .config import LSTMConfig
 
+# 动态int8量化的层: bilstm, lin以及bert向量降维用的red
+QUANTIZE_LAYERS = {nn.LSTM, nn.Linear}
+
+
+def quantize_dynamic(model):
+    """
+    返回model经动态int8量化后的副本: 权重以int8保存, 激活值在推理时动态量化. 量化后的模型只能在CPU上推理
+    """
+    model = deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, QUANTIZE_LAYERS, dtype=torch.qint8, inplace=True)
+
 class BiLSTM(nn.Module):
     def __init__(self, vocab_size, emb_size, hidden_size, out_size, weight):
         """初始化参数：
@@ -28,14 +40,28 @@ class BiLSTM(nn.Module):
         self.lin = nn.Linear(2*hidden_size, out_size)
 
     # sents_tensor [B, L] nn.embedding 把 sents_tensor[i][j] 对应的 word 映射到一个 emb_size 的向量
+    def embed(self, sents_tensor):
+        if hasattr(self, "embedding"):  # 未使用bert预训练向量, 或已经调用过freeze_embedding
+            return self.embedding(sents_tensor)  # [B, L, emb_size]   L: 最长的序列长度 ?
+        emb_1 = self.embedding_1(sents_tensor)
+        emb_2 = self.embedding_2(sents_tensor)
+        ber = self.red(emb_1)
+        return emb_2 + ber
+
+    def freeze_embedding(self):
+        """
+        推理时embedding只与字的id有关: 将 red(embedding_1) + embedding_2 预先算好合并为一张 [vocab_size, emb_size] 的表,
+        并删除768维的embedding_1及red. 之后不能再训练embedding
+        """
+        if hasattr(self, "embedding"):
+            return
+        with torch.no_grad():
+            weight = self.red(self.embedding_1.weight) + self.embedding_2.weight
+        self.embedding = nn.Embedding.from_pretrained(weight)
+        del self.embedding_1, self.embedding_2, self.red
+
     def forward(self, sents_tensor, lengths):
-        if (LSTMConfig.bert_pre_trained == True):
-            emb_1 = self.embedding_1(sents_tensor)
-            emb_2 = self.embedding_2(sents_tensor)
-            ber = self.red(emb_1)
-            emb = emb_2 + ber
-        else:
-            emb = self.embedding(sents_tensor)  # [B, L, emb_size]   L: 最长的序列长度 ?
+        emb = self.embed(sents_tensor)
         # 可以在 emb 层修改载入预训练的 word2vec 比如说加上？
         emb = self.dropout(emb)
         packed = pack_padded_sequence(emb, lengths, batch_first=True)
@@ -54,6 +80,10 @@ class BiLSTM(nn.Module):
 
         return batch_tagids   # [B, L] ?
 
+    def quantize(self):
+        """返回动态int8量化后的副本, 见quantize_dynamic. 已调用freeze_embedding时不再有red层"""
+        return quantize_dynamic(self)
+
 
 class Bert_BiLSTM(BiLSTM): # pre-trained bert-base-chinese instead of nn.Embedding(vocab_size, emb_size)
     def __init__(self, vocab_size, emb_size, hidden_size, out_size):
@@ -1,15 +1,19 @@
-from itertools import zip_longest
-from copy import deepcopy
+from copy import copy, deepcopy
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from tqdm import tqdm
 
-from .util import tensorized, sort_by_lengths, cal_loss, cal_lstm_crf_loss
+from .util import tensorized, sort_by_lengths, cal_loss, cal_lstm_crf_loss, TokenEncoder
 from .config import TrainingConfig, LSTMConfig
-from .bilstm import BiLSTM
+from .bilstm import BiLSTM, quantize_dynamic
+from .viterbi import viterbi_decode, viterbi_decode_np
 
 class BILSTM_Model(object):
+    # best_model是否经过动态int8量化, 作为类属性以兼容旧版本保存的模型
+    quantized = False
+
     def __init__(self, vocab_size, out_size, weight, crf=True):
         """功能：对LSTM的模型进行训练与测试
            参数:
@@ -57,6 +61,7 @@ class BILSTM_Model(object):
         #dev_word_lists, dev_tag_lists, _ = sort_by_lengths(
         #    dev_word_lists, dev_tag_lists)
 
+        word_encoder = TokenEncoder(word2id)   # 查找表只构建一次, 每个batch复用
         B = self.batch_size
         for e in range(1, self.epoches+1):
             self.step = 0
@@ -67,7 +72,7 @@ class BILSTM_Model(object):
                     batch_tags = tag_lists[ind:ind+B]
 
                     losses += self.train_step(batch_sents,
-                                            batch_tags, word2id, tag2id)
+                                            batch_tags, word_encoder, tag2id)
 
                     if self.step % TrainingConfig.print_step == 0:
                         inds.set_postfix_str("Loss:{:.4f}".format(losses / self.print_step))
@@ -104,6 +109,7 @@ class BILSTM_Model(object):
     def validate(self, dev_word_lists, dev_tag_lists, word2id, tag2id):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model.eval()   # model 进入测试状态
+        word_encoder = TokenEncoder(word2id)
         with torch.no_grad():   # 停止 autograd 模块的工作
             val_losses = 0.
             val_step = 0
@@ -113,7 +119,7 @@ class BILSTM_Model(object):
                 batch_sents = dev_word_lists[ind:ind+self.batch_size]
                 batch_tags = dev_tag_lists[ind:ind+self.batch_size]
                 tensorized_sents, lengths = tensorized(
-                    batch_sents, word2id)
+                    batch_sents, word_encoder)
                 tensorized_sents = tensorized_sents.to(self.device)
                 targets, lengths = tensorized(batch_tags, tag2id)
                 targets = targets.to(self.device)
@@ -134,16 +140,41 @@ class BILSTM_Model(object):
 
             return val_loss
 
+    def freeze(self):
+        """
+        仅用于推理: 合并best_model的embedding(见BiLSTM.freeze_embedding), 并丢弃训练用的model和优化器,
+        使768维的bert向量表不再常驻内存. 调用后不能再训练
+        """
+        self.best_model.bilstm.freeze_embedding()
+        self.model = self.best_model
+        self.optimizer = None
+
+    def quantize(self):
+        """
+        返回best_model经动态int8量化后的BILSTM_Model副本, 原模型不受影响. 量化后的模型只能在CPU上推理
+        """
+        quantized = copy(self)
+        quantized.best_model = self.best_model.quantize()
+        quantized.quantized = True
+        return quantized
+
+    def __infer_device(self):
+        # 量化模型只能在CPU上推理
+        if self.quantized:
+            return torch.device("cpu")
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
     def test(self, word_lists, tag_lists, word2id, tag2id):
         """返回最佳模型在测试集上的预测结果"""
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = self.__infer_device()
         # 准备数据
         word_lists, tag_lists, indices = sort_by_lengths(word_lists, tag_lists)
         tensorized_sents, lengths = tensorized(word_lists, word2id)
         tensorized_sents = tensorized_sents.to(self.device)
 
         self.best_model.eval()
-        self.best_model.bilstm.bilstm.flatten_parameters()
+        if not self.quantized:
+            self.best_model.bilstm.bilstm.flatten_parameters()
         with torch.no_grad():
             batch_tagids = self.best_model.test(
                 tensorized_sents, lengths, tag2id)
@@ -151,15 +182,12 @@ class BILSTM_Model(object):
         # 将id转化为标注
         pred_tag_lists = []
         id2tag = dict((id_, tag) for tag, id_ in tag2id.items())   # 反转字典
-        for i, ids in enumerate(batch_tagids):
-            tag_list = []
+        for i, ids in enumerate(batch_tagids.tolist()):   # 一次性拷回host, 不再逐元素.item()
             if self.crf:
-                for j in range(lengths[i] - 1):  # crf解码过程中，end被舍弃
-                    tag_list.append(id2tag[ids[j].item()])   # ids[j] 也是个张量
+                ids = ids[:lengths[i] - 1]  # crf解码过程中，end被舍弃
             else:
-                for j in range(lengths[i]):
-                    tag_list.append(id2tag[ids[j].item()])
-            pred_tag_lists.append(tag_list)
+                ids = ids[:lengths[i]]
+            pred_tag_lists.append([id2tag[id_] for id_ in ids])
 
         # indices存有根据长度排序后的索引映射的信息
         # 比如若indices = [1, 2, 0] 则说明原先索引为1的元素映射到的新的索引是0，
@@ -175,7 +203,7 @@ class BILSTM_Model(object):
 
     def predict(self, word_lists, word2id, tag2id):
         """返回最佳模型在测试集上的预测结果"""
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = self.__infer_device()
         # 准备数据
         tag_lists = deepcopy(word_lists)
         word_lists, tag_lists, indices = sort_by_lengths(word_lists, tag_lists)
@@ -183,7 +211,8 @@ class BILSTM_Model(object):
         tensorized_sents = tensorized_sents.to(self.device)
 
         self.best_model.eval()
-        self.best_model.bilstm.bilstm.flatten_parameters()
+        if not self.quantized:
+            self.best_model.bilstm.bilstm.flatten_parameters()
         with torch.no_grad():
             batch_tagids = self.best_model.test(
                 tensorized_sents, lengths, tag2id)
@@ -191,15 +220,12 @@ class BILSTM_Model(object):
         # 将id转化为标注
         pred_tag_lists = []
         id2tag = dict((id_, tag) for tag, id_ in tag2id.items())
-        for i, ids in enumerate(batch_tagids):
-            tag_list = []
+        for i, ids in enumerate(batch_tagids.tolist()):   # 一次性拷回host, 不再逐元素.item()
             if self.crf:
-                for j in range(lengths[i] - 1):  # crf解码过程中，end被舍弃
-                    tag_list.append(id2tag[ids[j].item()])
+                ids = ids[:lengths[i] - 1]  # crf解码过程中，end被舍弃
             else:
-                for j in range(lengths[i]):
-                    tag_list.append(id2tag[ids[j].item()])
-            pred_tag_lists.append(tag_list)
+                ids = ids[:lengths[i]]
+            pred_tag_lists.append([id2tag[id_] for id_ in ids])
 
         # indices存有根据长度排序后的索引映射的信息
         # 比如若indices = [1, 2, 0] 则说明原先索引为1的元素映射到的新的索引是0，
@@ -247,80 +273,28 @@ class BiLSTM_CRF(nn.Module):
 
         return crf_scores
 
-    def test(self, test_sents_tensor, lengths, tag2id):
+    def test(self, test_sents_tensor, lengths, tag2id, use_numpy=False):
+        """使用维特比算法进行解码, 返回 [B, L-1] 的标记id(去掉了<end>, 以<pad>填充)
+           use_numpy为True时在CPU上用numpy实现解码, 结果与默认的torch实现一致"""
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        """使用维特比算法进行解码"""
         start_id = tag2id['<start>']
         end_id = tag2id['<end>']
         pad = tag2id['<pad>']
-        tagset_size = len(tag2id)
 
-        crf_scores = self.forward(test_sents_tensor, lengths)
-        device = crf_scores.device
-        # B:batch_size, L:max_len, T:target set size
-        B, L, T, _ = crf_scores.size()
-        # viterbi[i, j, k]表示第i个句子，第j个字对应第k个标记的最大分数
-        viterbi = torch.zeros(B, L, T).to(device)
-        # backpointer[i, j, k]表示第i个句子，第j个字对应第k个标记时前一个标记的id，用于回溯
-        backpointer = (torch.zeros(B, L, T).long() * end_id).to(device)
-        lengths = torch.LongTensor(lengths).to(device)
-        # 向前递推
-        for step in range(L):
-            batch_size_t = (lengths > step).sum().item()
-            if step == 0:
-                # 第一个字它的前一个标记只能是start_id
-                viterbi[:batch_size_t, step,
-                        :] = crf_scores[: batch_size_t, step, start_id, :]
-                backpointer[: batch_size_t, step, :] = start_id
-            else:
-                max_scores, prev_tags = torch.max(
-                    viterbi[:batch_size_t, step-1, :].unsqueeze(2) +
-                    crf_scores[:batch_size_t, step, :, :],     # [B, T, T]
-                    dim=1
-                )
-                viterbi[:batch_size_t, step, :] = max_scores
-                backpointer[:batch_size_t, step, :] = prev_tags
-
-        # 在回溯的时候我们只需要用到backpointer矩阵
-        backpointer = backpointer.view(B, -1)  # [B, L * T]
-        tagids = []  # 存放结果
-        tags_t = None
-        for step in range(L-1, 0, -1):
-            batch_size_t = (lengths > step).sum().item()
-            if step == L-1:
-                index = torch.ones(batch_size_t).long() * (step * tagset_size)
-                index = index.to(device)
-                index += end_id
-            else:
-                prev_batch_size_t = len(tags_t)
-
-                new_in_batch = torch.LongTensor(
-                    [end_id] * (batch_size_t - prev_batch_size_t)).to(device)
-                offset = torch.cat(
-                    [tags_t, new_in_batch],
-                    dim=0
-                )  # 这个offset实际上就是前一时刻的
-                index = torch.ones(batch_size_t).long() * (step * tagset_size)
-                index = index.to(device)
-                index += offset.long()
-
-            try:
-                tags_t = backpointer[:batch_size_t].gather(
-                    dim=1, index=index.unsqueeze(1).long())
-            except RuntimeError:
-                import pdb
-                pdb.set_trace()
-            tags_t = tags_t.squeeze(1)
-            tagids.append(tags_t.tolist())
-
-        # tagids:[L-1]（L-1是因为扣去了end_token),大小的liebiao
-        # 其中列表内的元素是该batch在该时刻的标记
-        # 下面修正其顺序，并将维度转换为 [B, L]
-        tagids = list(zip_longest(*reversed(tagids), fillvalue=pad))
-        tagids = torch.Tensor(tagids).long()
-
-        # 返回解码的结果
-        return tagids
+        # 推理时只需要 [B, L, out_size] 的发射分数, 转移矩阵在解码的递推中再加上,
+        # 不必像forward那样展开成 [B, L, out_size, out_size] 的crf_scores
+        emission = self.bilstm(test_sents_tensor, lengths)
+        if use_numpy:
+            tagids = viterbi_decode_np(emission.cpu().numpy(), self.transition.detach().cpu().numpy(),
+                                       np.asarray(lengths), start_id, end_id, pad)
+            return torch.from_numpy(tagids)
+
+        lengths = torch.as_tensor(lengths, dtype=torch.long, device=emission.device)
+        return viterbi_decode(emission, self.transition, lengths, start_id, end_id, pad)
+
+    def quantize(self):
+        """返回动态int8量化后的副本, 转移矩阵保持不变, 见quantize_dynamic"""
+        return quantize_dynamic(self)
 
     def check_transmat(self, prohibitions, restrictions, tag2id):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -0,0 +1,129 @@
+import json
+import zipfile
+from copy import deepcopy
+from typing import Dict, List
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pad_packed_sequence, pack_padded_sequence
+
+from .util import tensorized, sort_by_lengths, TokenEncoder
+from .viterbi import viterbi_decode
+
+
+class BiLSTM_CRF_Inference(nn.Module):
+    """只包含推理所需部分的BiLSTM_CRF, 可以用torch.jit.script导出
+
+    与训练用的BiLSTM_CRF相比:
+        1. embedding经BiLSTM.freeze_embedding合并为一张表
+        2. 去掉了推理时不起作用的dropout
+        3. 转移矩阵为已经应用过check_transmat约束的结果
+        4. forward直接返回维特比解码后的标记id
+    """
+
+    def __init__(self, embedding: torch.Tensor, bilstm: nn.LSTM, lin: nn.Linear, transition: torch.Tensor,
+                 start_id: int, end_id: int, pad_id: int):
+        super(BiLSTM_CRF_Inference, self).__init__()
+        self.embedding = nn.Embedding.from_pretrained(embedding)
+        self.bilstm = bilstm
+        self.lin = lin
+        self.register_buffer("transition", transition)
+        self.start_id = start_id
+        self.end_id = end_id
+        self.pad_id = pad_id
+
+    @classmethod
+    def from_model(cls, model, tag2id: Dict[str, int]):
+        """
+        由训练得到的BiLSTM_CRF(即BILSTM_Model.best_model)构造推理模块, 调用前需先对model执行check_transmat
+        """
+        bilstm = deepcopy(model.bilstm)
+        bilstm.freeze_embedding()
+        embedding = bilstm.embedding.weight.detach()
+        module = cls(embedding.cpu(), bilstm.bilstm, bilstm.lin, model.transition.detach().clone().cpu(),
+                     tag2id['<start>'], tag2id['<end>'], tag2id['<pad>'])
+        return module.cpu().eval()
+
+    def forward(self, sents_tensor: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        """
+        sents_tensor: [B, L], lengths: [B] 且按降序排列(位于CPU上)
+        返回 [B, L-1] 的标记id
+        """
+        emb = self.embedding(sents_tensor)  # [B, L, emb_size]
+        packed = pack_padded_sequence(emb, lengths, batch_first=True)
+        rnn_out, _ = self.bilstm(packed)
+        rnn_out, _ = pad_packed_sequence(rnn_out, batch_first=True)
+        emission = self.lin(rnn_out)  # [B, L, out_size]
+        return viterbi_decode(emission, self.transition, lengths, self.start_id, self.end_id, self.pad_id)
+
+
+class ScriptedBiLSTM_CRF(object):
+    """
+    加载导出的TorchScript模型(见ner/export.py), 提供与BILSTM_Model.predict相同的接口.
+    word2id和tag2id以json的形式保存在模型文件的extra files中, 加载时不需要再读取其他pkl文件.
+    导出时所用bilstm_crf.pkl的sha1也保存在其中, 用于判断导出的模型是否已经过时, 见source_sha1
+    """
+    EXTRA_WORD2ID = "crf_word2id.json"
+    EXTRA_TAG2ID = "crf_tag2id.json"
+    EXTRA_SOURCE_SHA1 = "source_sha1.txt"
+
+    def __init__(self, module, word2id: Dict[str, int], tag2id: Dict[str, int], device="cpu"):
+        self.module = module
+        self.word2id = word2id
+        self.tag2id = tag2id
+        self.word_encoder = TokenEncoder(word2id)
+        self.device = torch.device(device)
+
+    @classmethod
+    def save(cls, module: BiLSTM_CRF_Inference, file_name: str, word2id: Dict[str, int], tag2id: Dict[str, int],
+             source_sha1: str = ""):
+        """将推理模块script并freeze(参数折叠为常量)后, 连同word2id、tag2id和导出所用pkl模型的sha1一起保存"""
+        scripted = torch.jit.freeze(torch.jit.script(module.eval()))
+        extra_files = {
+            cls.EXTRA_WORD2ID: json.dumps(word2id, ensure_ascii=False),
+            cls.EXTRA_TAG2ID: json.dumps(tag2id, ensure_ascii=False),
+            cls.EXTRA_SOURCE_SHA1: source_sha1,
+        }
+        torch.jit.save(scripted, file_name, _extra_files=extra_files)
+
+    @classmethod
+    def load(cls, file_name: str, device="cpu"):
+        extra_files = {cls.EXTRA_WORD2ID: "", cls.EXTRA_TAG2ID: ""}
+        module = torch.jit.load(file_name, map_location=torch.device(device), _extra_files=extra_files)
+        module.eval()
+        word2id = json.loads(extra_files[cls.EXTRA_WORD2ID])
+        tag2id = json.loads(extra_files[cls.EXTRA_TAG2ID])
+        return cls(module, word2id, tag2id, device)
+
+    @classmethod
+    def source_sha1(cls, file_name: str) -> str:
+        """
+        返回导出file_name时所用pkl模型的sha1, 没有记录时返回空字符串. 只读取模型文件(zip)中的一项, 不加载模型
+        """
+        with zipfile.ZipFile(file_name) as f:
+            for name in f.namelist():
+                if name.endswith("/extra/" + cls.EXTRA_SOURCE_SHA1):
+                    return f.read(name).decode("utf-8")
+        return ""
+
+    def predict(self, word_lists: List[List[str]], word2id: Dict[str, int] = None, tag2id: Dict[str, int] = None) -> List[List[str]]:
+        """返回预测的标记序列, word2id和tag2id缺省时使用模型文件中保存的映射"""
+        word2id = self.word_encoder if word2id is None or word2id is self.word2id else word2id
+        tag2id = self.tag2id if tag2id is None else tag2id
+
+        word_lists, _, indices = sort_by_lengths(word_lists, word_lists)
+        tensorized_sents, lengths = tensorized(word_lists, word2id)
+        tensorized_sents = tensorized_sents.to(self.device)
+
+        # 关闭profiling执行器的图优化: 模型已在导出时freeze, 再做优化收益很小, 却会让前几次调用多花数十毫秒
+        with torch.no_grad(), torch.jit.optimized_execution(False):
+            batch_tagids = self.module(tensorized_sents, torch.LongTensor(lengths))
+
+        # 将id转化为标注, crf解码过程中end被舍弃
+        id2tag = dict((id_, tag) for tag, id_ in tag2id.items())
+        pred_tag_lists = [[id2tag[id_] for id_ in ids[:lengths[i] - 1]]
+                          for i, ids in enumerate(batch_tagids.tolist())]
+
+        # 根据indices将pred_tag_lists转化为原来的顺序
+        ind_maps = sorted(list(enumerate(indices)), key=lambda e: e[1])
+        indices, _ = list(zip(*ind_maps))
+        return [pred_tag_lists[i] for i in indices]
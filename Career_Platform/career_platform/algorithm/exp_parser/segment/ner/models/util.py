@@ -1,3 +1,5 @@
+from itertools import chain
+import numpy as np
 import torch
 import torch.nn.functional as F
 
@@ -30,22 +32,60 @@ def sent2features(sent):
 
 # ******** LSTM模型 工具函数*************
 
-def tensorized(batch, maps):
-    PAD = maps.get('<pad>')
-    UNK = maps.get('<unk>')
-
-    max_len = len(batch[0])
-    # max_len = max(len(s) for s in batch)
-    batch_size = len(batch)
+class TokenEncoder(object):
+    """将token序列批量编码为id矩阵
+       单字符token通过预先计算好的 码位->id 查找表一次性映射, <end>等多字符token映射到代理区的占位码位后同样查表,
+       整个batch只做一次numpy查表, 不再逐元素写张量.
+       查找表在构建时由maps生成, 之后maps的修改不会反映到编码结果中"""
+
+    # 多字符token的占位码位从代理区开始分配, 正常解码得到的文本里不会出现单独的代理码位
+    ALIAS_BASE = 0xD800
+
+    def __init__(self, maps):
+        self.maps = maps
+        self.size = len(maps)
+        self.pad = maps.get('<pad>')
+        self.unk = maps.get('<unk>')
+
+        # 多字符token -> 占位字符
+        multi_tokens = [token for token in maps.keys() if len(token) != 1]
+        self.alias = {token: chr(self.ALIAS_BASE + i) for i, token in enumerate(multi_tokens)}
+        self.unk_alias = chr(self.ALIAS_BASE + len(multi_tokens))
+
+        # 码位 -> id 查找表, 不在maps中的码位都查到<unk>
+        single_codes = [ord(token) for token in maps.keys() if len(token) == 1]
+        table_size = max(single_codes + [ord(self.unk_alias)]) + 1
+        self.lookup = np.full(table_size, self.unk, dtype=np.int64)
+        for token, id_ in maps.items():
+            code = ord(token) if len(token) == 1 else ord(self.alias[token])
+            self.lookup[code] = id_
+
+    def encode(self, batch):
+        """返回 [B, L] 的id矩阵(padding为<pad>)以及batch中各序列的长度"""
+        lengths = [len(l) for l in batch]
+        batch_size, max_len = len(batch), max(lengths, default=0)
+
+        tokens = list(chain.from_iterable(batch))
+        text = "".join(tokens)
+        if len(text) != len(tokens):    # 含有多字符token, 先替换为占位字符
+            text = "".join([t if len(t) == 1 else self.alias.get(t, self.unk_alias) for t in tokens])
+        codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        # 超出查找表范围的码位(如emoji)同样视为<unk>
+        ids = np.where(codes < len(self.lookup), self.lookup[np.minimum(codes, len(self.lookup) - 1)], self.unk)
+
+        # 按行优先把ids填入mask为True的位置, 正好对应各序列依次拼接的顺序
+        ids_matrix = np.full((batch_size, max_len), self.pad, dtype=np.int64)
+        mask = np.arange(max_len)[None, :] < np.asarray(lengths)[:, None]
+        ids_matrix[mask] = ids
+
+        return torch.from_numpy(ids_matrix), lengths
 
-    batch_tensor = torch.ones(batch_size, max_len).long() * PAD
-    for i, l in enumerate(batch):
-        for j, e in enumerate(l):
-            batch_tensor[i][j] = maps.get(e, UNK)
-    # batch各个元素的长度
-    lengths = [len(l) for l in batch]
 
-    return batch_tensor, lengths
+def tensorized(batch, maps):
+    """maps可以是word2id/tag2id词典, 也可以是由其构建的TokenEncoder.
+       传入词典时每次调用都会重新构建查找表, 反复编码的调用方应自己持有TokenEncoder(如BCTokenizer.crf_word_encoder)"""
+    encoder = maps if isinstance(maps, TokenEncoder) else TokenEncoder(maps)
+    return encoder.encode(batch)
 
 
 def sort_by_lengths(word_lists, tag_lists):
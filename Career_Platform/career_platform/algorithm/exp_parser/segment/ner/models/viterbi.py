@@ -0,0 +1,79 @@
+from typing import List
+import numpy as np
+import torch
+
+
+def viterbi_decode(emission: torch.Tensor, transition: torch.Tensor, lengths: torch.Tensor,
+                   start_id: int, end_id: int, pad_id: int) -> torch.Tensor:
+    """维特比解码, 向前递推和回溯都在emission所在的设备上完成
+
+    lengths需按降序排列(与pack_padded_sequence的要求一致). 各时刻的有效batch大小由长度mask一次性算出,
+    之后每一步只在有效的前缀上计算, 递推过程中不再需要把数据同步回host.
+    转移矩阵在递推的每一步里才与当前字的发射分数相加, 不再构造 [B, L, T, T] 的crf分数,
+    同一时刻只存在一个 [B_t, T, T] 的临时张量
+
+    参数:
+        emission: [B, L, T], BiLSTM层输出的发射分数
+        transition: [T, T], transition[i, j]表示上一标记为i、当前标记为j的转移分数
+        lengths: [B], 各句子的长度(包含<end>)
+    返回:
+        [B, L-1] 的标记id, 每个句子去掉<end>后的有效部分之后以pad_id填充
+    """
+    B, L, T = emission.size()
+    device = emission.device
+    lengths = lengths.to(device)
+    # mask[b, t]表示第b个句子的第t个字是否有效, batch_sizes[t]为t时刻有效的句子数
+    mask = torch.arange(L, device=device).unsqueeze(0) < lengths.unsqueeze(1)  # [B, L]
+    batch_sizes: List[int] = mask.sum(dim=0).tolist()
+
+    # 向前递推, viterbi[b, k]表示第b个句子当前字对应第k个标记的最大分数
+    # 加法顺序与BiLSTM_CRF.forward中的crf_scores保持一致(先发射+转移, 再加上一时刻的分数), 解码结果逐位相同
+    viterbi = emission[:, 0, :] + transition[start_id]
+    # backpointers[t-1][b, k]表示第b个句子第t个字对应第k个标记时前一个标记的id, 用于回溯
+    backpointers: List[torch.Tensor] = []
+    for step in range(1, L):
+        batch_size_t = batch_sizes[step]
+        viterbi, prev_tags = torch.max(
+            viterbi[:batch_size_t].unsqueeze(2) + (emission[:batch_size_t, step].unsqueeze(1) + transition),  # [B_t, T, T]
+            dim=1
+        )
+        backpointers.append(prev_tags)
+
+    # 回溯, 每个句子最后一个字(<end>)的标记固定为end_id
+    tagids = torch.full((B, max(L - 1, 0)), pad_id, dtype=torch.long, device=device)
+    cur_tags = torch.full((B,), end_id, dtype=torch.long, device=device)
+    for step in range(L - 1, 0, -1):
+        batch_size_t = batch_sizes[step]
+        prev_tags = backpointers[step - 1].gather(1, cur_tags[:batch_size_t].unsqueeze(1)).squeeze(1)
+        tagids[:batch_size_t, step - 1] = prev_tags
+        # 在step时刻已经结束的句子, 当前标记仍停留在end_id
+        cur_tags = torch.cat([prev_tags, cur_tags[batch_size_t:]])
+
+    return tagids
+
+
+def viterbi_decode_np(emission: np.ndarray, transition: np.ndarray, lengths: np.ndarray,
+                      start_id: int, end_id: int, pad_id: int) -> np.ndarray:
+    """viterbi_decode的numpy实现, 可在没有torch运行时的CPU环境下解码, 结果与viterbi_decode一致"""
+    B, L, T = emission.shape
+    mask = np.arange(L)[None, :] < np.asarray(lengths)[:, None]     # [B, L]
+    batch_sizes = mask.sum(axis=0).tolist()
+
+    viterbi = emission[:, 0, :] + transition[start_id]
+    backpointers = []
+    for step in range(1, L):
+        batch_size_t = batch_sizes[step]
+        scores = viterbi[:batch_size_t, :, None] + (emission[:batch_size_t, step, None, :] + transition)   # [B_t, T, T]
+        prev_tags = scores.argmax(axis=1)
+        viterbi = np.take_along_axis(scores, prev_tags[:, None, :], axis=1)[:, 0, :]
+        backpointers.append(prev_tags)
+
+    tagids = np.full((B, max(L - 1, 0)), pad_id, dtype=np.int64)
+    cur_tags = np.full((B,), end_id, dtype=np.int64)
+    for step in range(L - 1, 0, -1):
+        batch_size_t = batch_sizes[step]
+        prev_tags = np.take_along_axis(backpointers[step - 1], cur_tags[:batch_size_t, None], axis=1)[:, 0]
+        tagids[:batch_size_t, step - 1] = prev_tags
+        cur_tags = np.concatenate([prev_tags, cur_tags[batch_size_t:]])
+
+    return tagids
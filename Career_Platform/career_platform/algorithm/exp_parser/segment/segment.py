@@ -2,51 +2,142 @@ import os, sys
 import pickle
 from typing import *
 import re
-import copy
-from ....common import Experience
+import warnings
+from ....common import Experience, ExperienceTable
+from ...utils import file_digest
 import torch
 
 from . import ner
 sys.modules['ner'] = ner
+from .ner.models.inference import ScriptedBiLSTM_CRF
+from .ner.models.util import TokenEncoder
 
 CKPT_PATH = os.path.join(os.path.dirname(__file__), "ner/ckpts")
+SEGMENT_BATCH_SIZE = 512    # 批量NER时每个批次的最大split子串数量
+SEGMENT_BUFFER_SIZE = 8192  # segment_iter中缓冲的split子串数量, 达到后统一分桶送入模型
 
-__all__ = ["segment"]   # 只对外暴露segment函数
+__all__ = ["segment", "segment_iter"]   # 只对外暴露segment和segment_iter函数
 
 
-def segment(exp_list:List[Experience], in_position:bool=False, callback:Callable=None) -> List[Experience]:
+def segment(exp_list:List[Experience], in_position:bool=False, callback:Callable=None, batch_size:int=SEGMENT_BATCH_SIZE, quantize:bool=False) -> List[Experience]:
     """
     对列表中每一个Experience的text_rawsplit中的每一个split进行: NER分词->去除U标签
 
+    所有Experience的split子串会被汇总后按长度分桶, 以不超过batch_size的批次送入模型, 再按顺序分发回各自的Experience.
     结果保存在text_rawtoken
 
     Params:
-        exp_list: 传入的经历列表
-        in_position: True则在传入exp_list上原地修改并返回原exp_list. False则深拷贝后修改并返回新的
-        callback: 回调函数, 需要能够接收一个包含函数执行状态信息的dict, 可以用来查看执行进度
+        exp_list: 传入的经历列表或ExperienceTable
+        in_position: True则在传入exp_list上原地修改并返回原exp_list. False则复制(Experience.copy)后修改并返回新的
+        callback: 回调函数, 需要能够接收一个包含函数执行状态信息的dict, 可以用来查看执行进度. total为经历数量, 每个批次解析完成后汇报一次已完成的经历
+        batch_size: 每次送入模型的最大split子串数量
+        quantize: True则使用动态int8量化的模型推理(仅CPU), 速度更快但结果可能与原模型有少量差异
     """
-    if not in_position:
-        exp_list = copy.deepcopy(exp_list)
-
-    tokenizer = BCTokenizer()
+    if isinstance(exp_list, ExperienceTable):
+        exp_list = exp_list.to_experiences()    # 取出的每一行都是新的Experience, 不需要再复制, in_position对它无效
+    elif not in_position:
+        exp_list = [exp.copy() for exp in exp_list]
 
+    tokenizer = BCTokenizer(quantize=quantize)
     # 用于传入callback的状态字典
     __status_dict = {
         "description": "[exp_parser]-segment",
         "total": len(exp_list),
         "iternum": 0
     }
-    for iternum, exp in enumerate(exp_list):
+    return _segment_buffer(tokenizer, exp_list, batch_size=batch_size, callback=callback, status_dict=__status_dict)
+
+
+def segment_iter(exp_iter:Iterable[Experience], in_position:bool=False, callback:Callable=None, batch_size:int=SEGMENT_BATCH_SIZE,
+                 buffer_size:int=SEGMENT_BUFFER_SIZE, quantize:bool=False) -> Iterator[Experience]:
+    """
+    segment的生成器版本. 从exp_iter中读入Experience, 每缓冲到buffer_size个split子串就按segment的方式分桶批量解析,
+    再按输入顺序产出这一批Experience. 内存占用只与buffer_size有关, 与输入规模无关
+
+    Params:
+        exp_iter: 传入的经历, 可以是任意可迭代对象
+        in_position: True则在传入的Experience上原地修改. False则复制后修改
+        callback: 回调函数, 见segment. exp_iter的长度已知时total为其长度, 否则为None
+        batch_size: 每次送入模型的最大split子串数量
+        buffer_size: 缓冲的split子串数量. 越大分桶后的padding越少, 但占用内存越多
+        quantize: 见segment
+    """
+    tokenizer = BCTokenizer(quantize=quantize)
+    # 用于传入callback的状态字典, iternum在各缓冲区之间累计
+    __status_dict = {
+        "description": "[exp_parser]-segment",
+        "total": len(exp_iter) if isinstance(exp_iter, Sized) else None,
+        "iternum": 0
+    }
+    done_num = 0    # 之前的缓冲区中已完成的Experience数量
+
+    buffer:List[Experience] = []
+    split_num = 0
+    for exp in exp_iter:
+        if not in_position:
+            exp = exp.copy()
+        buffer.append(exp)
         if exp.text_rawsplit is not None:
-            split_list = exp.text_rawsplit.split("|")
-            text_rawtoken = "|".join(tokenizer.parse_strings(split_list))  # 对text_rawsplit的每一个split子串进行: NER分词、去除U标签
-            exp.text_rawtoken = text_rawtoken if text_rawtoken != "" else None
+            split_num += exp.text_rawsplit.count("|") + 1
+        if split_num >= buffer_size:
+            yield from _segment_buffer(tokenizer, buffer, batch_size=batch_size, callback=callback,
+                                       status_dict=__status_dict, done_num=done_num)
+            done_num += len(buffer)
+            buffer = []
+            split_num = 0
 
-        # 调用callback函数
-        __status_dict["iternum"] = iternum
+    yield from _segment_buffer(tokenizer, buffer, batch_size=batch_size, callback=callback,
+                               status_dict=__status_dict, done_num=done_num)
+
+
+def _segment_buffer(tokenizer:"BCTokenizer", exp_list:List[Experience], batch_size:int=SEGMENT_BATCH_SIZE, callback:Callable=None,
+                    status_dict:Dict=None, done_num:int=0) -> List[Experience]:
+    """
+    对exp_list中的Experience原地进行NER分词, 并返回exp_list.
+
+    与逐条解析时一样按Experience汇报进度: 每个桶的结果分发回去后, 以done_num加上split子串已全部解析完的Experience数量更新status_dict的iternum并调用callback
+    """
+    # 1. 汇总所有Experience的split子串, 并记录每个子串所属Experience在exp_list中的下标
+    split_list:List[str] = []
+    owner_list:List[int] = []
+    for idx, exp in enumerate(exp_list):
+        if exp.text_rawsplit is not None:
+            for split in exp.text_rawsplit.split("|"):
+                split_list.append(split)
+                owner_list.append(idx)
+
+    # 每个Experience还未解析的split子串数量, 没有split子串的Experience直接算作已完成
+    remain_list = [0] * len(exp_list)
+    for idx in owner_list:
+        remain_list[idx] += 1
+    finished_num = remain_list.count(0)
+
+    def __bucket_done(bucket:List[int]):
+        nonlocal finished_num
+        for i in bucket:
+            remain_list[owner_list[i]] -= 1
+            if remain_list[owner_list[i]] == 0:
+                finished_num += 1
+        # 调用callback函数, iternum与逐条解析时一样为最后一个完成的Experience的序号
         if callback is not None:
-            callback(__status_dict)
-    
+            status_dict["iternum"] = done_num + finished_num - 1
+            callback(status_dict)
+
+    # 2. 按长度分桶批量进行NER分词、去除U标签
+    token_list = tokenizer.parse_strings_batched(split_list, batch_size=batch_size, bucket_callback=__bucket_done)
+    if len(split_list) == 0 and len(exp_list) > 0:
+        __bucket_done([])
+
+    # 3. 将结果分发回各自的Experience, 空结果不参与拼接
+    rawtoken_dict:Dict[int, List[str]] = {}
+    for idx, token in zip(owner_list, token_list):
+        if token != "":
+            rawtoken_dict.setdefault(idx, []).append(token)
+    for idx, exp in enumerate(exp_list):
+        if exp.text_rawsplit is not None:
+            text_rawtoken = "|".join(rawtoken_dict.get(idx, []))
+            exp.text_rawtoken = text_rawtoken if text_rawtoken != "" else None
+
     return exp_list
 
 
@@ -58,7 +149,9 @@ class BCTokenizer():
     # 存放模型的类变量，全局单例
     crf_word2id = None
     crf_tag2id = None
+    crf_word_encoder = None     # 由crf_word2id构建的TokenEncoder, 每个批次编码时复用
     bilstm_model = None
+    quantized_model = None  # 动态int8量化的模型, 仅在需要时加载
 
     # 禁止转移
     prohibitions = {
@@ -83,17 +176,70 @@ class BCTokenizer():
                     # "MU": ["MU", "EU"],
                     }
 
-    def __init__(self):
+    def __init__(self, quantize:bool=False):
         if self.bilstm_model is None:   # 仅在全局第一次实例化BCTokenizer时加载模型
             self.__init_model()   
+        if quantize and self.quantized_model is None:
+            self.__init_quantized_model()
+        self.model = self.quantized_model if quantize else self.bilstm_model
     
+    @classmethod
+    def model_paths(cls, quantize:bool=False) -> List[str]:
+        """
+        返回加载模型时会读取的文件路径(不加载模型), 与__init_model和__init_quantized_model的选择逻辑一致. 用于计算模型版本, 见ParseCache
+        """
+        script_path = cls.__script_path(quantize)
+        if script_path is not None:
+            return [script_path]
+        return [os.path.join(CKPT_PATH, name) for name in ['crf_word2id.pkl', 'crf_tag2id.pkl', 'bilstm_crf.pkl']]
+
+    @staticmethod
+    def __script_path(quantize:bool=False) -> str or None:
+        """
+        返回ner/export.py导出的TorchScript模型的路径. 模型不存在, 或导出时所用的bilstm_crf.pkl已被替换(如重新训练后忘记重新导出)时返回None
+        """
+        script_path = os.path.join(CKPT_PATH, 'bilstm_crf_script_int8.pt' if quantize else 'bilstm_crf_script.pt')
+        if not os.path.exists(script_path):
+            return None
+        pkl_path = os.path.join(CKPT_PATH, 'bilstm_crf.pkl')
+        if os.path.exists(pkl_path) and ScriptedBiLSTM_CRF.source_sha1(script_path) != file_digest(pkl_path):
+            warnings.warn("{}不是由当前的bilstm_crf.pkl导出的, 改为加载bilstm_crf.pkl. 请重新运行ner/export.py".format(script_path))
+            return None
+        return script_path
+
     @classmethod
     def __init_model(cls):
+        # 优先加载ner/export.py导出的TorchScript模型, 其中已包含word2id, tag2id和应用过约束的转移矩阵
+        script_path = cls.__script_path()
+        if script_path is not None:
+            cls.bilstm_model = ScriptedBiLSTM_CRF.load(script_path, device=('cuda' if torch.cuda.is_available() else 'cpu'))
+            cls.crf_word2id = cls.bilstm_model.word2id
+            cls.crf_tag2id = cls.bilstm_model.tag2id
+            cls.crf_word_encoder = cls.bilstm_model.word_encoder
+            return
+
         cls.crf_word2id = cls.__load_model(os.path.join(CKPT_PATH,'crf_word2id.pkl'), device="cpu")
         cls.crf_tag2id = cls.__load_model(os.path.join(CKPT_PATH,'crf_tag2id.pkl'), device="cpu")
+        cls.crf_word_encoder = TokenEncoder(cls.crf_word2id)
         cls.bilstm_model = cls.__load_model(os.path.join(CKPT_PATH, 'bilstm_crf.pkl'), device=('cuda' if torch.cuda.is_available() else 'cpu'))
         cls.bilstm_model.best_model.check_transmat(cls.prohibitions, cls.restrictions, cls.crf_tag2id)
-        cls.bilstm_model.model.bilstm.bilstm.flatten_parameters()  # remove warning
+        cls.bilstm_model.freeze()   # 合并embedding并丢弃训练用的model和优化器
+        cls.bilstm_model.best_model.bilstm.bilstm.flatten_parameters()  # remove warning
+
+    @classmethod
+    def __init_quantized_model(cls):
+        # 优先加载ner/export.py --quantize导出的量化TorchScript模型, 否则对pickle模型做动态量化
+        script_path = cls.__script_path(quantize=True)
+        if script_path is not None:
+            cls.quantized_model = ScriptedBiLSTM_CRF.load(script_path, device="cpu")
+            return
+
+        model = cls.bilstm_model
+        if isinstance(model, ScriptedBiLSTM_CRF):
+            model = cls.__load_model(os.path.join(CKPT_PATH, 'bilstm_crf.pkl'), device=('cuda' if torch.cuda.is_available() else 'cpu'))
+            model.best_model.check_transmat(cls.prohibitions, cls.restrictions, cls.crf_tag2id)
+            model.freeze()
+        cls.quantized_model = model.quantize()
 
     @staticmethod
     def __load_model(file_name:str, device="cpu"):
@@ -139,20 +285,42 @@ class BCTokenizer():
 
     def parse_strings(self, text_list:List[str]) -> List[str]:
         """
-        对字符串列表中的每一个字符串进行NER解析
+        对字符串列表中的每一个字符串进行NER解析, 结果为空的字符串会被丢弃
         """
-        
+        return [segment for segment in self.__parse_batch(text_list) if segment != ""]
+
+    def parse_strings_batched(self, text_list:List[str], batch_size:int=SEGMENT_BATCH_SIZE,
+                              bucket_callback:Callable[[List[int]], None]=None) -> List[str]:
+        """
+        对字符串列表中的每一个字符串进行NER解析. 字符串先按长度排序分桶, 每个桶不超过batch_size个字符串, 逐桶送入模型.
+
+        返回与text_list等长且顺序一致的结果列表, 解析结果为空的位置为空字符串.
+        bucket_callback: 每个桶的结果写回后, 以桶中字符串在text_list中的下标调用, 用于汇报进度
+        """
+        # 长度相近的字符串放进同一个桶, 减少每个批次里的padding
+        order = sorted(range(len(text_list)), key=lambda i: len(text_list[i]), reverse=True)
+        results = [""] * len(text_list)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start+batch_size]
+            segments = self.__parse_batch([text_list[i] for i in bucket])
+            for i, segment in zip(bucket, segments):
+                results[i] = segment
+            if bucket_callback is not None:
+                bucket_callback(bucket)
+
+        return results
+
+    def __parse_batch(self, text_list:List[str]) -> List[str]:
+        """
+        对一批字符串进行NER解析, 返回与text_list等长的结果列表
+        """
+        if len(text_list) == 0:
+            return []
+
         # [['广东省汕尾市委副书记'], ...] 转为 [['广', '东', '省', '汕', '尾', '市', '委', '副', '书', '记', '<end>'], ...]
         char_lists = self.__prepocess_data_for_lstmcrf(text_list)
 
         # 生成 [['BL', 'ML', 'EL', 'BO', 'MO', 'MO', 'EO', 'BP', 'MP', 'EP'], ...]
-        pred_tag_lists = self.bilstm_model.predict(char_lists, self.crf_word2id, self.crf_tag2id)
-
-        segment_list = []
-        for i in range(len(pred_tag_lists)):
-            segment = self.__parser(pred_tag_lists[i], char_lists[i])
-            segment = segment.strip()
-            if segment != "":
-                segment_list.append(segment)
-        
-        return segment_list
+        pred_tag_lists = self.model.predict(char_lists, self.crf_word_encoder, self.crf_tag2id)
+
+        return [self.__parser(pred_tag_lists[i], char_lists[i]).strip() for i in range(len(pred_tag_lists))]
@@ -1,3 +1,3 @@
 from .octree import *
 
-__all__ = ["octree"]
\ No newline at end of file
+__all__ = ["octree", "OCTreeStore"]
\ No newline at end of file
@@ -8,7 +8,7 @@ from py2neo.ogm import GraphObject, Related, Property, RelatedTo, RelatedFrom, L
 from py2neo.bulk import create_nodes, create_relationships
 from typing import List, Tuple, Dict, Callable, Iterable
 from ...config import neo4j_config
-from ...common import Experience
+from ...common import Experience, ExperienceTable
 import datetime
 
 school_mate = ['学习P', '学生P', '专业S']
@@ -93,7 +93,7 @@ class CareerSocialNetwork(object):
                                  start_node_key=("YearUser", "id"),
                                  end_node_key=("YearUser", "id"))
 
-    def store_user_resume_nodes(self, exp_list: List[Experience], uid2name: Dict, init=True) -> None:
+    def store_user_resume_nodes(self, exp_list: List[Experience] or ExperienceTable, uid2name: Dict, init=True) -> None:
         """
         store YearUser Nodes and Trajectory edges
         """
@@ -105,8 +105,14 @@ class CareerSocialNetwork(object):
         career_track = []
         last_exp_uuid = {}
         last_splitnum={}
-        exp_list_sorted = sorted(exp_list, key=lambda x:datetime.date.min if x.time_start is None else x.time_start)
-        exp_list_sorted = sorted(exp_list_sorted, key=lambda x:"0" if x.person_uuid is None else x.person_uuid)
+        # experiences starting at the same time are ordered by uuid and splitnum, so that the trajectories do not depend
+        # on the order of exp_list (compute_csn stores a person's experiences again in another order)
+        if isinstance(exp_list, ExperienceTable):    # 在数组上排序, None都排在最前面
+            exp_list_sorted = exp_list.sort_by("person_uuid", "time_start", "uuid", "splitnum")
+        else:
+            exp_list_sorted = sorted(exp_list, key=lambda x:(datetime.date.min if x.time_start is None else x.time_start,
+                                                             x.uuid or "", x.splitnum or 0))
+            exp_list_sorted = sorted(exp_list_sorted, key=lambda x:"0" if x.person_uuid is None else x.person_uuid)
         '''Build career trajectory and store nodes'''
         for exp in exp_list_sorted:
             person_uuid = exp.person_uuid
@@ -138,6 +144,22 @@ class CareerSocialNetwork(object):
         print("******** Inserting {} Trajectory Rels *************".format(len(career_track)))
         self.batch_relation_insert(career_track, "trajectory")
 
+    def remove_user_resume_nodes(self, ids: List[str]) -> None:
+        """
+        delete the YearUser nodes (id = uuid+splitnum) and all their relationships, before they are stored again
+        """
+        for b in batch(ids, 10000):
+            self.GraphDatabase.run("UNWIND $ids AS id MATCH (n:YearUser {id: id}) DETACH DELETE n", ids=b)
+
+    def remove_social_relationships(self, ids: List[str]) -> None:
+        """
+        delete the Col, Rank and Rank_cross relationships of the YearUser nodes (id = uuid+splitnum), their trajectories
+        are kept
+        """
+        for b in batch(ids, 10000):
+            self.GraphDatabase.run("UNWIND $ids AS id MATCH (:YearUser {id: id})-[r:Col|Rank|Rank_cross]-() DELETE r",
+                                   ids=b)
+
     def store_social_network(self, colleague_list, superior_list_same, superior_list_cross):
         relationship_col = []
         relationship_rank_same = []
@@ -1,12 +1,12 @@
 from py2neo import Graph, Node
-from py2neo.bulk import create_nodes, create_relationships
+from py2neo.bulk import create_nodes, create_relationships, merge_nodes, merge_relationships
 from py2neo.ogm import GraphObject, RelatedObjects, Property, RelatedTo, RelatedFrom, Label
 from py2neo.database import Schema
 from py2neo.data import walk
 import os, sys
 from .utils import *
-from .csn import CareerSocialNetwork, get_rank, school_mate
-from typing import List, Tuple, Dict, Callable
+from .csn import CareerSocialNetwork, get_rank, school_mate, batch
+from typing import List, Tuple, Dict, Set, Callable
 from ...config import neo4j_config
 
 
@@ -42,64 +42,125 @@ class Neo4jAdapter(object):
         self.schema.create_index("Node", "id")
         # much faster to build tree, very important index
 
-    def treelib_to_neo4j(self, nodes_rel_dict: Dict[List, List], interval_dict: Dict, init: bool) -> None:
+    def tree_to_neo4j(self, nodes_rel_dict: Dict, interval_dict: Dict, init: bool) -> None:
+        """
+        nodes_rel_dict: returned by CTree.build_tree(init=True), {"nodes": PrefixTrie, "rel": [edges], ...}
+        """
         if init:
             # self._init_tree()
             self.GraphDatabase.delete_all()
 
-        '''batch nodes addition'''
+        trie = nodes_rel_dict['nodes']
+        self._create_tree_nodes(trie, [nid for nid in range(len(trie)) if nid == 0 or trie.score[nid] > 0], interval_dict)
+
+        root = self.get_node(0)
+        root.root = True
+        self.GraphDatabase.push(root)
+        # links bulk insertion
+        create_relationships(self.GraphDatabase.auto(), nodes_rel_dict['rel'], "R",
+                             start_node_key=("Node", "id", "name"), end_node_key=("Node", "id", "name"))
+
+    def apply_delta(self, delta: Dict, interval_dict: Dict) -> None:
+        """
+        apply the delta returned by CTree.build_tree(init=False) to the tree in neo4j:
+        create the added nodes and their edges, update count, interval and Leaf label of the updated ones, delete the removed ones.
+        The YearUser nodes are updated by compute_csn.
+        The added nodes and edges are merged, so that a delta can be applied again after a failed octree() call
+        """
+        trie = delta['nodes']
+        if delta['removed']:
+            self.GraphDatabase.run("UNWIND $ids AS id MATCH (n:Node {id: id}) DETACH DELETE n", ids=delta['removed'])
+        # the root is always alive, so it is never in added or removed
+        self._create_tree_nodes(trie, delta['added'], interval_dict, merge=True)
+        if delta['updated']:
+            rows = [{"id": nid, "count": trie.count[nid], "interval": list(interval_dict[nid]),
+                     "leaf": trie.count[nid] > 0 and trie.name(nid)[-1] == "P"} for nid in delta['updated']]
+            self.GraphDatabase.run("UNWIND $rows AS row MATCH (n:Node {id: row.id}) "
+                                   "SET n.count = row.count, n.interval = row.interval", rows=rows)
+            # same rule as _create_tree_nodes: a node ending with P and with count > 0 is a leaf
+            self.GraphDatabase.run("UNWIND $ids AS id MATCH (n:Node {id: id}) SET n:Leaf",
+                                   ids=[row["id"] for row in rows if row["leaf"]])
+            self.GraphDatabase.run("UNWIND $ids AS id MATCH (n:Node {id: id}) REMOVE n:Leaf",
+                                   ids=[row["id"] for row in rows if not row["leaf"]])
+        merge_relationships(self.GraphDatabase.auto(), delta['rel'], ("R",),
+                            start_node_key=("Node", "id", "name"), end_node_key=("Node", "id", "name"))
+
+    def renumber_nodes(self, new_ids) -> None:
+        """
+        renumber the tree nodes after CTree.compact, new_ids[old id] is the new id of a node. The removed (dead) nodes
+        are already deleted by apply_delta. Ids are first set to -1 - new id and then to new id, so that a node is never
+        matched by the old id of another one
+        """
+        rows = [{"old": old, "new": new} for old, new in enumerate(new_ids.tolist()) if new >= 0 and new != old]
+        for b in batch(rows, 10000):
+            self.GraphDatabase.run("UNWIND $rows AS row MATCH (n:Node {id: row.old}) SET n.id = -1 - row.new", rows=b)
+        for b in batch(rows, 10000):
+            self.GraphDatabase.run("UNWIND $rows AS row MATCH (n:Node {id: -1 - row.new}) "
+                                   "SET n.id = row.new, n.identifier = row.new", rows=b)
+
+    def _create_tree_nodes(self, trie, nids: List[int], interval_dict: Dict, merge: bool = False) -> None:
+        '''batch nodes addition, merged on id if merge'''
         keys = ["id", "name", "identifier", "count", "interval"]
         data_nodes_org = []
         data_nodes_loc = []
         data_nodes = []
         data_leaves = []
-        relationship_data = nodes_rel_dict['rel']
 
         '''nodes data with count info'''
-        all_nodes = nodes_rel_dict['nodes']
-        for nid, node in all_nodes.items():
-            data = node.data
-            interval = interval_dict[data['id']]
+        for nid in nids:
+            name = trie.name(nid)
+            count = trie.count[nid]
+            interval = interval_dict[nid]
 
-            if data['count'] > 0 and data['name'][-1] == "P":  # leaf
-                data_leaves.append([data['id'], data['name'], nid, data['count'], interval])
+            if count > 0 and name[-1] == "P":  # leaf
+                data_leaves.append([nid, name, nid, count, interval])
             else:
-                if data['name'][-1] == "O":
-                    data_nodes_org.append([data['id'], data['name'], nid, data['count'], interval])
-                elif data['name'][-1] == "L":
-                    data_nodes_loc.append([data['id'], data['name'], nid, data['count'], interval])
+                if name[-1] == "O":
+                    data_nodes_org.append([nid, name, nid, count, interval])
+                elif name[-1] == "L":
+                    data_nodes_loc.append([nid, name, nid, count, interval])
                 else:
-                    data_nodes.append([data['id'], data['name'], nid, data['count'], interval])
-
-        create_nodes(self.GraphDatabase.auto(), data_nodes, labels={"Node"}, keys=keys)
-        create_nodes(self.GraphDatabase.auto(), data_nodes_loc, labels={"Node", "Loc"}, keys=keys)
-        create_nodes(self.GraphDatabase.auto(), data_nodes_org, labels={"Node", "Org"}, keys=keys)
-        create_nodes(self.GraphDatabase.auto(), data_leaves, labels={"Node", "Leaf"}, keys=keys)
+                    data_nodes.append([nid, name, nid, count, interval])
 
-        root = self.get_node(0)
-        root.root = True
-        self.GraphDatabase.push(root)
-        # links bulk insertion
-        create_relationships(self.GraphDatabase.auto(), relationship_data, "R",
-                             start_node_key=("Node", "id", "name"), end_node_key=("Node", "id", "name"))
+        for data, labels in ((data_nodes, {"Node"}), (data_nodes_loc, {"Node", "Loc"}),
+                             (data_nodes_org, {"Node", "Org"}), (data_leaves, {"Node", "Leaf"})):
+            if merge:
+                merge_nodes(self.GraphDatabase.auto(), data, ("Node", "id"), labels=labels, keys=keys)
+            else:
+                create_nodes(self.GraphDatabase.auto(), data, labels=labels, keys=keys)
 
-    def compute_csn(self, lib_tree, exp_list, uid2name, start, end) -> CareerSocialNetwork:
+    def compute_csn(self, lib_tree, exp_list, uid2name, start, end, delta: Dict = None) -> CareerSocialNetwork:
         """
         Use CQL to search career relationships in octree.
         Then save them into neo4j
+
+        delta: None computes the whole network from exp_list. Otherwise the delta returned by an incremental
+            CTree.build_tree: the YearUser nodes and trajectories of delta["persons"] are stored again from
+            lib_tree.user_exps, and the relationships of the leaves touched by the delta (see _touched_leaves) are
+            computed again with all the experiences of these leaves, the result is the same as computed from scratch
         """
         csn = CareerSocialNetwork(start, end)
-        csn.store_user_resume_nodes(exp_list, uid2name)
+        if delta is None:
+            csn.store_user_resume_nodes(exp_list, uid2name)
+            leaf_ids = None
+            leaves = [l['id'] for l in self.match_nodes_by_tag("Leaf")]
+        else:
+            user_ids = [exp_id for person in delta["persons"] for exp_id in lib_tree.person_exp_ids.get(person, ())]
+            csn.remove_user_resume_nodes(user_ids + delta["removed_user_ids"])
+            csn.store_user_resume_nodes([lib_tree.user_exps[exp_id] for exp_id in user_ids], uid2name)
+            leaf_ids = self._touched_leaves(lib_tree, delta)
+            leaves = sorted(leaf_ids)
+            # the other experiences of these leaves keep their YearUser nodes, only their relationships are replaced
+            csn.remove_social_relationships([r[0] for l in leaves for r in lib_tree.resume_record[l]])
         colleague_list = []
         superior_list_same = []
         superior_list_cross = []
         col_set = set()  # 同事记录
         sup_set = set()  # 上下级记录
         '''同一叶节点（同一职位）为同事关系'''
-        leafs_y = self.match_nodes_by_tag("Leaf")
-        for l in leafs_y:
-            # l_tag = self.leaf_tag[l['id']]
-            l_resumes = lib_tree.resume_record[l['id']]
+        for l in leaves:
+            # l_tag = self.leaf_tag[l]
+            l_resumes = lib_tree.resume_record[l]
             pairs = user_pair(l_resumes, l_resumes, start, end)
             for mid, nid, period in pairs:
                 if (mid, nid) in col_set or (nid, mid) in col_set:  # 由于对称性，需要去重
@@ -108,11 +169,9 @@ class Neo4jAdapter(object):
                 col_set.add((mid, nid))
         '''两跳：同级同僚'''
         rank_dict = get_rank_dict()
-        cql_col = "match (m:Leaf)<-[:R]-(o:Node)-[:R]->(n:Leaf) " \
-                  "where m.interval[0]<=n.interval[0]<=m.interval[1] and " \
-                  "not o:Loc and not o:Root and not o:Leaf " \
-                  "return m,n"
-        col_y = self.GraphDatabase.run(cql_col).to_ndarray()
+        col_y = self._match_leaf_pairs("(m:Leaf)<-[:R]-(o:Node)-[:R]->(n:Leaf)",
+                                       "m.interval[0]<=n.interval[0]<=m.interval[1] and "
+                                       "not o:Loc and not o:Root and not o:Leaf", leaf_ids)
         for m, n in col_y:
             if (m, n) in sup_set or (n, m) in sup_set:
                 continue
@@ -140,14 +199,14 @@ class Neo4jAdapter(object):
                     else:
                         continue
                 else:
-                    is_rank = True
+                    # 同级的经历对不改变is_rank, 否则结果取决于叶节点下经历的顺序(增量计算时与重新计算不同)
                     if m_level > n_level:  # level 越小， 职称越高
                         superior_list_same.append([nid, mid, n_key, m_key, period])
+                        is_rank = True
                     elif m_level < n_level:
                         superior_list_same.append([mid, nid, m_key, n_key, period])
-                    else:
-                        is_rank = False
-            '''不是上下级的会属于同事'''
+                        is_rank = True
+            '''任一经历对是上下级时不计同事, 否则都属于同事'''
             if is_rank:
                 continue
             pairs = user_pair(m_resumes, n_resumes, start, end)
@@ -159,12 +218,10 @@ class Neo4jAdapter(object):
                     col_set.add((mid, nid))
 
         '''三跳：跨组织上下级'''
-        cql_rank = "match (m:Leaf)<-[:R]-(o1:Node)-[:R]->(o2:Node)-[:R]->(n:Leaf) " \
-                   "where m.interval[0]<=n.interval[0]<=m.interval[1] and " \
-                   "not o2:Loc and not o2:Leaf and " \
-                   "not o1:Root and not o1:Loc and not o1:Leaf " \
-                   "return m,n"
-        rank_y = self.GraphDatabase.run(cql_rank).to_ndarray()
+        rank_y = self._match_leaf_pairs("(m:Leaf)<-[:R]-(o1:Node)-[:R]->(o2:Node)-[:R]->(n:Leaf)",
+                                        "m.interval[0]<=n.interval[0]<=m.interval[1] and "
+                                        "not o2:Loc and not o2:Leaf and "
+                                        "not o1:Root and not o1:Loc and not o1:Leaf", leaf_ids)
         for m, n in rank_y:
             m_resumes = lib_tree.resume_record[m['id']]
             n_resumes = lib_tree.resume_record[n['id']]
@@ -193,6 +250,36 @@ class Neo4jAdapter(object):
         csn.store_social_network(colleague_list, superior_list_same, superior_list_cross)
         return csn
 
+    @staticmethod
+    def _touched_leaves(lib_tree, delta: Dict) -> Set[int]:
+        """
+        ids of the leaves whose relationships may differ after the incremental build of delta: the leaves of the
+        inserted experiences, of the experiences whose rank changed and of all the experiences of delta["persons"]
+        (their YearUser nodes are stored again), the added and updated leaves (experiences moved in or out, interval
+        changed), and the leaf children of the added and updated nodes ending with P, whose Leaf label may have changed
+        """
+        trie = delta["nodes"]
+        is_leaf = lambda n: trie.count[n] > 0 and trie.name(n)[-1] == "P"     # same rule as _create_tree_nodes
+        exp_ids = delta["exp_ids"] + delta["rank_exp_ids"] + \
+                  [exp_id for person in delta["persons"] for exp_id in lib_tree.person_exp_ids.get(person, ())]
+        nids = {lib_tree.exp_nid[exp_id] for exp_id in exp_ids if exp_id in lib_tree.exp_nid}
+        for n in delta["added"] + delta["updated"]:
+            nids.add(n)
+            if trie.name(n)[-1] == "P":
+                nids.update(lib_tree.get_children(n))
+        return {n for n in nids if is_leaf(n)}
+
+    def _match_leaf_pairs(self, pattern: str, condition: str, leaf_ids: Set[int] = None):
+        """
+        (m, n) of the paths matching pattern and condition. If leaf_ids is not None, only those with m or n in leaf_ids:
+        the query starts from these leaves through the index on Node.id instead of going through all the leaves
+        """
+        if leaf_ids is None:
+            return self.GraphDatabase.run("match {} where {} return m,n".format(pattern, condition)).to_ndarray()
+        cql = " union ".join("match ({0}:Node) where {0}.id in $leaf_ids "
+                             "match {1} where {2} return m,n".format(v, pattern, condition) for v in "mn")
+        return self.GraphDatabase.run(cql, leaf_ids=sorted(leaf_ids)).to_ndarray()
+
     # =============================================================================
     # Main APIs for CTree
     # =============================================================================
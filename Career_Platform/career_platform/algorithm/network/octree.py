@@ -1,29 +1,35 @@
 #!/usr/bin/env python3
 # coding=utf-8
 import os, sys
-import treelib
-from ...common import Experience, Person
+import threading
+from ...common import Experience, ExperienceTable, Person
 import pickle
 import json
-from treelib import Tree
+from .trie import PrefixTrie
 from .utils import *
 from .neo4j import Neo4jAdapter
-from typing import List, Tuple, Dict, Callable
+from typing import List, Tuple, Dict, Callable, Mapping
 import datetime
+import numpy as np
 
-__all__ = ["octree"]
+__all__ = ["octree", "OCTreeStore"]
 
 data_path = os.path.dirname(__file__) + "/data"
+COMPACT_DEAD_RATIO = 0.2    # the trie is compacted once the dead nodes exceed this fraction of it, see CTree.compact
 
 
-def octree(exp_list:List[Experience], person_list:List[Person], export_json: bool = True) -> Dict or None:
+def octree(exp_list:List[Experience] or ExperienceTable, person_list:List[Person], export_json: bool = True,
+           store: "OCTreeStore" = None) -> Dict or None:
     """
     Build octree from experiences and export json file if needed
 
     Params:
-        exp_list: a list of all the experiences to be inserted
+        exp_list: a list (or an ExperienceTable) of all the experiences to be inserted
         person_list: a list of all the person related to experiences in exp_list
         export_json: export json tree if True
+        store: the OCTreeStore holding the tree between calls. If it has a tree, the experiences are inserted into it
+            incrementally and only the changes are written to neo4j, otherwise the tree and neo4j are built from
+            scratch and saved to the store. None: always build from scratch without saving
 
     Returns:
          Diction of octree or None
@@ -38,51 +44,207 @@ def octree(exp_list:List[Experience], person_list:List[Person], export_json: boo
     ############################################################
     """
     uid2name = {p.uuid:p.name for p in person_list}
-    oct = CTree()
-    nodes_rel_dict = oct.build_tree(exp_list)
     adapter = Neo4jAdapter()
-    adapter.treelib_to_neo4j(nodes_rel_dict, oct.interval_dict, init=True)
+    if store is None:
+        return _build_octree(adapter, CTree(), exp_list, uid2name, export_json)
+    with store.lock:
+        oct = store.load()
+        if oct is None:
+            oct = CTree()
+            oct.uid_userName_map = uid2name
+            result = _build_octree(adapter, oct, exp_list, uid2name, export_json)
+            store.save(oct)
+            return result
+        try:
+            delta = oct.build_tree(exp_list, init=False)
+            oct.uid_userName_map.update(uid2name)
+            adapter.apply_delta(delta, oct.interval_dict)
+            # only the relationships of the leaves touched by the batch are computed again
+            adapter.compute_csn(oct, exp_list, oct.uid_userName_map, start=1960,
+                                end=float(datetime.date.today().strftime("%Y.%m")), delta=delta)
+        except BaseException:
+            # the batch is in the tree but not (completely) in neo4j: forget it, so that it is inserted again next time
+            store.reset()
+            raise
+        # logged only once neo4j is updated
+        store.append(exp_list, uid2name)
+        if oct.dead_num() > COMPACT_DEAD_RATIO * len(oct):
+            try:
+                adapter.renumber_nodes(oct.compact())
+            except BaseException:
+                store.reset()
+                raise
+            store.save()    # the logged batches refer to the ids before compacting
+        elif store.logged_num() >= store.snapshot_interval:
+            store.save()
+        if export_json:
+            return oct.export_json_tree(oct.uid_userName_map)
+
+
+def _build_octree(adapter: Neo4jAdapter, oct: "CTree", exp_list, uid2name: Dict, export_json: bool) -> Dict or None:
+    """
+    build oct from scratch and write it to neo4j
+    """
+    delta = oct.build_tree(exp_list)
+    adapter.tree_to_neo4j(delta, oct.interval_dict, init=True)
     adapter.compute_csn(oct, exp_list, uid2name, start=1960, end=float(datetime.date.today().strftime("%Y.%m")))
     if export_json:
         return oct.export_json_tree(uid2name)
 
 
-class CNode(dict):
-    def __init__(self, id, name=None, count=None):
-        self.id = id  # Represents a different ID, each node has a different ID eg:0,1,2,3
-        self.name = name  # eg: ”深圳市”“南山区“ ”南山街道”
-        self.count = count
-        self.score = 0  # a score to indicate the importance of the node (the current
-        # implementation is the sum of all node counts in its subtree)
-        super().__init__(self, name=name)  # attribute in json export
-        super().__init__(self, count=count)
-        super().__init__(self, score=self.score)
-        super().__init__(self, id=self.id)
+class OCTreeStore(object):
+    """
+    A CTree kept in memory between calls of octree(store=...), so that each call only inserts its own experiences.
+
+    It is persisted as a snapshot (CTree.save_tree at snapshot_path) and an append-only log (snapshot_path + ".log"),
+    with one JSON line per incremental build_tree: the experiences of the batch and uid2name of its persons.
+    load() reads the snapshot and replays the log once, save() writes a new snapshot and empties the log.
+    octree() saves after snapshot_interval logged batches and after compacting the tree, close() saves on shutdown.
+    A batch is logged only after it is inserted into the tree and written to neo4j. If writing to neo4j fails,
+    octree() calls reset(), so that the tree is reloaded without the batch and the batch is not skipped as unchanged
+    when it is submitted again. The changes already written to neo4j by the failed call are not rolled back.
+
+    Lines of the log have increasing "seq" numbers and the snapshot records the last one it includes (CTree.log_seq),
+    so lines already in the snapshot are skipped if the log could not be emptied after saving.
+    """
+    # new attributes go at the end, the missing ones of older log lines are None
+    LOG_ATTRS = ("uuid", "splitnum", "person_uuid", "text_token", "time_start", "time_end", "adminrank", "text")
+
+    def __init__(self, snapshot_path: str, snapshot_interval: int = 200):
+        """
+        Params:
+            snapshot_path: path of the snapshot, the log is snapshot_path + ".log"
+            snapshot_interval: number of logged batches after which octree() saves a new snapshot
+        """
+        self.snapshot_path = snapshot_path
+        self.log_path = snapshot_path + ".log"
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.RLock()     # held by octree() while the tree is updated
+        self.tree: CTree or None = None
+        self.__loaded = False
+        self.__logged = 0   # batches logged since the last snapshot
+
+    def load(self) -> "CTree" or None:
+        """
+        the tree in memory, loaded from the snapshot and the log on the first call. None if there is no snapshot
+        """
+        with self.lock:
+            if self.__loaded:
+                return self.tree
+            self.__loaded = True
+            if not os.path.isfile(self.snapshot_path):
+                return None
+            self.tree = CTree.load_tree(self.snapshot_path)
+            if self.tree.uid_userName_map is None:
+                self.tree.uid_userName_map = {}
+            complete = True
+            if os.path.isfile(self.log_path):
+                with open(self.log_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            batch = json.loads(line)
+                        except json.JSONDecodeError:   # the last line was not completely written
+                            complete = False
+                            break
+                        if batch["seq"] <= self.tree.log_seq:
+                            continue
+                        self.tree.build_tree([self.__load_exp(row) for row in batch["exps"]], init=False)
+                        self.tree.uid_userName_map.update(batch["uid2name"])
+                        self.tree.log_seq = batch["seq"]
+                        self.__logged += 1
+            if not complete:
+                self.save()
+            return self.tree
+
+    def append(self, exp_list: List[Experience] or ExperienceTable, uid2name: Dict) -> None:
+        """
+        log a batch which has just been inserted into the tree by build_tree(init=False)
+        """
+        with self.lock:
+            self.tree.log_seq += 1
+            line = json.dumps({"seq": self.tree.log_seq, "uid2name": uid2name,
+                               "exps": [self.__dump_exp(exp) for exp in exp_list]}, ensure_ascii=False)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.__logged += 1
+
+    def save(self, tree: "CTree" = None) -> None:
+        """
+        write a snapshot of the tree (tree replaces the one in memory if given) and empty the log
+        """
+        with self.lock:
+            if tree is not None:
+                self.tree, self.__loaded = tree, True
+            self.tree.save_tree(self.snapshot_path)
+            open(self.log_path, "w").close()
+            self.__logged = 0
+
+    def reset(self) -> None:
+        """
+        drop the tree in memory, the next load() reads the snapshot and the log again
+        """
+        with self.lock:
+            self.tree = None
+            self.__loaded = False
+            self.__logged = 0
+
+    def logged_num(self) -> int:
+        """
+        number of batches logged since the last snapshot
+        """
+        return self.__logged
+
+    def close(self) -> None:
+        """
+        save a snapshot if batches were logged since the last one
+        """
+        with self.lock:
+            if self.tree is not None and self.__logged > 0:
+                self.save()
+
+    @classmethod
+    def __dump_exp(cls, exp: Experience) -> List:
+        return [value.isoformat()[:10] if isinstance(value, datetime.date) else value
+                for value in (getattr(exp, attr) for attr in cls.LOG_ATTRS)]
 
-    def setname(self, name):
-        self.name = name
-        self['name'] = self.name
+    @classmethod
+    def __load_exp(cls, row: List) -> Experience:
+        values = dict(zip(cls.LOG_ATTRS, row))
+        for attr in ("time_start", "time_end"):
+            if values[attr] is not None:
+                values[attr] = datetime.date.fromisoformat(values[attr])
+        return Experience(**values)
 
-    def count_plus(self):
-        self.count = self.count + 1
-        self['count'] = self.count
 
-    def score_plus(self):
-        self.score = self.score + 1
-        self['score'] = self.score
+class CTree(object):
+    """
+    OCTree of institution names. Nodes are stored in a PrefixTrie and referred to by their ids (int),
+    the root is PrefixTrie.ROOT (0)
 
+    A node is alive while some experience passes through it (score > 0). The nodes left without experiences after
+    changed experiences are moved or removed (see build_tree) stay in the trie with score 0, and are skipped by
+    get_children, record_node_interval, tree_to_json and neo4j, until compact removes them and renumbers the others
+    """
+    # attributes of the experiences kept in user_exps, those used by CareerSocialNetwork.store_user_resume_nodes
+    USER_EXP_ATTRS = ("uuid", "splitnum", "person_uuid", "text", "text_token", "time_start", "time_end")
 
-class CTree(Tree):
-    def __init__(self, tree=None, deep=False):
-        Tree.__init__(self, tree=tree, deep=deep)
+    def __init__(self):
+        self.trie = PrefixTrie("root")
         self.uid_userName_map = None
         self.id_num = 0  # unique id for node
         self.user_id = 1  # unique id for user
-        self.interval_dict = {}
         self.resume_record = {}
         self.leaf_tag = {}
         self.rank_record = {}
         self.shenzhen_nid = None
+        self.exp_nid = {}  # experience id (uuid+splitnum) -> node id where its resume is recorded
+        self.user_exps = {}  # experience id -> the experience stored as a YearUser node, see _record_user_exp
+        self.person_exp_ids = {}  # person uuid -> {experience id: None} of the person's experiences in user_exps
+        self.alive_num = 1  # number of alive nodes, the root included
+        self.log_seq = 0  # last batch of the OCTreeStore log included in this tree
+        self.__touched = None  # node id -> (alive, count, interval) before the current incremental build
         self.class_map = {'市政协直属': 1, '市人大直属': 2, '市委直属': 3, '市政府直属': 4, '国企事业单位': 5, '军检法机构': 6,
                           '龙华': 7, '罗湖': 8, '福田': 9, '南山': 10, '宝安': 11, '龙岗': 12, '盐田': 13, '坪山': 14,
                           '光明': 15, '深汕特别合作区': 16, '大鹏新区': 17}
@@ -90,39 +252,84 @@ class CTree(Tree):
         #     self.abbr = json.load(fp)
         # self.abbr = {**self.abbr, **dict(zip(self.abbr.values(), self.abbr.keys()))}  # Abbreviation mapping
 
+    def __len__(self):
+        return len(self.trie)
+
+    @property
+    def interval_dict(self) -> Mapping[int, Tuple[int, int]]:
+        """
+        node id -> existing interval (start year, end year), a read-only view over the interval arrays of the trie
+        """
+        return self.trie.intervals
+
     # =============================================================================
     # Main APIs for CTree
     # =============================================================================
     def save_tree(self, tree_path):
-        with open(tree_path, "wb") as f:
-            pickle.dump(self, f)
-
-    def build_tree(self, exp_list: List[Experience], init=True) -> Dict[List, List]:
+        # write to a temporary file first, so that a failed dump does not destroy the previous snapshot
+        tmp_path = tree_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, tree_path)
+
+    @staticmethod
+    def load_tree(tree_path) -> "CTree":
+        with open(tree_path, "rb") as f:
+            return pickle.load(f)
+
+    def build_tree(self, exp_list: List[Experience] or ExperienceTable, init=True) -> Dict:
         """
         main function of OCTree. 
-        1. build octree by treelib
+        1. build octree on a PrefixTrie
         2. record resume information and existing interval of each node
-        3. return a dict consisting of all nodes and edges
+        3. return a dict consisting of all nodes (the PrefixTrie) and edges, and the delta for neo4j:
+           {"nodes": PrefixTrie, "rel": edges to the added nodes,
+            "added": ids of the nodes alive now but not before, "updated": ids of the nodes whose count or interval changed,
+            "removed": ids of the nodes no longer alive, "exp_ids": ids of the inserted experiences,
+            "removed_exp_ids": ids of the experiences removed from the tree and not inserted again,
+            "rank_exp_ids": ids of the unchanged experiences whose rank record changed,
+            "persons": uuids of the persons whose experiences in user_exps changed,
+            "removed_user_ids": ids of the experiences removed from user_exps}
+
+        init=True builds the tree from scratch (every node is "added").
+        init=False inserts exp_list into the current tree, e.g. one loaded by load_tree: new experiences are inserted,
+        changed ones (same uuid+splitnum with different tokens or time) are moved to their new path, unchanged ones
+        are skipped. Counts and intervals are updated along the affected paths only
         """
         print("******** Building OCTree ****************************")
         if init:
-            self.create_node(tag="root", identifier=0, data=CNode(self.id_num, "root", 0))  # root
+            self.trie = PrefixTrie("root")  # root
+            self.resume_record, self.leaf_tag, self.rank_record, self.exp_nid = {}, {}, {}, {}
+            self.user_exps, self.person_exp_ids = {}, {}
+            self.shenzhen_nid, self.id_num = None, 0
         else:
-            self.load_tree("./octree")  # TODO : LOAD OCTREE
-        '''record nodes and edges for neo4j'''
-        nodes_rel = {
-            "nodes": self.nodes,
-            "rel": []
-        }
+            self.__touched = {}
+            self._touch(PrefixTrie.ROOT)
+        exp_ids = []
+        removed_exp_ids = []
+        rank_exp_ids = []
+        persons = {}
+        removed_user_ids = []
+        # experiences lasting "till now" are measured against the same day during one build
+        today = datetime.date.today()
+        # durations of a table are computed at once on its date columns
+        durations = exp_list.durations(today=today) if isinstance(exp_list, ExperienceTable) else None
         # insert a list of parsed institution names to the tree
-        for exp in iter(exp_list):
+        for idx, exp in enumerate(exp_list):
+            self._record_user_exp(exp, persons, removed_user_ids)
             '''get segmented/raw experience'''
             # TODO: text_token is asserted str
             if exp.text_token:
                 parsed = exp.text_token.strip()
             else:
-                continue
-            if None in [exp.uuid,exp.person_uuid,exp.time_start,exp.time_end]:
+                parsed = None
+            if parsed is None or None in [exp.uuid,exp.person_uuid,exp.time_start,exp.time_end]:
+                # an experience which can no longer be inserted leaves the tree
+                if not init and exp.uuid is not None:
+                    exp_id = exp.uuid + '+' + str(exp.splitnum)
+                    if exp_id in self.exp_nid:
+                        self._remove_experience(exp_id)
+                        removed_exp_ids.append(exp_id)
                 continue
             # get rank info ( should be a str(dict) )
             if not exp.adminrank:
@@ -136,25 +343,55 @@ class CTree(Tree):
                      exp.time_start.strftime("%Y.%m"),
                      exp.time_end.strftime("%Y.%m")
                      )
-            self.rank_record[exp_id] = {__rank: exp.duration()}
-            '''build octree by treelib'''
+            duration = int(durations[idx]) if durations is not None else exp.duration(today=today)
+            rank_before = self.rank_record.get(exp_id)
+            self.rank_record[exp_id] = {__rank: duration}
+            if not init and exp_id in self.exp_nid:
+                if self._same_experience(exp_id, rinfo, parsed):
+                    if rank_before != self.rank_record[exp_id]:
+                        rank_exp_ids.append(exp_id)
+                    continue
+                self._remove_experience(exp_id, keep_rank=True)
+            '''build octree'''
             # insertion
-            self.id_num += 1
-            self._add_sequence_treelib(resume_info=rinfo,
-                                       tokens=parsed,
-                                       nodes_rel=nodes_rel)
-        print("******** Updating node interval *********************")
-        self.interval_dict = self.record_node_interval()
-        # save resume dict
-        print("******** Dumping nid2resumes dict *******************")
-        with open(data_path + '/temp/nid2resumes.json', 'w', encoding='utf-8') as fp:
-            json.dump(self.resume_record, fp, ensure_ascii=False, indent=2)
-        return nodes_rel
+            nid = self._add_sequence(resume_info=rinfo,
+                                     tokens=parsed)
+            self.exp_nid[exp_id] = nid
+            exp_ids.append(exp_id)
+            if not init:
+                self._update_path_interval(nid, added=(int(rinfo[2][:4]), int(rinfo[3][:4])))
+        self.id_num = len(self.trie)
+        if init:
+            print("******** Updating node interval *********************")
+            self.record_node_interval()
+            # save resume dict
+            print("******** Dumping nid2resumes dict *******************")
+            with open(data_path + '/temp/nid2resumes.json', 'w', encoding='utf-8') as fp:
+                json.dump(self.resume_record, fp, ensure_ascii=False, indent=2)
+            added, updated, removed = list(range(len(self.trie))), [], []
+            self.alive_num = len(self.trie)
+        else:
+            added, updated, removed = self._collect_delta()
+            self.alive_num += len(added) - len(removed)
+        '''record nodes and edges for neo4j'''
+        trie = self.trie
+        return {
+            "nodes": trie,
+            "rel": [((trie.parent[n], trie.name(trie.parent[n])), {}, (n, trie.name(n))) for n in added if n != PrefixTrie.ROOT],
+            "added": added,
+            "updated": updated,
+            "removed": removed,
+            "exp_ids": exp_ids,
+            "removed_exp_ids": [exp_id for exp_id in dict.fromkeys(removed_exp_ids) if exp_id not in self.exp_nid],
+            "rank_exp_ids": [exp_id for exp_id in dict.fromkeys(rank_exp_ids) if exp_id not in exp_ids],
+            "persons": list(persons),
+            "removed_user_ids": [exp_id for exp_id in dict.fromkeys(removed_user_ids) if exp_id not in self.user_exps]
+        }
 
     def export_json_tree(self, uid2name) -> Dict:
         # initialize json tree
         self.uid_userName_map = uid2name
-        root = self.get_node(self.shenzhen_nid)
+        root = self.shenzhen_nid
         class_map_main = {}
         class_map_all = {}
         self.get_classmap(root, class_map_main, class_map_all)
@@ -164,7 +401,16 @@ class CTree(Tree):
         json_tree = {"nodes": nodes, "users": users, "path": path, '_7class': _7class}
         return json_tree
 
-    def tree_to_json(self, root, nodes, users, path, _7class, class_map_all):
+    def tree_to_json(self, root: int, nodes, users, path, _7class, class_map_all, fullname: str = None,
+                     node_path: List[int] = None):
+        """
+        fullname and node_path are the prefix name and prefix ids of root, computed if None. Those of each child are
+        derived from them during the traversal instead of walking up to the root for every node
+        """
+        if fullname is None:
+            fullname = self.get_prefix_name(root)
+        if node_path is None:
+            node_path = self.get_prefix_id(root)
         # init
         if nodes == {}:
             nodes = self._creat_ori_viznode('深圳市', 'None', 0, 0, 0, 0, 9999)
@@ -177,7 +423,7 @@ class CTree(Tree):
         # insert
         for child in self.get_children(root):
             '''information of this child'''
-            node_id = child.data.id
+            node_id = child
             class_id = class_map_all[node_id]
             # if class_id not in label_list:
             #     continue
@@ -185,22 +431,24 @@ class CTree(Tree):
             # if root.data.id == self.shenzhen_nid and node_id not in self.main_children_list:
             #     continue
 
-            name = child.data.name
-            count = child.data.count
-            parent = self.get_parent(child).identifier
+            name = self.trie.name(child)
+            count = self.trie.count[child]
+            parent = self.get_parent(child)
             start, end = self.interval_dict[node_id]
             '''record the path to this node'''
+            child_fullname = fullname + name
+            child_path = node_path + [node_id]
             path[node_id] = {}
-            path[node_id]['fullname'] = self.get_prefix_name(child)
-            path[node_id]['node_path'] = self.get_prefix_id(node_id)
+            path[node_id]['fullname'] = child_fullname
+            path[node_id]['node_path'] = child_path
             # record this node in json
             ''' insert children of shenzhen into class nodes'''
-            if root.data.id == self.shenzhen_nid:
+            if root == self.shenzhen_nid:
                 nodes["children"][class_id - 1]["children"].append(
                     self._creat_ori_viznode(name, parent, count, node_id, class_id, start, end))
                 self.tree_to_json(child,
                                   nodes["children"][class_id - 1]["children"][-1],
-                                  users, path, _7class, class_map_all)
+                                  users, path, _7class, class_map_all, child_fullname, child_path)
             else:
                 '''if not leaf, record this node in "children" list of parent(dict), then traverse its children'''
                 if count == 0:
@@ -208,7 +456,7 @@ class CTree(Tree):
                         self._creat_ori_viznode(name, parent, count, node_id, class_id, start, end))
                     self.tree_to_json(child,
                                       nodes['children'][-1],
-                                      users, path, _7class, class_map_all)
+                                      users, path, _7class, class_map_all, child_fullname, child_path)
                 else:  # leaf node need to record users as well
                     resume_ids = self.resume_record[node_id]
                     leaf_node = self._creat_ori_viznode(name, parent, count, node_id, class_id, start, end)
@@ -247,68 +495,98 @@ class CTree(Tree):
                             self._creat_user_viznode(uid=uid, parent=node_id, start=startTime, end=endTime,
                                                      rank=rank_period))
                         path[self.id_num + self.user_id] = {}
-                        path[self.id_num + self.user_id]['fullname'] = self.get_prefix_name(child)
-                        path[self.id_num + self.user_id]['node_path'] = self.get_prefix_id(node_id)
+                        # users share the path of their leaf
+                        path[self.id_num + self.user_id]['fullname'] = child_fullname
+                        path[self.id_num + self.user_id]['node_path'] = child_path
                     nodes['children'].append(leaf_node)
 
         return nodes, users, path, _7class
 
-    def record_node_interval(self) -> Dict:
+    def record_node_interval(self) -> Mapping[int, Tuple[int, int]]:
         """
-        This function will get the overall existing time of all the leaves
-        predecessors' interval is the UNION of all its children's
+        This function will get the overall existing time of all the nodes in one bottom-up pass
+        the interval of a leaf is the union of its resumes, predecessors' interval is the UNION of all its children's
         """
-        restore_node_interval = {}
-        leaves = self.leaves(0)
-        for leaf in leaves:
-            for _, _, startTime, endTime in self.resume_record.get(leaf.identifier, []):
-                # only consider year
-                startTime = int(startTime[:4])
-                endTime = int(endTime[:4])
-                # record the leaf's interval as (startTime, endTime)
-                set_node_time(leaf.identifier, startTime, endTime, restore_node_interval)
-
-            # update the time of the predecessors
-            # set predecessors interval of this node as the UNION of its children's
-            self._update_node_interval(leaf, restore_node_interval)
+        trie = self.trie
+        parent = np.array(trie.parent, dtype=np.int64)
+        alive = np.array(trie.score, dtype=np.int64) > 0
+        alive[PrefixTrie.ROOT] = True
+        start = np.full(len(trie), PrefixTrie.INTERVAL_UNSET[0], dtype=np.int64)
+        end = np.full(len(trie), PrefixTrie.INTERVAL_UNSET[1], dtype=np.int64)
+
+        # leaves are the alive nodes without alive children
+        alive_children = np.bincount(parent[1:][alive[1:]], minlength=len(trie))
+        leaves = np.flatnonzero(alive & (alive_children == 0))
+        leaves = leaves[leaves != PrefixTrie.ROOT]
+        records = [self.resume_record.get(leaf, []) for leaf in leaves.tolist()]
+        sizes = np.array([len(r) for r in records], dtype=np.int64)
+        # only consider year: a dtype of "S4" keeps the first 4 characters of "%Y.%m"
+        years_start = np.array([r[2] for rs in records for r in rs], dtype="S4").astype(np.int64)
+        years_end = np.array([r[3] for rs in records for r in rs], dtype="S4").astype(np.int64)
+        has_records = sizes > 0
+        offsets = (np.cumsum(sizes) - sizes)[has_records]
+        if len(offsets) > 0:
+            start[leaves[has_records]] = np.minimum.reduceat(years_start, offsets)
+            end[leaves[has_records]] = np.maximum.reduceat(years_end, offsets)
+        start[leaves[~has_records]], end[leaves[~has_records]] = 0, 9999
+
+        # set predecessors interval as the UNION of its children's, from the deepest level up.
+        # the nodes are sorted by depth once and split into levels
+        depth = np.array(trie.depths, dtype=np.int64)
+        by_depth = np.argsort(depth, kind="stable")
+        levels = np.split(by_depth, np.cumsum(np.bincount(depth))[:-1])
+        for nodes in reversed(levels[1:]):
+            nodes = nodes[alive[nodes]]
+            np.minimum.at(start, parent[nodes], start[nodes])
+            np.maximum.at(end, parent[nodes], end[nodes])
+        trie.set_intervals(start, end)
+        return self.interval_dict
+
+    def dead_num(self) -> int:
+        """
+        number of the nodes left in the trie without experiences
+        """
+        return len(self.trie) - self.alive_num
 
-        return restore_node_interval
+    def compact(self) -> np.ndarray:
+        """
+        remove the dead nodes from the trie and renumber the alive ones in the same order, resume_record, leaf_tag,
+        exp_nid and shenzhen_nid follow the new ids. Returns the new id of every old id (-1 for the removed nodes),
+        the tree in neo4j must be renumbered with it, see Neo4jAdapter.renumber_nodes
+        """
+        new_ids = self.trie.compact(np.array(self.trie.score, dtype=np.int64) > 0)
+        mapping = new_ids.tolist()
+        self.resume_record = {mapping[n]: records for n, records in self.resume_record.items() if mapping[n] >= 0}
+        self.leaf_tag = {mapping[n]: tag for n, tag in self.leaf_tag.items() if mapping[n] >= 0}
+        self.exp_nid = {exp_id: mapping[n] for exp_id, n in self.exp_nid.items()}
+        if self.shenzhen_nid is not None:
+            self.shenzhen_nid = mapping[self.shenzhen_nid] if mapping[self.shenzhen_nid] >= 0 else None
+        self.id_num = self.alive_num = len(self.trie)
+        return new_ids
 
     '''
     APIs of octree
     '''
 
-    def get_parent(self, node):  # faster
-        return self.parent(node.identifier)
+    def get_parent(self, n: int) -> int:
+        return self.trie.parent[n]
 
-    def get_children(self, node):
-        return self.children(node.identifier)
-        # return [i for i in node.children]
+    def get_children(self, n: int) -> List[int]:
+        return [c for c in self.trie.children(n) if self.trie.score[c] > 0]
 
-    def get_prefix_name(self, n, remove_tag=False):
-        if n.is_root():
-            return ""
-        parent_id = n.predecessor(self.identifier)
+    def get_prefix_name(self, n: int, remove_tag=False) -> str:
         if remove_tag:
-            result = self.get_prefix_name(self.get_node(parent_id), remove_tag=remove_tag) + n.data.name[:-1]
-        else:
-            result = self.get_prefix_name(self.get_node(parent_id)) + n.data.name
-        return result
-
-    def get_prefix_id(self, n):
-        if str(n) == '0':
-            return []
-        node = self.get_node(n)
-        parent_id = node.predecessor(self.identifier)
-        result = self.get_prefix_id(parent_id)
-        result.append(n)
-        return result
-
-    def get_depth_position(self, node):
-        depth_now = self.depth(node)
+            return ''.join(self.trie.name(i)[:-1] for i in self.trie.path(n))
+        return ''.join(self.trie.name(i) for i in self.trie.path(n))
+
+    def get_prefix_id(self, n: int) -> List[int]:
+        return self.trie.path(n)
+
+    def get_depth_position(self, node: int):
+        depth_now = self.trie.depth(node)
         depth_leaf = depth_now
         n = node
-        while not n.is_leaf():
+        while self.get_children(n):
             n = self.get_children(n)[0]
             depth_leaf += 1
 
@@ -318,67 +596,177 @@ class CTree(Tree):
     Intrinsic functions
     '''
 
-    def _add_sequence_treelib(self, resume_info: Tuple[str, int, str, str], tokens: str, nodes_rel: Dict) -> None:
+    def _add_sequence(self, resume_info: Tuple[str, int, str, str], tokens: str) -> int:
         """
-        main insertion loop of tree, based on treelib.
-        insert each word of an experience into the prefix tree.
+        main insertion loop of tree.
+        insert each word of an experience into the prefix tree, return the id of the last node
         :resume_info : (uuid, splitnum, time start, time end)
         :tokens : exp.text_token
-        :nodes_rel: {nodes:[],rel:[]}
         """
+        trie = self.trie
         experience = tokens.split(' ')
-        pointer = self.get_node(0)
+        pointer = PrefixTrie.ROOT
         # 建树：以root为根, root的每一个直接后继（children字典里的key） 都是.txt中的一个开头字符串
         for i in range(len(experience)):
             word = experience[i]
-            # find children of root
-            children = {node.tag: node for node in self.children(pointer.identifier)}
-            # search word or its abbr in children
+            # search word or its abbr in children of pointer
             # TODO: abbreviation match
+            child = trie.get_child(pointer, word)
             """ INSERTION """
-            if word in children:
-                pointer = children[word]
+            if child is not None:
+                pointer = child
+                self._touch(pointer)
                 if i == len(experience) - 1:  # repeat leaf node
-                    if pointer.data.count == 0:
-                        self.leaf_tag[pointer.data.id] = ''.join(experience)
-                    pointer.data.count_plus()
-                    self.resume_record[pointer.data.id].append(resume_info)
+                    if trie.count[pointer] == 0:
+                        self.leaf_tag[pointer] = ''.join(experience)
+                    trie.count[pointer] += 1
+                    self.resume_record[pointer].append(resume_info)
             else:  # Not find in children list
-                if word == "深圳市L" and self.shenzhen_nid is None:
-                    # record nid of 深圳 for export json tree
-                    self.shenzhen_nid = int(self.id_num)
                 if i == len(experience) - 1:  # last entity is the leaf node
-                    n1 = self.create_node(tag=word, identifier=self.id_num, parent=pointer.identifier,
-                                          data=CNode(id=self.id_num, name=word, count=1))
-                    self.resume_record[self.id_num] = [resume_info]
-                    self.leaf_tag[self.id_num] = ''.join(experience)
+                    n1 = trie.add_child(pointer, word, count=1)
+                    self.resume_record[n1] = [resume_info]
+                    self.leaf_tag[n1] = ''.join(experience)
                 else:
-                    n1 = self.create_node(tag=word, identifier=self.id_num, parent=pointer.identifier,
-                                          data=CNode(id=self.id_num, name=word, count=0))
-                    self.resume_record[self.id_num] = []
-                nodes_rel['rel'].append(((pointer.identifier, pointer.tag), {}, (self.id_num, word)))
-                self.id_num = self.id_num + 1
+                    n1 = trie.add_child(pointer, word, count=0)
+                    self.resume_record[n1] = []
+                if word == "深圳市L" and self.shenzhen_nid is None:
+                    # record nid of 深圳 for export json tree
+                    self.shenzhen_nid = n1
+                if self.__touched is not None:
+                    self.__touched[n1] = (False, 0, None)
                 pointer = n1
                 # 新插入的子结点作为下一个根节点
-            pointer.data.score_plus()
+            trie.score[pointer] += 1
+        return pointer
 
-    def _update_node_interval(self, n: treelib.Node, restore_node_interval: Dict) -> None:
-        if n.is_root():
-            return
-        if n.identifier not in restore_node_interval:
-            restore_node_interval[n.identifier] = (0, 9999)
-        start, end = restore_node_interval[n.identifier]
-        parent = self.get_node(n.predecessor(self.identifier))
-        set_node_time(parent.identifier, start, end, restore_node_interval)
-        self._update_node_interval(parent, restore_node_interval)
-
-    def _label_all_subnodes(self, root, class_map_all, class_id):
-        class_map_all[root.identifier] = class_id
-        if root.is_leaf():
+    def _record_user_exp(self, exp: Experience, persons: Dict, removed: List[str]) -> None:
+        """
+        keep the experience in user_exps if it has a text, i.e. if CareerSocialNetwork.store_user_resume_nodes stores
+        it as a YearUser node, whether it is in the tree or not. The persons whose experiences change are added to
+        persons, the ids of the experiences which lose their text to removed
+        """
+        exp_id = str(exp.uuid) + '+' + str(exp.splitnum)
+        old = self.user_exps.get(exp_id)
+        if exp.text:
+            new = Experience(**{attr: getattr(exp, attr) for attr in self.USER_EXP_ATTRS})
+            if old is not None and all(getattr(old, attr) == getattr(new, attr) for attr in self.USER_EXP_ATTRS):
+                return
+        elif old is None:
             return
+        if old is not None:
+            del self.user_exps[exp_id]
+            exp_ids = self.person_exp_ids[old.person_uuid]
+            del exp_ids[exp_id]
+            if not exp_ids:
+                del self.person_exp_ids[old.person_uuid]
+            persons[old.person_uuid] = None
+        if exp.text:
+            self.user_exps[exp_id] = new
+            self.person_exp_ids.setdefault(new.person_uuid, {})[exp_id] = None
+            persons[new.person_uuid] = None
         else:
-            for child in self.get_children(root):
-                self._label_all_subnodes(child, class_map_all, class_id)
+            removed.append(exp_id)
+
+    def _same_experience(self, exp_id: str, resume_info: Tuple[str, int, str, str], tokens: str) -> bool:
+        """
+        whether the experience exp_id in the tree has the same resume info and tokens
+        """
+        nid = self.exp_nid[exp_id]
+        if resume_info not in self.resume_record.get(nid, []):
+            return False
+        return [self.trie.name(n) for n in self.trie.path(nid)] == tokens.split(' ')
+
+    def _remove_experience(self, exp_id: str, keep_rank=False) -> None:
+        """
+        remove the resume of an experience from the tree and update the counts and intervals along its path
+        """
+        nid = self.exp_nid.pop(exp_id, None)
+        if not keep_rank:
+            self.rank_record.pop(exp_id, None)
+        if nid is None:
+            return
+        trie = self.trie
+        path = trie.path(nid)
+        for n in path:
+            self._touch(n)
+        records = self.resume_record[nid]
+        del records[next(i for i, r in enumerate(records) if r[0] == exp_id)]
+        trie.count[nid] -= 1
+        if trie.count[nid] == 0:
+            self.leaf_tag.pop(nid, None)
+        for n in path:
+            trie.score[n] -= 1
+        self._update_path_interval(nid)
+
+    def _update_path_interval(self, nid: int, added: Tuple[int, int] = None) -> None:
+        """
+        update the intervals from nid up to the root after an experience ending at nid is inserted (added is its
+        (start year, end year)) or removed. Stops at the first node whose interval and aliveness do not change
+        """
+        trie = self.trie
+        n, child, child_old, child_new = nid, None, None, None
+        while True:
+            old = trie.interval(n)
+            if n != PrefixTrie.ROOT and trie.score[n] == 0:  # no longer alive
+                new = None
+            elif child is not None and child_old is not None and child_new is not None and \
+                    child_new[0] <= child_old[0] and child_new[1] >= child_old[1] and old is not None:
+                # the only changed child was alive before and its interval only grew
+                new = (min(old[0], child_new[0]), max(old[1], child_new[1]))
+            else:
+                intervals = [trie.interval(c) for c in self.get_children(n)]
+                if intervals:
+                    new = (min(i[0] for i in intervals), max(i[1] for i in intervals))
+                elif n == PrefixTrie.ROOT:
+                    new = None
+                elif added is not None and n == nid:
+                    new = added if old is None else (min(old[0], added[0]), max(old[1], added[1]))
+                else:
+                    years = [(int(s[:4]), int(e[:4])) for _, _, s, e in self.resume_record.get(n, [])]
+                    new = (min(y[0] for y in years), max(y[1] for y in years)) if years else (0, 9999)
+            if new is None:
+                trie.clear_interval(n)
+            else:
+                trie.set_interval(n, new[0], new[1], union=False)
+            # aliveness of n changes when its score turns from 0 to 1 or from 1 to 0
+            alive_changed = n != PrefixTrie.ROOT and trie.score[n] == (1 if added is not None else 0)
+            if n == PrefixTrie.ROOT or (new == old and not alive_changed):
+                return
+            child, child_old, child_new = n, (None if alive_changed else old), new
+            n = trie.parent[n]
+
+    def _touch(self, n: int) -> None:
+        """
+        record the state of node n before it is first modified during an incremental build
+        """
+        if self.__touched is not None and n not in self.__touched:
+            self.__touched[n] = self._node_state(n)
+
+    def _node_state(self, n: int) -> Tuple[bool, int, Tuple[int, int] or None]:
+        return n == PrefixTrie.ROOT or self.trie.score[n] > 0, self.trie.count[n], self.trie.interval(n)
+
+    def _collect_delta(self) -> Tuple[List[int], List[int], List[int]]:
+        """
+        compare the nodes touched during the incremental build with their previous state
+        """
+        added, updated, removed = [], [], []
+        for n, (alive_before, count_before, interval_before) in sorted(self.__touched.items()):
+            alive, count, interval = self._node_state(n)
+            if alive and not alive_before:
+                added.append(n)
+            elif alive_before and not alive:
+                removed.append(n)
+            elif alive and (count, interval) != (count_before, interval_before):
+                updated.append(n)
+        self.__touched = None
+        return added, updated, removed
+
+    def _label_all_subnodes(self, root: int, class_map_all, class_id):
+        stack = [root]
+        while stack:
+            n = stack.pop()
+            class_map_all[n] = class_id
+            stack.extend(self.get_children(n))
 
     def _creat_ori_viznode(self, name, parent, count, node_id, class_id, start, end):
         temp = {}
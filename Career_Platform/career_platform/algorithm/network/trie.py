@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# coding=utf-8
+from array import array
+from typing import List, Tuple, Dict, Iterator, Optional, Mapping
+import numpy as np
+
+__all__ = ["PrefixTrie"]
+
+
+class PrefixTrie(object):
+    """
+    Array-backed prefix trie used by CTree.
+
+    Nodes are numbered 0, 1, 2, ... in insertion order and node 0 is the root. Every attribute of a node
+    is stored in a typed array indexed by its id:
+        parent: id of the parent node, -1 for the root
+        tag: index of the node's tag in the interned string table `tags`
+        count: number of sequences ending at the node
+        score: number of sequences passing through the node
+        depths: number of edges from the root, set when the node is created from the depth of its parent
+        interval_start, interval_end: existing interval (years) of the node, see set_interval. `intervals` is a
+            read-only mapping over the two arrays
+
+    Children are found through a dict (parent id, tag index) -> child id while inserting, and listed through
+    a CSR layout (child_offsets, child_ids). Children added after the CSR layout is built are kept in a small
+    pending dict until they outnumber 1/CSR_REBUILD_RATIO of the layout, so that inserting into a large trie
+    does not rebuild it every time. Nodes are never moved, and only removed by compact, which renumbers the remaining
+    ones.
+    """
+    ROOT = 0
+    INTERVAL_UNSET = (2**31 - 1, -1)    # (start, end) of a node whose interval is not set yet
+    CSR_REBUILD_RATIO = 8
+
+    def __init__(self, root_tag: str = "root"):
+        self.tags: List[str] = []           # interned tag strings
+        self.tag_ids: Dict[str, int] = {}   # tag string -> index in tags
+        self.parent = array('i', [-1])
+        self.tag = array('i', [self.intern(root_tag)])
+        self.count = array('q', [0])
+        self.score = array('q', [0])
+        self.depths = array('i', [0])
+        self.interval_start = array('i', [self.INTERVAL_UNSET[0]])
+        self.interval_end = array('i', [self.INTERVAL_UNSET[1]])
+        self.__child_dict: Dict[int, int] = {}    # (parent id << 32 | tag index) -> child id
+        self.__child_offsets = None
+        self.__child_ids = None
+        self.__pending_children: Dict[int, List[int]] = {}  # parent id -> children added after the CSR layout was built
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def intern(self, tag: str) -> int:
+        """
+        index of tag in the string table, tag is added if not present
+        """
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = len(self.tags)
+            self.tags.append(tag)
+            self.tag_ids[tag] = tag_id
+        return tag_id
+
+    def add_child(self, parent: int, tag: str, count: int = 0) -> int:
+        """
+        create a child of parent with the given tag and return its id. parent must not have a child with this tag yet
+        """
+        nid = len(self.parent)
+        tag_id = self.intern(tag)
+        self.parent.append(parent)
+        self.tag.append(tag_id)
+        self.count.append(count)
+        self.score.append(0)
+        self.depths.append(self.depths[parent] + 1)
+        self.interval_start.append(self.INTERVAL_UNSET[0])
+        self.interval_end.append(self.INTERVAL_UNSET[1])
+        self.__child_dict[parent << 32 | tag_id] = nid
+        if self.__child_offsets is not None:
+            self.__pending_children.setdefault(parent, []).append(nid)
+        return nid
+
+    def get_child(self, parent: int, tag: str) -> Optional[int]:
+        """
+        id of the child of parent with the given tag, or None
+        """
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return None
+        return self.__child_dict.get(parent << 32 | tag_id)
+
+    def name(self, nid: int) -> str:
+        return self.tags[self.tag[nid]]
+
+    def children(self, nid: int) -> List[int]:
+        """
+        ids of the children of nid in insertion order
+        """
+        offsets, child_ids = self.__csr()
+        result = child_ids[offsets[nid]:offsets[nid + 1]].tolist() if nid + 1 < len(offsets) else []
+        return result + self.__pending_children.get(nid, [])
+
+    def is_leaf(self, nid: int) -> bool:
+        offsets, _ = self.__csr()
+        if nid + 1 < len(offsets) and offsets[nid] != offsets[nid + 1]:
+            return False
+        return nid not in self.__pending_children
+
+    def leaves(self) -> List[int]:
+        """
+        ids of all the nodes without children, in id order
+        """
+        offsets, _ = self.__csr(rebuild=len(self.__pending_children) > 0)
+        return np.flatnonzero(offsets[1:] == offsets[:-1]).tolist()
+
+    def path(self, nid: int) -> List[int]:
+        """
+        ids of the nodes from the root (excluded) down to nid
+        """
+        result = []
+        while nid != self.ROOT:
+            result.append(nid)
+            nid = self.parent[nid]
+        result.reverse()
+        return result
+
+    def depth(self, nid: int) -> int:
+        return self.depths[nid]
+
+    def subtree(self, nid: int) -> Iterator[int]:
+        """
+        ids of nid and all its descendants in pre-order
+        """
+        stack = [nid]
+        while stack:
+            nid = stack.pop()
+            yield nid
+            stack.extend(reversed(self.children(nid)))
+
+    def interval(self, nid: int) -> Optional[Tuple[int, int]]:
+        """
+        (start, end) of nid, or None if not set
+        """
+        if self.interval_end[nid] == self.INTERVAL_UNSET[1]:
+            return None
+        return self.interval_start[nid], self.interval_end[nid]
+
+    def set_interval(self, nid: int, start: int, end: int, union: bool = True) -> None:
+        """
+        set the interval of nid to (start, end), or extend it to cover (start, end) if union is True and it is already set
+        """
+        if union and self.interval_end[nid] != self.INTERVAL_UNSET[1]:
+            start = min(start, self.interval_start[nid])
+            end = max(end, self.interval_end[nid])
+        self.interval_start[nid] = start
+        self.interval_end[nid] = end
+
+    def clear_interval(self, nid: int) -> None:
+        self.interval_start[nid], self.interval_end[nid] = self.INTERVAL_UNSET
+
+    @property
+    def intervals(self) -> "NodeIntervals":
+        return NodeIntervals(self)
+
+    def interval_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        copies of (interval_start, interval_end) as int64 arrays, unset intervals are INTERVAL_UNSET
+        """
+        return np.array(self.interval_start, dtype=np.int64), np.array(self.interval_end, dtype=np.int64)
+
+    def set_intervals(self, start: np.ndarray, end: np.ndarray) -> None:
+        """
+        replace the intervals of all the nodes by the arrays start and end, in the format of interval_arrays
+        """
+        if len(start) != len(self.parent) or len(end) != len(self.parent):
+            raise ValueError("expected {} intervals, got {} starts and {} ends".format(len(self.parent), len(start), len(end)))
+        self.interval_start = array('i', np.asarray(start, dtype=np.int32).tobytes())
+        self.interval_end = array('i', np.asarray(end, dtype=np.int32).tobytes())
+
+    def compact(self, keep: np.ndarray) -> np.ndarray:
+        """
+        remove the nodes where keep (a bool array indexed by node id) is False and renumber the others in the same
+        order, so that ids stay contiguous and every parent still comes before its children. The parent of a kept node
+        must be kept, the root is always kept. Returns the new id of every old id, -1 for the removed nodes
+        """
+        keep = np.array(keep, dtype=bool)
+        keep[self.ROOT] = True
+        parent = np.array(self.parent, dtype=np.int64)
+        if not keep[parent[1:][keep[1:]]].all():
+            raise ValueError("the parent of a kept node must be kept")
+        new_ids = np.cumsum(keep) - 1
+        new_ids[~keep] = -1
+        new_parent = new_ids[parent[keep][1:]]
+        # tags only used by the removed nodes are dropped from the string table
+        used_tags, new_tag = np.unique(np.array(self.tag, dtype=np.int64)[keep], return_inverse=True)
+        self.tags = [self.tags[t] for t in used_tags.tolist()]
+        self.tag_ids = {tag: tag_id for tag_id, tag in enumerate(self.tags)}
+        self.parent = array('i', np.concatenate(([-1], new_parent)).astype(np.int32).tobytes())
+        self.tag = array('i', new_tag.astype(np.int32).tobytes())
+        # the ancestors of a kept node are kept, so depths do not change
+        for name, typecode in (("count", 'q'), ("score", 'q'), ("depths", 'i'), ("interval_start", 'i'), ("interval_end", 'i')):
+            values = np.array(getattr(self, name), dtype=np.int64)[keep]
+            setattr(self, name, array(typecode, values.astype(np.int64 if typecode == 'q' else np.int32).tobytes()))
+        keys = (new_parent << 32) | new_tag[1:]
+        self.__child_dict = dict(zip(keys.tolist(), range(1, len(self.parent))))
+        self.__child_offsets, self.__child_ids, self.__pending_children = None, None, {}
+        return new_ids
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        if "depths" not in state:
+            # tries pickled before depths was added: parents come before their children, one pass in id order
+            depths = [0] * len(self.parent)
+            for nid in range(1, len(self.parent)):
+                depths[nid] = depths[self.parent[nid]] + 1
+            self.depths = array('i', depths)
+
+    def __csr(self, rebuild: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (child_offsets, child_ids): the children of nid are child_ids[child_offsets[nid]:child_offsets[nid+1]]
+        plus __pending_children[nid]. Nodes added after the layout was built are not covered by child_offsets
+        """
+        n = len(self.parent)
+        if self.__child_offsets is not None and not rebuild:
+            # rebuild once the nodes added since the last build are too many
+            rebuild = (n + 1 - len(self.__child_offsets)) * self.CSR_REBUILD_RATIO > n
+        if self.__child_offsets is None or rebuild:
+            self.__pending_children = {}
+            parents = np.array(self.parent, dtype=np.int64)[1:]
+            # a stable sort by parent keeps the children of each node in insertion order
+            self.__child_ids = np.argsort(parents, kind="stable") + 1
+            self.__child_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(parents, minlength=n), out=self.__child_offsets[1:])
+        return self.__child_offsets, self.__child_ids
+
+
+class NodeIntervals(Mapping):
+    """
+    read-only mapping node id -> (start, end) over the interval arrays of a PrefixTrie, containing the nodes whose
+    interval is set. It reflects later changes of the trie
+    """
+    def __init__(self, trie: PrefixTrie):
+        self.__trie = trie
+
+    def __getitem__(self, nid: int) -> Tuple[int, int]:
+        interval = self.__trie.interval(nid) if 0 <= nid < len(self.__trie) else None
+        if interval is None:
+            raise KeyError(nid)
+        return interval
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(np.flatnonzero(self.__set_mask()).tolist())
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.__set_mask()))
+
+    def __set_mask(self) -> np.ndarray:
+        return np.array(self.__trie.interval_end, dtype=np.int64) != PrefixTrie.INTERVAL_UNSET[1]
@@ -2,9 +2,12 @@
 functions used in CTree class func
 '''
 import pandas as pd
+import numpy as np
 import pickle
 import os
 
+USER_PAIR_BLOCK_SIZE = 1024     # user_pair每次与resume_lb整体比较的resume_la行数, 限制临时矩阵的大小
+
 
 def set_node_time(nid, startTime, endTime, restore_node_interval):
     if nid not in restore_node_interval:
@@ -41,23 +44,38 @@ def coincident_interval(ia, ib, min_year, max_year):
 
 
 def user_pair(resume_la, resume_lb, start, end):
-    """  """
+    """
+    resume_la与resume_lb中不同人员、在[start, end]内时间有重合的经历对, 结果及顺序与逐对调用coincident_interval相同.
+    起止时间先整体转为数组, 再按USER_PAIR_BLOCK_SIZE行一块在numpy中比较, 只对有重合的经历对生成结果
+    """
     results = []
-    for ra in resume_la:
-        eid_a, uid_a, interval_as, interval_ae = ra
-        for rb in resume_lb:
-            eid_b, uid_b, interval_bs, interval_be = rb
-            co_period = coincident_interval((interval_as, interval_ae),
-                                            (interval_bs, interval_be),
-                                            min_year=start,
-                                            max_year=end)
-            if uid_a == uid_b or co_period == []:
-                continue
-            else:
-                results.append((eid_a, eid_b, co_period))
+    if len(resume_la) == 0 or len(resume_lb) == 0:
+        return results
+    uid_codes = {}      # person uuid -> 整数编号, 用于在数组中比较人员
+    eid_a, uid_a, sa, ea = _resume_arrays(resume_la, start, end, uid_codes)
+    eid_b, uid_b, sb, eb = _resume_arrays(resume_lb, start, end, uid_codes)
+    for block_start in range(0, len(eid_a), USER_PAIR_BLOCK_SIZE):
+        block = slice(block_start, block_start + USER_PAIR_BLOCK_SIZE)
+        overlap = (ea[block, None] > sb[None, :]) & (eb[None, :] > sa[block, None]) & (uid_a[block, None] != uid_b[None, :])
+        rows, cols = np.nonzero(overlap)    # 按行优先顺序, 与双重循环的顺序相同
+        co_starts = np.maximum(sa[block][rows], sb[cols]).tolist()
+        co_ends = np.minimum(ea[block][rows], eb[cols]).tolist()
+        for row, col, co_start, co_end in zip((rows + block_start).tolist(), cols.tolist(), co_starts, co_ends):
+            results.append((eid_a[row], eid_b[col], [format(co_start, '.2f'), format(co_end, '.2f')]))
     return results
 
 
+def _resume_arrays(resume_list, start, end, uid_codes):
+    """
+    将(eid, uid, 开始时间, 结束时间)的列表转为eid列表、uid编号数组, 以及截断到[start, end]的起止时间数组
+    """
+    eids, uids, starts, ends = zip(*resume_list)
+    uid_array = np.array([uid_codes.setdefault(uid, len(uid_codes)) for uid in uids], dtype=np.int64)
+    start_array = np.maximum(np.array(starts, dtype=np.float64), float(start))
+    end_array = np.minimum(np.array(ends, dtype=np.float64), float(end))
+    return list(eids), uid_array, start_array, end_array
+
+
 def get_rank_dict(path=os.path.join(os.path.dirname(__file__), "./data/rank.xlsx")):
     rank_excel = pd.read_excel(path)
     rank_dict = {"null": -1}
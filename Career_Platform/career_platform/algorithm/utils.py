@@ -1,7 +1,13 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import *
 from tqdm import tqdm
 
 
-__all__ = ["tqdm_callback"]
+__all__ = ["tqdm_callback", "LRUCache", "file_digest"]
 
 def tqdm_callback(description:str="Processing..."):
     """
@@ -16,4 +22,79 @@ def tqdm_callback(description:str="Processing..."):
         tqdm_obj.total = c_dict["total"]
         tqdm_obj.n = c_dict["iternum"]
         tqdm_obj.display()  # 请用display()来刷新tqdm，这样进度条滚动会很丝滑
-    return __cb
\ No newline at end of file
+    return __cb
+
+
+class LRUCache():
+    """
+    有容量上限的LRU缓存, 超出maxsize时淘汰最久未被访问的项. 记录get的命中和未命中次数, 可以用info()查看以确定合适的容量
+
+    与functools.lru_cache不同, 可以由调用方自行决定何时查询、何时写入, 适合批量查询后再批量写入未命中项的场景.
+    get/put/clear/info都在锁内完成, 可以被多个线程共享(如API服务中并发的run_sync)
+    """
+    def __init__(self, maxsize:int=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data:OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        """
+        查询key对应的值, 命中时将其标记为最近访问. 未命中返回default
+        """
+        with self.__lock:
+            if key in self.__data:
+                self.hits += 1
+                self.__data.move_to_end(key)
+                return self.__data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key:Hashable, value:Any):
+        """
+        写入key对应的值, 超出容量时淘汰最久未被访问的项
+        """
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        """
+        清空缓存并将命中计数归零
+        """
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        """
+        返回缓存的命中次数、未命中次数、容量上限和当前大小
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "maxsize": self.maxsize, "currsize": len(self.__data)}
+
+
+def file_digest(path:str) -> str:
+    """
+    返回文件内容的sha1摘要, 文件不存在时返回空字符串. 按(路径, 修改时间, 大小)缓存, 同一进程中不会重复读取未变化的文件
+    """
+    if not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    return _file_digest_cached(path, stat.st_mtime, stat.st_size)
+
+
+@lru_cache(maxsize=None)
+def _file_digest_cached(path:str, mtime:float, size:int) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
@@ -1,2 +1,3 @@
 from .person import *
-from .experience import *
\ No newline at end of file
+from .experience import *
+from .experience_table import *
\ No newline at end of file
@@ -26,39 +26,37 @@ class Experience():
     
     Functions:
         attr2dict(): 获得该实例的所有公开访问属性, 以字典形式返回
+        copy(): 返回该实例的副本
         duration(): 返回经历持续时间, 以月或日为单位, 默认以月为单位
     """
+    # 使用__slots__保存属性, 实例没有__dict__. 加载整张exp表时有数百万个实例, 每个实例可以省下一个dict的内存
+    # 增加属性时需同时修改__slots__, __init__, copy()和下面的__PUBLIC_ATTRS或__PROPERTIES
+    __slots__ = ("uuid", "splitnum", "ordernum", "person_uuid",
+                 "text", "text_token", "text_raw", "text_rawpinyin", "text_rawrefine", "text_rawsplit", "text_rawtoken", "adminrank",
+                 "__time_start", "__time_end")
+    __PUBLIC_ATTRS = __slots__[:-2]             # 公有属性, 按attr2dict中的顺序排列
+    __PROPERTIES = ("time_start", "time_end")   # 被@property和@*.setter修饰为公开访问属性的私有属性
+
     def __init__(self, **kwargs):
+        # 只有传入的值为真时才使用传入的值, 否则使用默认值
         # 公有属性
-        self.uuid: str = None                               # 履历在数据中心的uuid（A16主键）
-        self.splitnum: int = 0                              # 编号，代表本条记录是对应经历原文的第几个兼职拆分结果. 若没被拆分则为0
-        self.ordernum: int = None                           # 编号，代表本记录是对应人员的第几条经历
-        self.person_uuid: str = None                        # 经历所属人员UUID（数据中心A00）
+        self.uuid: str = kwargs.get("uuid") or None                        # 履历在数据中心的uuid（A16主键）
+        self.splitnum: int = kwargs.get("splitnum") or 0                   # 编号，代表本条记录是对应经历原文的第几个兼职拆分结果. 若没被拆分则为0
+        self.ordernum: int = kwargs.get("ordernum") or None                # 编号，代表本记录是对应人员的第几条经历
+        self.person_uuid: str = kwargs.get("person_uuid") or None          # 经历所属人员UUID（数据中心A00）
         
-        self.text: str = None                               # 经历文本
-        self.text_token: str = None                         # 经历文本的token
-        self.text_raw: str = None                           # 经历原文
-        self.text_rawpinyin: str = None                     # 经历原文（首字母拼音）
-        self.text_rawrefine: str = None                     # 经历原文（refine后）
-        self.text_rawsplit: str = None                      # 经历原文（adjunct_split后）
-        self.text_rawtoken: str = None                      # 经历原文（tokenize后）
-        self.adminrank: str = None                          # 经历行政级别
-
-        # 私有属性,其中一部分被@property和@*setter修饰为公开访问属性
-        self.__time_start: datetime.date = None             # 经历开始日期
-        self.__time_end: datetime.date = None               # 经历结束日期
+        self.text: str = kwargs.get("text") or None                        # 经历文本
+        self.text_token: str = kwargs.get("text_token") or None            # 经历文本的token
+        self.text_raw: str = kwargs.get("text_raw") or None                # 经历原文
+        self.text_rawpinyin: str = kwargs.get("text_rawpinyin") or None    # 经历原文（首字母拼音）
+        self.text_rawrefine: str = kwargs.get("text_rawrefine") or None    # 经历原文（refine后）
+        self.text_rawsplit: str = kwargs.get("text_rawsplit") or None      # 经历原文（adjunct_split后）
+        self.text_rawtoken: str = kwargs.get("text_rawtoken") or None      # 经历原文（tokenize后）
+        self.adminrank: str = kwargs.get("adminrank") or None              # 经历行政级别
 
-        # 所有公有属性带参初始化赋值
-        public_attrs = [key for key in self.__dict__.keys() if key[0]!='_']
-        for attr in public_attrs:
-            if kwargs.get(attr, False):
-                self.__setattr__(attr, kwargs[attr])
-        
-        # 被@property和@*.setter修饰的私有属性初始化赋值
-        if kwargs.get('time_start', False):
-            self.time_start = kwargs['time_start']
-        if kwargs.get('time_end', False):
-            self.time_end = kwargs['time_end']
+        # 私有属性, 通过@*.setter赋值以进行类型检查
+        self.time_start: datetime.date = kwargs.get("time_start") or None  # 经历开始日期
+        self.time_end: datetime.date = kwargs.get("time_end") or None      # 经历结束日期
 
     @property
     def time_start(self) -> datetime.date:
@@ -84,24 +82,43 @@ class Experience():
         """
         return str(self.attr2dict())
 
+    def copy(self) -> "Experience":
+        """
+        返回该实例的副本. 所有属性都是str、int、datetime.date等不可变对象, 逐个复制属性引用即可,
+        结果与copy.deepcopy相同, 但不需要遍历对象图. 逐个赋值比遍历__slots__的getattr/setattr快得多
+        """
+        new_exp = self.__class__.__new__(self.__class__)
+        new_exp.uuid = self.uuid
+        new_exp.splitnum = self.splitnum
+        new_exp.ordernum = self.ordernum
+        new_exp.person_uuid = self.person_uuid
+        new_exp.text = self.text
+        new_exp.text_token = self.text_token
+        new_exp.text_raw = self.text_raw
+        new_exp.text_rawpinyin = self.text_rawpinyin
+        new_exp.text_rawrefine = self.text_rawrefine
+        new_exp.text_rawsplit = self.text_rawsplit
+        new_exp.text_rawtoken = self.text_rawtoken
+        new_exp.adminrank = self.adminrank
+        new_exp.__time_start = self.__time_start
+        new_exp.__time_end = self.__time_end
+        return new_exp
+
     def attr2dict(self) -> Dict[str, Any]:
         """
         将对象公共属性转为{属性名:属性值}的词典
         """
-        # __init__时创建的公有属性和属性值
-        attrs = {name: value for name, value in self.__dict__.items() if name[0] != "_"}
-        # 被@property修饰符创建的公有属性和属性值
-        properties = {name: self.__getattribute__(name) for name, obj in vars(self.__class__).items() if isinstance(obj, property)}
-        attrs.update(properties)
-        
-        return attrs
+        # 公有属性和被@property修饰符创建的公有属性
+        return {name: getattr(self, name) for name in self.__PUBLIC_ATTRS + self.__PROPERTIES}
     
-    def duration(self, unit:str="month") -> int or None:
+    def duration(self, unit:str="month", today:datetime.date=None) -> int or None:
         """
         返回经历的持续时间, 通过time_start和time_end计算得到
         
         Params:
             unit (str): 持续时间的单位，可以是"month"或"day"
+            today (datetime.date): time_end为datetime.date.max(至今)时作为结束日期, 默认为datetime.date.today().
+                                   对一批经历计算时传入同一个值, 避免每条都调用today(). 批量计算见ExperienceTable.durations
         """
         # 起止时间有None则返回None
         if (self.time_start is None) or (self.time_end is None):
@@ -110,7 +127,7 @@ class Experience():
         if unit == "month":
             # 经历time_end为datetime.date.max时，返回time_start到今天的时间
             if self.time_end == datetime.date.max:
-                today = datetime.date.today()
+                today = today or datetime.date.today()
                 return (today.year-self.time_start.year)*12 + today.month - self.time_start.month
             else:
                 return (self.time_end.year-self.time_start.year)*12 + self.time_end.month - self.time_start.month
@@ -118,7 +135,7 @@ class Experience():
         elif unit == "day":
             # 经历time_end为datetime.date.max时，返回time_start到今天的时间
             if self.time_end == datetime.date.max:
-                return (datetime.date.today() - self.time_start).days
+                return ((today or datetime.date.today()) - self.time_start).days
             # 否则返回time_end-time_start
             else:
                 return (self.time_end - self.time_start).days
@@ -0,0 +1,271 @@
+import datetime
+from typing import *
+import numpy as np
+from .experience import Experience
+
+__all__ = ["ExperienceTable"]
+
+
+class ExperienceTable():
+    """
+    按列存储的一批Experience, 每个属性是一个长度相同的numpy数组:
+        uuid, person_uuid, text, text_token, text_raw, ... , adminrank: object数组, 元素为str或None
+        splitnum: int64数组
+        ordernum: int64数组, None保存为ORDERNUM_NA
+        time_start, time_end: datetime64[D]数组, None保存为NaT. datetime.datetime会被截断为日期
+
+    适合一次处理整张exp表的场景: 排序、按人员分组、起止时间的计算都可以在数组上完成, 内存占用也比同样数量的Experience少.
+    需要逐条处理时, 迭代或按下标取出的每一行都是一个新的Experience, 其中的字符串与表中的是同一个对象(不复制),
+    修改取出的Experience不会改变表中的数据.
+
+    exp_parser的各个阶段、octree以及CareerDBExperienceMapper.save都可以直接传入ExperienceTable
+
+    Functions:
+        from_experiences(): 由Experience构造
+        from_rows(): 由数据库查询结果等按属性顺序排列的元组构造
+        to_experiences(): 转为Experience列表
+        rows(): 按属性顺序返回每一行的元组, 可直接用于数据库写入
+        sort_by(): 按若干列排序, 返回新表
+        group_by_person(): 按person_uuid分组
+        month_start(), month_end(): 起止时间的月份序号数组, 可用于计算区间
+        durations(): 每条经历的持续时间数组, 与逐条调用Experience.duration相同
+        concat(): 拼接多个表
+    """
+    STR_ATTRS = ("uuid", "person_uuid", "text", "text_token", "text_raw", "text_rawpinyin",
+                 "text_rawrefine", "text_rawsplit", "text_rawtoken", "adminrank")     # object数组保存的属性
+    INT_ATTRS = ("splitnum", "ordernum")        # int64数组保存的属性
+    DATE_ATTRS = ("time_start", "time_end")     # datetime64[D]数组保存的属性
+    ATTRS = tuple(Experience().attr2dict().keys())  # 所有属性, 顺序与Experience.attr2dict相同
+
+    ORDERNUM_NA = -1    # ordernum为None时在数组中的值
+    MONTH_NA = -1       # month_start, month_end中时间为None时的值
+    __EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()   # datetime64的0点对应的公历序数
+
+    def __init__(self, columns:Dict[str, np.ndarray]=None):
+        """
+        Params:
+            columns: 属性名 -> 该属性的数组, 必须包含ATTRS中的全部属性且长度相同. 为None时创建空表
+        """
+        if columns is None:
+            columns = {attr: self.__empty_column(attr) for attr in self.ATTRS}
+        missing = [attr for attr in self.ATTRS if attr not in columns]
+        if len(missing) > 0:
+            raise ValueError("缺少属性{}对应的列".format(missing))
+        lengths = {len(columns[attr]) for attr in self.ATTRS}
+        if len(lengths) > 1:
+            raise ValueError("各列的长度不一致: {}".format(lengths))
+        self.columns:Dict[str, np.ndarray] = {attr: columns[attr] for attr in self.ATTRS}
+
+    @classmethod
+    def from_experiences(cls, exp_iter:Iterable[Experience]) -> "ExperienceTable":
+        """
+        由Experience构造
+        """
+        exp_list = exp_iter if isinstance(exp_iter, (list, tuple)) else list(exp_iter)
+        columns = {attr: [getattr(exp, attr) for exp in exp_list] for attr in cls.ATTRS}
+        return cls(cls.__to_arrays(columns))
+
+    @classmethod
+    def from_rows(cls, rows:Sequence[Tuple], attrs:Sequence[str]) -> "ExperienceTable":
+        """
+        由按attrs顺序排列的元组构造, 如数据库查询的结果. 与逐行Experience(**dict(zip(attrs, row)))的结果相同,
+        包括值为假时使用默认值、时间的类型检查, 但不需要为每一行构造dict和Experience
+
+        Params:
+            rows: 每一行的元组
+            attrs: 元组中每个位置对应的属性名, 没有出现的属性使用默认值
+        """
+        unknown = [attr for attr in attrs if attr not in cls.ATTRS]
+        if len(unknown) > 0:
+            raise ValueError("未知的属性{}".format(unknown))
+        n = len(rows)
+        value_lists = list(zip(*rows)) if n > 0 else [() for _ in attrs]
+        columns = {}
+        for attr in cls.ATTRS:
+            if attr in attrs:
+                # 与Experience.__init__相同: 只有值为真时才使用该值
+                default = 0 if attr == "splitnum" else None
+                columns[attr] = [value or default for value in value_lists[attrs.index(attr)]]
+            else:
+                columns[attr] = [0 if attr == "splitnum" else None] * n
+        return cls(cls.__to_arrays(columns))
+
+    def to_experiences(self) -> List[Experience]:
+        """
+        转为Experience列表
+        """
+        return list(self)
+
+    def rows(self, attrs:Sequence[str]) -> List[Tuple]:
+        """
+        返回每一行按attrs顺序排列的元组, 与[tuple(getattr(exp, attr) for attr in attrs) for exp in 本表]相同
+        """
+        return list(zip(*[self.__object_column(attr) for attr in attrs]))
+
+    def __len__(self) -> int:
+        return len(self.columns["uuid"])
+
+    def __iter__(self) -> Iterator[Experience]:
+        value_lists = [self.__object_column(attr) for attr in self.ATTRS]
+        for values in zip(*value_lists):
+            yield self.__make_experience(values)
+
+    def __getitem__(self, key):
+        """
+        table["uuid"]: 返回该属性的数组
+        table[i]: 返回第i行的Experience
+        table[slice], table[下标数组], table[bool数组]: 返回由这些行组成的新表
+        """
+        if isinstance(key, str):
+            return self.columns[key]
+        if isinstance(key, (int, np.integer)):
+            return self.__make_experience([self.__object_value(attr, self.columns[attr][key]) for attr in self.ATTRS])
+        return ExperienceTable({attr: column[key] for attr, column in self.columns.items()})
+
+    def __str__(self) -> str:
+        return "ExperienceTable({} rows)".format(len(self))
+
+    def sort_by(self, *attrs:str) -> "ExperienceTable":
+        """
+        按attrs依次排序(稳定排序), 返回新表. None排在最前面
+        """
+        keys = []
+        for attr in reversed(attrs):     # np.lexsort以最后一个key为第一关键字
+            column = self.columns[attr]
+            if attr in self.STR_ATTRS:
+                is_none = np.equal(column, None)
+                keys.append(np.where(is_none, "", column).astype(str))
+                keys.append(~is_none)
+            else:
+                keys.append(column.view(np.int64) if attr in self.DATE_ATTRS else column)   # NaT为int64的最小值, 排在最前面
+        if len(keys) == 0:
+            return self[:]
+        return self[np.lexsort(keys)]
+
+    def group_by_person(self) -> Iterator[Tuple[str, "ExperienceTable"]]:
+        """
+        按person_uuid分组, 依次返回(person_uuid, 该人员的经历组成的表). 组按person_uuid排序, 组内保持原有顺序
+        """
+        table = self.sort_by("person_uuid")
+        person_column = table.columns["person_uuid"]
+        if len(table) == 0:
+            return
+        # 相邻两行person_uuid不同的位置即为组的边界
+        boundaries = np.flatnonzero(person_column[1:] != person_column[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(table)]))
+        for start, end in zip(starts, ends):
+            yield person_column[start], table[start:end]
+
+    def month_start(self) -> np.ndarray:
+        """
+        time_start的月份序号(年*12+月-1), None为MONTH_NA. 两个月份序号之差即为相差的月数
+        """
+        return self.__month_index(self.columns["time_start"])
+
+    def month_end(self) -> np.ndarray:
+        """
+        time_end的月份序号(年*12+月-1), None为MONTH_NA
+        """
+        return self.__month_index(self.columns["time_end"])
+
+    def durations(self, unit:str="month", today:datetime.date=None) -> np.ndarray:
+        """
+        返回每条经历的持续时间(float64数组), 与对每一行调用Experience.duration(unit, today)的结果相同, None为NaN.
+        起止时间整体转换为月份(或日)序号后相减, 至今的经历统一以同一个today计算
+
+        Params:
+            unit: 持续时间的单位，可以是"month"或"day"
+            today: time_end为datetime.date.max(至今)时作为结束日期, 默认为datetime.date.today()
+        """
+        if unit not in ("month", "day"):
+            raise ValueError('Illegal unit value \"%s\", should be \"month\" or \"day\"' % unit)
+        today = np.datetime64(today or datetime.date.today(), "D")
+        time_start, time_end = self.columns["time_start"], self.columns["time_end"]
+        time_end = np.where(time_end == np.datetime64(datetime.date.max, "D"), today, time_end)
+
+        if unit == "month":
+            result = (time_end.astype("datetime64[M]") - time_start.astype("datetime64[M]")).astype(np.int64).astype(np.float64)
+        else:
+            result = (time_end - time_start).astype(np.int64).astype(np.float64)
+        result[np.isnat(time_start) | np.isnat(time_end)] = np.nan
+        return result
+
+    @classmethod
+    def concat(cls, tables:Iterable["ExperienceTable"]) -> "ExperienceTable":
+        """
+        按顺序拼接多个表
+        """
+        tables = list(tables)
+        if len(tables) == 0:
+            return cls()
+        return cls({attr: np.concatenate([table.columns[attr] for table in tables]) for attr in cls.ATTRS})
+
+    @classmethod
+    def __month_index(cls, column:np.ndarray) -> np.ndarray:
+        months = column.astype("datetime64[M]").view(np.int64) + 1970*12
+        return np.where(np.isnat(column), cls.MONTH_NA, months)
+
+    @classmethod
+    def __to_arrays(cls, columns:Dict[str, List]) -> Dict[str, np.ndarray]:
+        """
+        将属性名 -> 值列表转为属性名 -> 数组, 时间进行与Experience相同的类型检查
+        """
+        arrays = {}
+        for attr, values in columns.items():
+            if attr in cls.DATE_ATTRS:
+                # 由date对象直接构造datetime64数组很慢, 先取出公历序数(datetime.datetime的时分秒被舍去)再整体转换, None记为0
+                try:
+                    ordinals = np.array([value.toordinal() if value else 0 for value in values], dtype=np.int64)
+                except AttributeError:
+                    raise TypeError("{} must be an instance of datetime.date or a None".format(attr))
+                array = (ordinals - cls.__EPOCH_ORDINAL).astype("datetime64[D]")
+                array[ordinals == 0] = np.datetime64("NaT")
+                arrays[attr] = array
+            elif attr == "ordernum":
+                arrays[attr] = np.array([cls.ORDERNUM_NA if value is None else value for value in values], dtype=np.int64)
+            elif attr == "splitnum":
+                arrays[attr] = np.array(values, dtype=np.int64)
+            else:
+                array = np.empty(len(values), dtype=object)     # 避免numpy把字符串转为定长的unicode数组
+                array[:] = values
+                arrays[attr] = array
+        return arrays
+
+    @classmethod
+    def __empty_column(cls, attr:str) -> np.ndarray:
+        if attr in cls.DATE_ATTRS:
+            return np.array([], dtype="datetime64[D]")
+        if attr in cls.INT_ATTRS:
+            return np.array([], dtype=np.int64)
+        return np.array([], dtype=object)
+
+    def __object_column(self, attr:str) -> List:
+        """
+        以Python对象的列表返回一列: 时间转为datetime.date, ordernum的ORDERNUM_NA转为None
+        """
+        column = self.columns[attr]
+        if attr in self.DATE_ATTRS:
+            return column.astype(object).tolist()   # NaT转为None
+        if attr == "ordernum":
+            return [None if value == self.ORDERNUM_NA else value for value in column.tolist()]
+        return column.tolist()
+
+    def __object_value(self, attr:str, value):
+        if attr in self.DATE_ATTRS:
+            return value.astype(object)
+        if attr == "ordernum":
+            return None if value == self.ORDERNUM_NA else int(value)
+        if attr == "splitnum":
+            return int(value)
+        return value
+
+    @staticmethod
+    def __make_experience(values:Sequence) -> Experience:
+        """
+        由按ATTRS顺序排列的值构造Experience. 值已经过检查, 不需要再经过Experience.__init__
+        """
+        exp = Experience.__new__(Experience)
+        (exp.uuid, exp.splitnum, exp.ordernum, exp.person_uuid, exp.text, exp.text_token, exp.text_raw, exp.text_rawpinyin,
+         exp.text_rawrefine, exp.text_rawsplit, exp.text_rawtoken, exp.adminrank, exp.time_start, exp.time_end) = values
+        return exp
@@ -1,9 +1,31 @@
 import pinyin
 import datetime
+from functools import lru_cache
 from typing import *
 
 __all__ = ["Person"]
 
+NAME_INITIALS_CACHE_SIZE = 65536    # 姓名 -> 拼音首字母 的LRU缓存容量
+
+_PINYIN_UNSET = False   # __name_pinyin为此值表示尚未由姓名生成拼音首字母. 用False而不是object(), pickle前后仍是同一个值
+_char_initial_memo:Dict[str, str] = {}  # 单个字 -> 拼音首字母, 汉字数量有限, 不设上限
+
+
+@lru_cache(maxsize=NAME_INITIALS_CACHE_SIZE)
+def _name_initials(name:str) -> str:
+    """
+    返回姓名的大写拼音首字母, 与pinyin.get_initial(name, delimiter='').upper()相同.
+    pinyin逐字转换, 因此按字缓存后拼接即可, 重复出现的姓名直接命中LRU缓存
+    """
+    initials = []
+    for char in name:
+        initial = _char_initial_memo.get(char)
+        if initial is None:
+            initial = pinyin.get_initial(char, delimiter='')
+            _char_initial_memo[char] = initial
+        initials.append(initial)
+    return "".join(initials).upper()
+
 class Person():
     """
     common class of a person. 
@@ -30,49 +52,39 @@ class Person():
     Functions:
         attr2dict(): 获得该实例的所有公开访问属性, 以字典形式返回
     """
+    # 使用__slots__保存属性, 实例没有__dict__, 见Experience
+    __slots__ = ("uuid", "gender", "minzu", "origo", "birthplace", "photo", "edu_ft", "edu_ft_school", "edu_pt", "edu_pt_school",
+                 "cur_position", "cur_adminrank",
+                 "__name", "__name_pinyin", "__time_birth", "__time_joinparty", "__time_startwork")
+    __PUBLIC_ATTRS = __slots__[:-5]     # 公有属性, 按attr2dict中的顺序排列
+    __PROPERTIES = ("name", "name_pinyin", "time_birth", "time_joinparty", "time_startwork")  # 被@property和@*.setter修饰为公开访问属性的私有属性
+
     def __init__(self, **kwargs) -> None:
+        # 只有传入的值为真时才使用传入的值, 否则使用默认值
         # 公有属性
-        self.uuid: str = None                       #人员UUID (数据中心A00)
-        self.gender: str = None                     #性别{1: 男, 2: 女}
-        self.minzu: str = None                      #民族
-        self.origo: str = None                      #籍贯
-        self.birthplace: str = None                 #出生地
-        self.photo: str = None                      #照片路径
-        self.edu_ft: str = None                     #最高全日制教育学历
-        self.edu_ft_school: str = None              #最高全日制教育学校
-        self.edu_pt: str = None                     #最高在职教育学历
-        self.edu_pt_school: str = None              #最高在职教育学校
-        self.cur_position: str = None               #现任职位
-        self.cur_adminrank: str = None              #现任行政级别
+        self.uuid: str = kwargs.get("uuid") or None                        #人员UUID (数据中心A00)
+        self.gender: str = kwargs.get("gender") or None                    #性别{1: 男, 2: 女}
+        self.minzu: str = kwargs.get("minzu") or None                      #民族
+        self.origo: str = kwargs.get("origo") or None                      #籍贯
+        self.birthplace: str = kwargs.get("birthplace") or None            #出生地
+        self.photo: str = kwargs.get("photo") or None                      #照片路径
+        self.edu_ft: str = kwargs.get("edu_ft") or None                    #最高全日制教育学历
+        self.edu_ft_school: str = kwargs.get("edu_ft_school") or None      #最高全日制教育学校
+        self.edu_pt: str = kwargs.get("edu_pt") or None                    #最高在职教育学历
+        self.edu_pt_school: str = kwargs.get("edu_pt_school") or None      #最高在职教育学校
+        self.cur_position: str = kwargs.get("cur_position") or None        #现任职位
+        self.cur_adminrank: str = kwargs.get("cur_adminrank") or None      #现任行政级别
 
         # 私有属性,其中一部分被@property和@*.setter修饰为公开访问属性
-        self.__name: str = None                     #人员姓名
-        self.__name_pinyin: str = None              #人员姓名拼音首字母
-        self.__time_birth: datetime.date = None     #生日
-        self.__time_joinparty: datetime.date = None #入党时间
-        self.__time_startwork: datetime.date = None #工作时间
-
-        # 所有公有属性带参初始化赋值
-        public_attrs = [key for key in self.__dict__.keys() if key[0]!='_']
-        for attr in public_attrs:
-            if kwargs.get(attr, False):
-                self.__setattr__(attr, kwargs[attr])
-
-        # 被@property和@*.setter修饰的私有属性初始化赋值
-        if kwargs.get('name', False):
-            self.__name = kwargs['name']
-
-        if kwargs.get('name_pinyin', False):    #若传入了name_pinyin则直接用该值初始化self.name_pinyin
-            self.__name_pinyin = kwargs['name_pinyin']
-        elif self.__name is not None:   # 若没传入name_pinyin，但传入了name，则由name自动生成self.name_pinyin
-            self.__name_pinyin = pinyin.get_initial(self.__name, delimiter='').upper()
-
-        if kwargs.get('time_birth', False):
-            self.time_birth = kwargs['time_birth']
-        if kwargs.get('time_joinparty', False):
-            self.time_joinparty = kwargs['time_joinparty']
-        if kwargs.get('time_startwork', False):
-            self.time_startwork = kwargs['time_startwork']
+        self.__name: str = kwargs.get("name") or None                      #人员姓名
+
+        #若传入了name_pinyin则直接用该值初始化self.name_pinyin, 否则在第一次访问name_pinyin时由name生成
+        self.__name_pinyin: str = kwargs.get("name_pinyin") or _PINYIN_UNSET     #人员姓名拼音首字母
+
+        # 通过@*.setter赋值以进行类型检查
+        self.time_birth: datetime.date = kwargs.get("time_birth") or None            #生日
+        self.time_joinparty: datetime.date = kwargs.get("time_joinparty") or None    #入党时间
+        self.time_startwork: datetime.date = kwargs.get("time_startwork") or None    #工作时间
 
     @property
     def name(self) -> str:
@@ -80,11 +92,14 @@ class Person():
     @name.setter
     def name(self, name:str):
         self.__name = name
-        # 给name赋值时自动生成name_pinyin
-        self.__name_pinyin = pinyin.get_initial(self.__name, delimiter='').upper()
+        # 给name赋值后name_pinyin由新的name重新生成
+        self.__name_pinyin = _PINYIN_UNSET
 
     @property
     def name_pinyin(self) -> str:
+        # 没有传入或设置过name_pinyin时, 第一次访问才由name生成
+        if self.__name_pinyin is _PINYIN_UNSET:
+            self.__name_pinyin = None if self.__name is None else _name_initials(self.__name)
         return self.__name_pinyin
     @name_pinyin.setter
     def name_pinyin(self, name_pinyin:str):
@@ -127,10 +142,5 @@ class Person():
         """
         将对象公共属性转为{属性名:属性值}的词典
         """
-        # __init__时创建的公有属性和属性值
-        attrs = {name: value for name, value in self.__dict__.items() if name[0] != "_"}
-        # 被@property修饰符创建的公有属性和属性值
-        properties = {name: self.__getattribute__(name) for name, obj in vars(self.__class__).items() if isinstance(obj, property)}
-        attrs.update(properties)
-        
-        return attrs
\ No newline at end of file
+        # 公有属性和被@property修饰符创建的公有属性
+        return {name: getattr(self, name) for name in self.__PUBLIC_ATTRS + self.__PROPERTIES}
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Iterator
 import abc
 import pymysql
 from ... import config
@@ -100,6 +100,25 @@ class MysqlDB(DBInterface):
 
         return res
 
+    def query_iter(self, sql:str, args:Tuple=None, batch_size:int=1000) -> Iterator[Tuple]:
+        """
+        流式查询: 使用无缓冲的SSCursor, 每次从服务器fetch batch_size行并逐行产出, 不会把整个结果集读入内存.
+        迭代结束(或生成器被关闭)时释放连接. 迭代过程中连接一直被占用, 不要在同一连接上执行其他语句
+        """
+        conn = self.__get_connection()
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+            conn.commit()
+            conn.close()
+
     def execute(self, sql:str, args:Tuple=None):
         conn = self.__get_connection()
         cursor = conn.cursor()
@@ -202,6 +221,25 @@ class PooledMysqlDB(DBInterface):
 
         return res
 
+    def query_iter(self, sql:str, args:Tuple=None, batch_size:int=1000) -> Iterator[Tuple]:
+        """
+        流式查询: 使用无缓冲的SSCursor, 每次从服务器fetch batch_size行并逐行产出, 不会把整个结果集读入内存.
+        迭代结束(或生成器被关闭)时释放连接. 迭代过程中连接一直被占用, 不要在同一连接上执行其他语句
+        """
+        conn = self.__get_connection()
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+            conn.commit()
+            conn.close()
+
     def execute(self, sql:str, args:Tuple=None):
         conn = self.__get_connection()
         cursor = conn.cursor()
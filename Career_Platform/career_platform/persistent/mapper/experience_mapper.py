@@ -2,7 +2,7 @@ import abc
 import datetime
 import json
 from typing import *
-from ...common import Experience
+from ...common import Experience, ExperienceTable
 from .. import driver
 
 
@@ -172,27 +172,77 @@ class CareerDBExperienceMapper(ExperienceMapperInterface):
         return [Experience(**dict(zip(self.__attr2field_map.keys(), res))) for res in all_res]
 
     def getAll(self) -> Iterable[Experience]:
-        # TODO 当前只实现了将结果全部fetch到内存中并返回整个列表，需要实现为带Buffer的迭代器以支持内存无法承受的数据量
+        # 将结果全部fetch到内存中并返回整个列表, 数据量大时请使用iterAll
         sql = (
             "SELECT {} FROM {} ".format(self.__fields_str, self.__table)
         )
         all_res = self.__db_obj.query(sql)
         return [Experience(**dict(zip(self.__attr2field_map.keys(), res))) for res in all_res]
 
-    def save(self, replace_by:str, exp_list: List[Experience]) -> int:
+    def getAllTable(self) -> ExperienceTable:
+        """
+        与getAll相同, 但以ExperienceTable返回. 查询结果按列直接转为数组, 不需要为每一行构造dict和Experience, 适合加载整张表
+        """
+        sql = (
+            "SELECT {} FROM {} ".format(self.__fields_str, self.__table)
+        )
+        all_res = self.__db_obj.query(sql)
+        return ExperienceTable.from_rows(all_res, list(self.__attr2field_map.keys()))
+
+    def iterAll(self, batch_size:int=1000) -> Iterator[Experience]:
+        """
+        以迭代器的形式返回全部的Experience, 每次从数据库fetch batch_size条, 内存占用与表的大小无关.
+        结果按(person_uuid, exp_uuid, exp_splitnum)排序, 同一个人、同一条经历的记录是连续的, 可以直接交给saveIter
+
+        需要db_obj实现query_iter(如MysqlDB, PooledMysqlDB)
+        """
+        sql = (
+            "SELECT {} FROM {} ".format(self.__fields_str, self.__table) +
+            "ORDER BY {},{},{}".format(self.__attr2field_map['person_uuid'][0], *self.__primary_key_db)
+        )
+        for res in self.__db_obj.query_iter(sql, batch_size=batch_size):
+            yield Experience(**dict(zip(self.__attr2field_map.keys(), res)))
+
+    def saveIter(self, replace_by:str, exp_iter:Iterable[Experience], batch_size:int=1000) -> int:
+        """
+        分批保存exp_iter中的Experience, 每攒够batch_size条调用一次save, 返回受影响行数. replace_by的含义与save相同.
+
+        replace_by为"exp_uuid"或"person_uuid"时, save会先删除这一批中出现的exp_uuid(person_uuid)的全部记录,
+        因此要求exp_iter中同一exp_uuid(person_uuid)的记录是连续的(rebuild_iter的输出、iterAll的结果都满足),
+        本函数只会在两个exp_uuid(person_uuid)之间分批, 不会把同一exp_uuid(person_uuid)的记录拆到两批里.
+        """
+        if replace_by == "id":
+            key = None
+        elif replace_by == "exp_uuid":
+            key = lambda exp: exp.uuid
+        elif replace_by == "person_uuid":
+            key = lambda exp: exp.person_uuid
+        else:
+            raise ValueError("invalid replace_by value, should be 'id' or 'exp_uuid' or 'person_uuid' ")
+
+        aff_rows = 0
+        batch:List[Experience] = []
+        for exp in exp_iter:
+            # 凑够一批且下一条不属于当前这一批的最后一个exp_uuid(person_uuid)时才保存
+            if len(batch) >= batch_size and (key is None or key(exp) != key(batch[-1])):
+                aff_rows += self.save(replace_by, batch)
+                batch = []
+            batch.append(exp)
+        if len(batch) > 0:
+            aff_rows += self.save(replace_by, batch)
+        return aff_rows
+
+    def save(self, replace_by:str, exp_list: List[Experience] or ExperienceTable) -> int:
         aff_rows = 0
         if replace_by == "id":
             sql = (
                 "REPLACE INTO {} ({}) VALUES %s".format(self.__table, self.__fields_str)
             )
-            aff_rows = self.__db_obj.execute_many(sql, [(tuple([exp.__getattribute__(attr) for attr in self.__attr2field_map.keys()]), ) for exp in exp_list])
+            aff_rows = self.__db_obj.execute_many(sql, self.__value_tuples(exp_list))
         
         elif replace_by == "exp_uuid":
             # 获取exp_list中所有出现的exp_uuid
-            exp_uuid_set = set()
-            for exp in exp_list:
-                exp_uuid_set.add(exp.uuid)
-            exp_uuid_list = list(exp_uuid_set)
+            exp_uuid_list = list(set(self.__attr_values(exp_list, "uuid")))
             
             # 删除所有exp_uuid_list中的记录
             sql = (
@@ -206,14 +256,11 @@ class CareerDBExperienceMapper(ExperienceMapperInterface):
             sql = (
                 "REPLACE INTO {} ({}) VALUES %s".format(self.__table, self.__fields_str)
             )
-            aff_rows += self.__db_obj.execute_many(sql, [(tuple([exp.__getattribute__(attr) for attr in self.__attr2field_map.keys()]), ) for exp in exp_list])
+            aff_rows += self.__db_obj.execute_many(sql, self.__value_tuples(exp_list))
 
         elif replace_by == "person_uuid":
             # 获取exp_list中所有出现的person_uuid
-            person_uuid_set = set()
-            for exp in exp_list:
-                person_uuid_set.add(exp.person_uuid)
-            person_uuid_list = list(person_uuid_set)
+            person_uuid_list = list(set(self.__attr_values(exp_list, "person_uuid")))
             
             # 删除所有exp_uuid_list中的记录
             sql = (
@@ -227,13 +274,30 @@ class CareerDBExperienceMapper(ExperienceMapperInterface):
             sql = (
                 "REPLACE INTO {} ({}) VALUES %s".format(self.__table, self.__fields_str)
             )
-            aff_rows += self.__db_obj.execute_many(sql, [(tuple([exp.__getattribute__(attr) for attr in self.__attr2field_map.keys()]), ) for exp in exp_list])
+            aff_rows += self.__db_obj.execute_many(sql, self.__value_tuples(exp_list))
 
         else:
             raise ValueError("invalid replace_by value, should be 'id' or 'exp_uuid' or 'person_uuid' ")
 
         return aff_rows
 
+    def __value_tuples(self, exp_list: List[Experience] or ExperienceTable) -> List[Tuple[Tuple]]:
+        """
+        将exp_list转为execute_many的参数: 每个Experience的属性值按__attr2field_map的顺序组成元组. ExperienceTable直接按列取值
+        """
+        if isinstance(exp_list, ExperienceTable):
+            return [(row, ) for row in exp_list.rows(list(self.__attr2field_map.keys()))]
+        return [(tuple([exp.__getattribute__(attr) for attr in self.__attr2field_map.keys()]), ) for exp in exp_list]
+
+    @staticmethod
+    def __attr_values(exp_list: List[Experience] or ExperienceTable, attr:str) -> Iterable:
+        """
+        返回exp_list中所有Experience的attr属性值
+        """
+        if isinstance(exp_list, ExperienceTable):
+            return exp_list[attr]
+        return [exp.__getattribute__(attr) for exp in exp_list]
+
 
 class DatacenterExperienceMapper(ExperienceMapperInterface):
     """
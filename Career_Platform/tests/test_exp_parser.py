@@ -0,0 +1,337 @@
+"""
+exp_parser各步骤的测试, 在Career_Platform目录下运行: python -m pytest tests
+"""
+import os
+import importlib
+import itertools
+import random
+import re
+import sys
+import threading
+import numpy as np
+import pytest
+import torch
+from career_platform.common import Experience
+
+segment_module = importlib.import_module("career_platform.algorithm.exp_parser.segment.segment")
+inference = importlib.import_module("career_platform.algorithm.exp_parser.segment.ner.models.inference")
+refine_module = importlib.import_module("career_platform.algorithm.exp_parser.refine.refine")
+cache_module = importlib.import_module("career_platform.algorithm.exp_parser.cache")
+location_module = importlib.import_module("career_platform.algorithm.exp_parser.rebuild.location_recover.location_recover")
+viterbi = importlib.import_module("career_platform.algorithm.exp_parser.segment.ner.models.viterbi")
+utils_module = importlib.import_module("career_platform.algorithm.utils")
+BCTokenizer = segment_module.BCTokenizer
+
+
+def test_stale_script_model_is_not_used(monkeypatch, tmp_path):
+    """bilstm_crf.pkl被替换后, 之前由它导出的TorchScript模型不再被使用, 模型版本(ParseCache)也随之改变"""
+    monkeypatch.setattr(segment_module, "CKPT_PATH", str(tmp_path))
+    pkl_path = tmp_path / "bilstm_crf.pkl"
+    script_path = tmp_path / "bilstm_crf_script.pt"
+    pkl_paths = [str(tmp_path / name) for name in ["crf_word2id.pkl", "crf_tag2id.pkl", "bilstm_crf.pkl"]]
+    assert BCTokenizer.model_paths() == pkl_paths
+
+    pkl_path.write_bytes(b"model v1")
+    module = torch.nn.Linear(2, 2)
+    inference.ScriptedBiLSTM_CRF.save(module, str(script_path), {"a": 0}, {"O": 0},
+                                      source_sha1=segment_module.file_digest(str(pkl_path)))
+    assert inference.ScriptedBiLSTM_CRF.source_sha1(str(script_path)) == segment_module.file_digest(str(pkl_path))
+    assert BCTokenizer.model_paths() == [str(script_path)]
+
+    pkl_path.write_bytes(b"model v2, retrained")
+    with pytest.warns(UserWarning, match="export.py"):
+        assert BCTokenizer.model_paths() == pkl_paths
+
+
+def brute_force_decode(emission, transition, lengths, start_id, end_id, pad_id):
+    """枚举每个句子所有的标记序列(最后一个字固定为end_id), 取分数最大的一个"""
+    B, L, T = emission.shape
+    result = np.full((B, max(L - 1, 0)), pad_id, dtype=np.int64)
+    for b, n in enumerate(lengths):
+        best, best_path = None, None
+        for path in itertools.product(range(T), repeat=n - 1):
+            tags = list(path) + [end_id]
+            score = transition[start_id, tags[0]] + sum(emission[b, t, tag] for t, tag in enumerate(tags)) + \
+                    sum(transition[tags[t - 1], tags[t]] for t in range(1, n))
+            if best is None or score > best:
+                best, best_path = score, path
+        result[b, :n - 1] = best_path
+    return result
+
+
+@pytest.mark.parametrize("lengths", [[1], [1, 1], [2], [4, 1], [5, 3, 3, 1], [4, 4, 2, 2, 1, 1], [5, 4, 3, 2, 1]])
+def test_viterbi_decode_matches_brute_force(lengths):
+    """两种维特比解码与穷举所有标记序列的结果相同, 包括长度为1(只有<end>)的句子和不同长度混合的批次"""
+    rng = np.random.default_rng(len(lengths) * 10 + lengths[0])
+    T, start_id, end_id, pad_id = 5, 3, 4, 2
+    for _ in range(10):
+        emission = rng.normal(size=(len(lengths), max(lengths), T))
+        transition = rng.normal(size=(T, T))
+        expected = brute_force_decode(emission, transition, lengths, start_id, end_id, pad_id)
+        decoded_np = viterbi.viterbi_decode_np(emission, transition, np.array(lengths), start_id, end_id, pad_id)
+        decoded = viterbi.viterbi_decode(torch.from_numpy(emission), torch.from_numpy(transition),
+                                         torch.LongTensor(lengths), start_id, end_id, pad_id)
+        assert decoded_np.tolist() == expected.tolist()
+        assert decoded.tolist() == expected.tolist()
+
+
+def reference_noise_remove(input_str):
+    """逐条规则执行的清洗去噪(合并规则、批量执行之前的实现)"""
+    result = re.sub("[\n\t \u00A0\u0020\u3000]", "", input_str)
+    result = re.sub("学习[,，、]+|学习$", lambda m: m.group().replace("学习", "学生"), result)
+    result = re.sub("任教[,，、]+|任教$", lambda m: m.group().replace("任教", "教师"), result)
+    result = re.sub("职务[,，、]+|职务$", "", result)
+    result = re.sub("获.*?学位", "", result)
+    result = re.sub("[,，/.。、]?主持.*?工作[的]?", "", result)
+    result = re.sub("[,，/.。、]?从事.*?工作", "", result)
+    result = re.sub("(工作)?[，,][历]?任", "", result)
+    result = re.sub("[\\(（\\[【][^\\(（\\[【]*?[\\)）\\]】]", "", result)
+    result = re.sub("[\\(（\\[【].*[\\)）\\]】]", "", result)
+    result = re.sub("[0-9]{4}.?[0-9]{0,2}[—-]?", "", result)
+    return result if result != "" else None
+
+
+def reference_abbreviation_recover(input_str):
+    if input_str is None:
+        return None
+    result = input_str
+    for old, new in [("委会", "委员会"), ("市委", "市委员会"), ("区委", "区委员会"), ("省委", "省委员会"), ("县委", "县委员会"),
+                     ("镇委", "镇委员会"), ("村委", "村委员会"), ("委员会员会", "委员会")]:
+        result = result.replace(old, new)
+    if result.startswith("市"):
+        result = "深圳" + result
+    if result.startswith("省"):
+        result = "广东" + result
+    result = re.sub("E?MBA", "管理学硕士", result)
+    return result if result != "" else None
+
+
+def reference_adjunct_mark(input_str):
+    if input_str is None:
+        return None
+    result = input_str.replace("兼职", "")
+    result = re.sub("[\\.,，。、；;兼]+任?", "|", result)
+    result = re.sub("(\\|)+", "|", result)
+    result = result.strip("|")
+    if result == "":
+        return None
+    if "|" in result:
+        adj_list = result.split("|")
+        cur_position_suffix = ""
+        for i in range(len(adj_list) - 1, -1, -1):
+            hanlp_seg = refine_module.HanLP.segment(adj_list[i])
+            if str(hanlp_seg[-1].nature).startswith("nn"):
+                cur_position_suffix = str(hanlp_seg[-1].word)
+            else:
+                if len(adj_list[i]) < 3 or adj_list[i][-3] == adj_list[i][-2]:
+                    break
+                if adj_list[i].endswith(("书记", "科员", "指导员", "治安员", "员工", "成员", "人选", "主管", "主办", "主任", "组长",
+                                         "单元长", "主操", "副操", "助工", "排长", "营长", "连长", "旅长", "师长", "军长", "工作")):
+                    break
+                adj_list[i] = adj_list[i] + cur_position_suffix
+        result = "|".join(adj_list)
+    return result
+
+
+# 覆盖各条规则的触发词、括号、数字、空白和换行
+REFINE_FRAGMENTS = ["学习", "任教", "职务", "获", "学位", "主持", "从事", "工作", "的", "历任", "任", "，", ",", "、", "/", ".", "。",
+                    "；", ";", "|", "(", "（", "[", "【", ")", "）", "]", "】", "1", "9", "2003", "—", "-", "委", "会", "市", "区",
+                    "省", "县", "员", "E", "M", "BA", "MBA", "兼", "兼职", "深圳", "局", "局长", "副主任", "书记", "处",
+                    " ", "\t", "\u3000", "\u00A0"]
+
+
+def random_refine_text(rng, newline):
+    fragments = REFINE_FRAGMENTS + (["\n"] * 3 if newline else [])
+    return "".join(rng.choice(fragments) for _ in range(rng.randrange(0, 16)))
+
+
+def test_refine_strings_matches_per_rule_reference():
+    """批量(以换行拼接后每条规则只执行一次)的refine与逐条字符串、逐条规则执行的结果相同, 包括字符串本身含有换行的情况"""
+    rng = random.Random(0)
+    for _ in range(300):
+        newline = rng.random() < 0.5
+        text_list = [random_refine_text(rng, newline) for _ in range(rng.randrange(1, 20))]
+        expected_AR = [reference_abbreviation_recover(reference_noise_remove(text)) for text in text_list]
+        expected = [(text_AR, reference_adjunct_mark(text_AR)) for text_AR in expected_AR]
+        assert refine_module.refine_strings(text_list) == expected
+        # 后两步单独执行时输入可能含有换行
+        assert refine_module.abbreviation_recover_batch(text_list) == [reference_abbreviation_recover(t) for t in text_list]
+        assert refine_module.adjunct_mark_batch(text_list) == [reference_adjunct_mark(t) for t in text_list]
+
+
+# NER训练数据中的真实token字符串(GBK编码), 如"深圳L 审计局O 政府投资审计专业局O 干部P"
+NER_DATA_PATH = os.path.join(os.path.dirname(segment_module.__file__), "ner/data/data.txt")
+
+
+def reference_location_recover(token):
+    """逐层查词典、用正则去后缀的地点补齐(合并为loc2pc_dict、nosuffix_dict之前的实现)"""
+    if (token is None) or (re.search("[SOL]", token) is None):
+        return token
+    helper = location_module.LocDetHelper()
+    remove_loc_suffix = helper._LocDetHelper__remove_loc_suffix_re
+    token_list = token.split(" ")
+    full_text = "".join([t[0:-1] for t in token_list])
+    L_tokens = [t[0:-1] for t in token_list if t[-1] == "L"]
+    L_tokens_nosuffix = [remove_loc_suffix(t) for t in L_tokens]
+    O_text = "".join([t[0:-1] for t in token_list if t[-1] in ["O", "S"]])
+
+    explicit_prov, explicit_city, O_inferenced_city, L_inferenced_city = [], [], [], []
+    for t in range(len(L_tokens)):
+        if helper.prov2p_dict.get(L_tokens[t], False):
+            explicit_prov.append(helper.prov2p_dict[L_tokens[t]])
+        if helper.prov2p_dict.get(L_tokens_nosuffix[t], False):
+            explicit_prov.append(helper.prov2p_dict[L_tokens_nosuffix[t]])
+    explicit_city.extend(helper.detect_by_city2pc_dict(L_tokens, L_tokens_nosuffix))
+    explicit_city.extend([e[2] for e in helper.detect_by_city2pc_AC("".join(L_tokens))])
+    if len(explicit_city) == 0:
+        O_inferenced_city.extend(helper.detect_by_school2pc_AC(full_text))
+        O_inferenced_city.extend(helper.detect_by_city2pc_AC(O_text))
+        O_inferenced_city.sort(key=lambda x: x[0])
+    if (len(explicit_city) == 0) and (len(O_inferenced_city) == 0):
+        L_inferenced_city.extend(helper.detect_by_dist2pc_dict(L_tokens, L_tokens_nosuffix))
+
+    prov, city = None, None
+    if len(explicit_prov) > 0:
+        prov = explicit_prov[0]
+        city = next((i[1] for i in explicit_city if i[0] == prov), None)
+        if city is None:
+            city = next((i[2][1] for i in O_inferenced_city if i[2][0] == prov), None)
+    elif len(explicit_city) > 0:
+        prov, city = explicit_city[0]
+    elif len(O_inferenced_city) > 0:
+        prov, city = O_inferenced_city[-1][2]
+    elif len(L_inferenced_city) > 0:
+        prov, city = L_inferenced_city[-1]
+
+    token_list_new = [name + "L" for name in (prov, city) if name]
+    for i, cur_token in enumerate(token_list):
+        if cur_token[-1] == "L":
+            if helper.dist2pc_dict.get(cur_token[0:-1], False) or \
+                    helper.dist2pc_dict_nosuffix.get(remove_loc_suffix(cur_token[0:-1]), False):
+                token_list_new.append(cur_token)
+        else:
+            token_list_new.extend(" ".join(token_list[i:]).replace("L ", "").split(" "))
+            break
+    return " ".join(token_list_new)
+
+
+def test_location_recover_matches_regex_path():
+    """查合并词典的location_recover和remove_loc_suffix, 与逐层查词典、用正则去后缀的结果相同"""
+    with open(NER_DATA_PATH, "r", encoding="gbk") as f:
+        token_list = [line.strip() for line in f if line.strip() != ""]
+    helper = location_module.LocDetHelper()
+    remove_loc_suffix_re = helper._LocDetHelper__remove_loc_suffix_re
+
+    L_tokens = {t[:-1] for token in token_list for t in token.split(" ") if t.endswith("L")}
+    names = {name for prov, city_dict in helper.loc_dict.items()
+             for city, dist_list in city_dict.items() for name in [prov, city] + dist_list}
+    for name in L_tokens | names | {remove_loc_suffix_re(name) for name in names}:
+        assert helper.remove_loc_suffix(name) == remove_loc_suffix_re(name), name
+
+    # 补上省市的, 只有区县的, 以及只能从O/S或高校名推断的token字符串
+    token_list += ["深圳L 审计局O 政府投资审计专业局O 干部P", "清华大学O 计算机系S 教授P", "南山区L 人民法院O 法官P", "南山L 区委O 书记P"]
+    for token in token_list:
+        assert location_module.location_recover(token) == reference_location_recover(token), token
+
+
+@pytest.mark.parametrize("use_iter", [False, True])
+def test_segment_reports_progress_per_experience(monkeypatch, use_iter):
+    """segment和segment_iter的callback按经历汇报进度: total为经历数量, iternum跨缓冲区单调递增, 最后为total-1"""
+    monkeypatch.setattr(BCTokenizer, "__init__", lambda self, quantize=False: None)
+    monkeypatch.setattr(BCTokenizer, "_BCTokenizer__parse_batch", lambda self, text_list: [t + "O" for t in text_list])
+    rng = random.Random(0)
+    exp_list = [Experience(text_rawsplit=None if rng.random() < 0.2 else
+                           "|".join("s{}".format("x" * rng.randrange(1, 9)) for _ in range(rng.randrange(1, 4))))
+                for _ in range(40)]
+    status_list = []
+    callback = lambda status: status_list.append((status["total"], status["iternum"]))
+    if use_iter:
+        result = list(segment_module.segment_iter(exp_list, callback=callback, batch_size=3, buffer_size=10))
+    else:
+        result = segment_module.segment(exp_list, callback=callback, batch_size=3)
+
+    assert [exp.text_rawtoken for exp in result] == \
+           [None if exp.text_rawsplit is None else "|".join(t + "O" for t in exp.text_rawsplit.split("|")) for exp in exp_list]
+    assert all(total == len(exp_list) for total, _ in status_list)
+    iternums = [iternum for _, iternum in status_list]
+    assert iternums == sorted(iternums) and iternums[-1] == len(exp_list) - 1
+
+
+def test_parse_cache_version_follows_source_files(monkeypatch, tmp_path):
+    """规则文件被修改后, refresh_version得到新的版本, 旧的键不再命中"""
+    rule_path = tmp_path / "rule.py"
+    rule_path.write_text("RULE = 1")
+    monkeypatch.setattr(cache_module, "RULE_FILES", [str(rule_path)])
+    monkeypatch.setattr(segment_module, "CKPT_PATH", str(tmp_path))
+    cache = cache_module.ParseCache()
+    key = cache.key("深圳市福田区人民政府副区长")
+    assert cache.refresh_version() == cache.version and cache.key("深圳市福田区人民政府副区长") == key
+
+    rule_path.write_text("RULE = 22")
+    cache.refresh_version()
+    assert cache.key("深圳市福田区人民政府副区长") != key
+    assert cache.version == cache_module.ParseCache().version
+
+
+def test_lru_cache_is_thread_safe():
+    """多个线程并发get/put同一个LRUCache时不会因淘汰与move_to_end交错而抛出KeyError"""
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)   # 尽量频繁地切换线程以暴露竞争
+    cache = utils_module.LRUCache(8)
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(20000):
+                key = rng.randrange(16)
+                if cache.get(key) is None:
+                    cache.put(key, key)
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    info = cache.info()
+    assert info["currsize"] <= 8 and info["hits"] + info["misses"] == 4 * 20000
+
+
+def test_parse_cache_is_thread_safe(monkeypatch, tmp_path):
+    """多个线程共享同一个ParseCache(如get_parse_cache())并发读写时不出错, 读到的总是写入的缓存项"""
+    monkeypatch.setattr(segment_module, "CKPT_PATH", str(tmp_path))
+    cache = cache_module.ParseCache(db_path=str(tmp_path / "parse_cache.db"), maxsize=8)
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(300):
+                keys = [str(rng.randrange(32)) for _ in range(4)]
+                for key, entry in cache.get_many(keys).items():
+                    assert entry == {"value": key}
+                cache.put_many({key: {"value": key} for key in keys})
+        except Exception as e:
+            errors.append(e)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+        cache.close()
+    assert errors == []
+    info = cache.info()
+    assert info["lru"]["currsize"] <= 8
+    assert info["db_hits"] + info["db_misses"] == info["lru"]["misses"]
@@ -0,0 +1,532 @@
+"""
+OCTree增量更新的测试, 在Career_Platform目录下运行: python -m pytest tests
+neo4j的读写由FakeGraph记录, 不需要连接数据库
+"""
+import os
+import datetime
+import importlib
+import random
+import types
+import pytest
+from career_platform.common import Experience, Person
+
+octree_module = importlib.import_module("career_platform.algorithm.network.octree")
+neo4j_module = importlib.import_module("career_platform.algorithm.network.neo4j")
+csn_module = importlib.import_module("career_platform.algorithm.network.csn")
+CTree = octree_module.CTree
+
+
+class FakeCursor():
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def to_ndarray(self):
+        return self.rows
+
+
+class FakeNode(dict):
+    """查询结果中的结点, 可以作为集合元素(compute_csn用(m, n)去重)"""
+    def __hash__(self):
+        return hash(self["id"])
+
+
+class FakeGraph():
+    """
+    记录执行的Cypher语句及参数, 并按Neo4jAdapter和CareerSocialNetwork使用的几种语句维护图的状态:
+    nodes: id -> (name, count, interval, 是否有Leaf标签), edges: (父结点id, 子结点id)的集合,
+    users: YearUser结点 id -> 属性, relations: YearUser之间的关系 (类型, 起点id, 终点id, 属性)的列表
+    """
+    def __init__(self):
+        self.queries = []
+        self.nodes = {}
+        self.edges = set()
+        self.users = {}
+        self.relations = []
+
+    def auto(self):
+        return self
+
+    def delete_all(self):
+        self.nodes, self.edges, self.users, self.relations = {}, set(), {}, []
+
+    def push(self, node):
+        pass
+
+    def create_nodes(self, data, labels, keys, merge=False):
+        for row in data:
+            values = dict(zip(keys, row))
+            if "YearUser" in labels:
+                assert values["id"] not in self.users
+                self.users[values["id"]] = values
+                continue
+            assert merge or values["id"] not in self.nodes    # CREATE会产生重复的结点
+            self.nodes[values["id"]] = (values["name"], values["count"], tuple(values["interval"]), "Leaf" in labels)
+
+    def create_relationships(self, data, rel_type="R", merge=False):
+        for start, properties, end in data:
+            if rel_type != "R":     # YearUser之间的关系, 与py2neo.bulk相同, 找不到起点或终点时不创建
+                if start in self.users and end in self.users:
+                    self.relations.append((rel_type, start, end, tuple(sorted(properties.items()))))
+                continue
+            (start_id, _), (end_id, _) = start, end
+            assert start_id in self.nodes and end_id in self.nodes
+            assert merge or (start_id, end_id) not in self.edges
+            self.edges.add((start_id, end_id))
+
+    def run(self, cypher, **params):
+        self.queries.append((cypher, params))
+        if "MATCH (n:Node {id: id}) DETACH DELETE" in cypher:
+            for nid in params["ids"]:
+                self.nodes.pop(nid, None)
+            self.edges = {e for e in self.edges if e[0] in self.nodes and e[1] in self.nodes}
+        elif "SET n.count = row.count" in cypher:
+            for row in params["rows"]:
+                name, _, _, leaf = self.nodes[row["id"]]
+                self.nodes[row["id"]] = (name, row["count"], tuple(row["interval"]), leaf)
+        elif "SET n:Leaf" in cypher or "REMOVE n:Leaf" in cypher:
+            for nid in params["ids"]:
+                self.nodes[nid] = self.nodes[nid][:3] + ("SET n:Leaf" in cypher,)
+        elif "MATCH (n:Node {id: row.old}) SET n.id = -1 - row.new" in cypher:
+            self.rename({row["old"]: -1 - row["new"] for row in params["rows"]})
+        elif "MATCH (n:Node {id: -1 - row.new}) SET n.id = row.new" in cypher:
+            self.rename({-1 - row["new"]: row["new"] for row in params["rows"]})
+        elif "MATCH (n:YearUser {id: id}) DETACH DELETE" in cypher:
+            for uid in params["ids"]:
+                self.users.pop(uid, None)
+            self.relations = [r for r in self.relations if r[1] in self.users and r[2] in self.users]
+        elif "-[r:Col|Rank|Rank_cross]-() DELETE r" in cypher:
+            ids = set(params["ids"])
+            self.relations = [r for r in self.relations if r[0] == "trajectory" or ids.isdisjoint(r[1:3])]
+        elif "return m,n" in cypher:
+            return FakeCursor(self.leaf_pairs(three_hops="(o1:Node)" in cypher, leaf_ids=params.get("leaf_ids")))
+        return FakeCursor()
+
+    def leaf_pairs(self, three_hops, leaf_ids=None):
+        """
+        compute_csn中两跳(同一父结点下的两个Leaf)或三跳(m的父结点的子结点下的Leaf n)查询的结果,
+        有leaf_ids时只返回m或n在其中的
+        """
+        children = {}
+        for a, b in sorted(self.edges):
+            children.setdefault(a, []).append(b)
+        is_leaf = lambda nid: self.nodes[nid][3]
+        # 不是Root, Loc和Leaf的结点
+        is_inner = lambda nid: nid != 0 and not self.nodes[nid][0].endswith("L") and not is_leaf(nid)
+        pairs = []
+        for o in sorted(self.nodes):
+            if three_hops:
+                if not is_inner(o):
+                    continue
+                for m in children.get(o, []):
+                    for o2 in children.get(o, []):
+                        if o2 == m or self.nodes[o2][0].endswith("L") or is_leaf(o2):
+                            continue
+                        pairs.extend((m, n) for n in children.get(o2, []))
+            elif is_inner(o):
+                pairs.extend((m, n) for m in children.get(o, []) for n in children.get(o, []) if m != n)
+        rows = []
+        for m, n in pairs:
+            if not (is_leaf(m) and is_leaf(n)) or not self.nodes[m][2][0] <= self.nodes[n][2][0] <= self.nodes[m][2][1]:
+                continue
+            if leaf_ids is None or m in leaf_ids or n in leaf_ids:
+                rows.append([FakeNode(id=nid, name=self.nodes[nid][0]) for nid in (m, n)])
+        return rows
+
+    def leaves(self):
+        return [FakeNode(id=nid, name=value[0]) for nid, value in sorted(self.nodes.items()) if value[3]]
+
+    def rename(self, ids):
+        moved = {ids[nid]: self.nodes.pop(nid) for nid in ids}
+        assert moved.keys().isdisjoint(self.nodes)    # 不能与其他结点的id重复
+        self.nodes.update(moved)
+        self.edges = {(ids.get(a, a), ids.get(b, b)) for a, b in self.edges}
+
+    def ids_of(self, fragment):
+        """所有包含fragment的语句的ids参数"""
+        return [i for cypher, params in self.queries if fragment in cypher for i in params.get("ids", [])]
+
+
+class FakeCSN(csn_module.CareerSocialNetwork):
+    """将YearUser结点和关系写入FakeCSN.graph的CareerSocialNetwork, graph为正在计算的adapter的图, 见compute_csn"""
+    graph = None
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.GraphDatabase = FakeCSN.graph
+
+
+@pytest.fixture
+def fake_neo4j(monkeypatch, tmp_path):
+    """
+    不连接数据库的Neo4jAdapter, 同时让build_tree(init=True)将nid2resumes.json写到临时目录
+    """
+    (tmp_path / "temp").mkdir()
+    monkeypatch.setattr(octree_module, "data_path", str(tmp_path))
+    graph = FakeGraph()
+    monkeypatch.setattr(neo4j_module, "create_nodes", lambda tx, data, labels, keys: tx.create_nodes(data, labels, keys))
+    monkeypatch.setattr(neo4j_module, "create_relationships",
+                        lambda tx, data, rel_type, start_node_key, end_node_key: tx.create_relationships(data))
+    monkeypatch.setattr(csn_module, "create_nodes", lambda tx, data, labels, keys: tx.create_nodes(data, labels, keys))
+    monkeypatch.setattr(csn_module, "create_relationships",
+                        lambda tx, data, rel_type, start_node_key, end_node_key: tx.create_relationships(data, rel_type))
+    monkeypatch.setattr(neo4j_module, "merge_nodes",
+                        lambda tx, data, merge_key, labels, keys: tx.create_nodes(data, labels, keys, merge=True))
+    monkeypatch.setattr(neo4j_module, "merge_relationships",
+                        lambda tx, data, merge_key, start_node_key, end_node_key: tx.create_relationships(data, merge=True))
+    monkeypatch.setattr(neo4j_module, "CareerSocialNetwork", FakeCSN)
+    monkeypatch.setattr(FakeCSN, "graph", graph)
+    adapter = neo4j_module.Neo4jAdapter.__new__(neo4j_module.Neo4jAdapter)
+    adapter.GraphDatabase = graph
+    adapter.match_nodes_by_tag = lambda tag: graph.leaves()
+    adapter.get_node = lambda nid: types.SimpleNamespace(id=nid)
+    adapter.tmp_path = tmp_path
+    return adapter
+
+
+def new_adapter(adapter):
+    """与adapter相同的FakeGraph之外的另一个空图"""
+    other = neo4j_module.Neo4jAdapter.__new__(neo4j_module.Neo4jAdapter)
+    other.GraphDatabase = FakeGraph()
+    other.match_nodes_by_tag = lambda tag: other.GraphDatabase.leaves()
+    other.get_node = adapter.get_node
+    return other
+
+
+def compute_csn(adapter, tree, exp_list, uid2name, delta=None):
+    """adapter.compute_csn, YearUser结点和关系写入adapter的图"""
+    FakeCSN.graph = adapter.GraphDatabase
+    return adapter.compute_csn(tree, exp_list, uid2name, start=1960, end=2022.1, delta=delta)
+
+
+def make_exp(uuid, person_uuid, text_token, start=(2001, 3), end=(2004, 6), splitnum=1):
+    text = None if text_token is None else "".join(token[:-1] for token in text_token.split(" "))
+    return Experience(uuid=uuid, splitnum=splitnum, person_uuid=person_uuid, text=text, text_token=text_token,
+                      time_start=datetime.date(start[0], start[1], 1), time_end=datetime.date(end[0], end[1], 1))
+
+
+def test_removed_experiences_are_reported(fake_neo4j):
+    tree = CTree()
+    exp_list = [make_exp("a", "p1", "深圳市L 福田区L 教育局O 局长P"),
+                make_exp("b", "p2", "深圳市L 福田区L 教育局O 副局长P"),
+                make_exp("c", "p3", "深圳市L 南山区L 科员P")]
+    delta = tree.build_tree(exp_list)
+    fake_neo4j.tree_to_neo4j(delta, tree.interval_dict, init=True)
+    compute_csn(fake_neo4j, tree, exp_list, {})
+    assert sorted(fake_neo4j.GraphDatabase.users) == ["a+1", "b+1", "c+1"]
+    removed_path = tree.trie.path(tree.exp_nid["a+1"])
+
+    invalid_a = make_exp("a", "p1", None)                      # 不能再解析的经历
+    no_time_c = make_exp("c", "p3", "深圳市L 南山区L 科员P")    # 失去时间信息的经历
+    no_time_c.time_end = None
+    reinserted = make_exp("b", "p2", None)                     # 同一批次中先失效又重新插入
+    never_inserted = make_exp("d", "p4", None)
+    delta = tree.build_tree([invalid_a, no_time_c, reinserted, make_exp("b", "p2", "深圳市L 福田区L 副局长P"),
+                             never_inserted], init=False)
+
+    assert delta["removed_exp_ids"] == ["a+1", "c+1"]
+    assert delta["exp_ids"] == ["b+1"]
+    assert "a+1" not in tree.exp_nid and "a+1" not in tree.rank_record
+    assert tree.trie.score[removed_path[-1]] == 0 and removed_path[-1] in delta["removed"]
+
+    # 失去时间信息的c仍有文本, 与重新建立时一样保留其YearUser结点
+    assert delta["persons"] == ["p1", "p3", "p2"] and delta["removed_user_ids"] == ["a+1"]
+
+    fake_neo4j.apply_delta(delta, tree.interval_dict)
+    assert fake_neo4j.GraphDatabase.ids_of("YearUser {id: id}) DETACH DELETE") == []
+    compute_csn(fake_neo4j, tree, [], {}, delta=delta)
+    assert fake_neo4j.GraphDatabase.ids_of("YearUser {id: id}) DETACH DELETE") == ["c+1", "b+1", "a+1"]
+    assert sorted(fake_neo4j.GraphDatabase.users) == ["b+1", "c+1"]
+    assert fake_neo4j.GraphDatabase.users["c+1"]["interval"] == "2001-03-01——None"
+
+
+ADMINRANKS = [None, "正处级", "副处级", "正科级"]
+
+
+def random_exp(rng, uuid, person_uuid, splitnum=0):
+    tokens = [rng.choice(["深圳市L", "广东省L"])] + \
+             ["w{}{}".format(rng.randrange(5), rng.choice("OSLP")) for _ in range(rng.randrange(0, 4))]
+    year = rng.randint(1970, 2015)
+    time_end = datetime.date.max if rng.random() < 0.2 else datetime.date(year + rng.randint(0, 9), rng.randint(1, 12), 1)
+    return Experience(uuid=uuid, splitnum=splitnum, person_uuid=person_uuid, text="".join(tokens),
+                      text_token=" ".join(tokens), time_start=datetime.date(year, rng.randint(1, 12), 1),
+                      time_end=time_end, adminrank=rng.choice(ADMINRANKS))
+
+
+def path_key(tree, nid):
+    return tuple(tree.trie.name(n) for n in tree.trie.path(nid))
+
+
+def alive_nodes(tree):
+    return [n for n in range(len(tree.trie)) if n == 0 or tree.trie.score[n] > 0]
+
+
+def graph_state(tree, graph):
+    """neo4j中的树结点和边, 结点id换为其在tree中的路径"""
+    nodes = sorted((path_key(tree, nid), value) for nid, value in graph.nodes.items())
+    edges = sorted((path_key(tree, a), path_key(tree, b)) for a, b in graph.edges)
+    return nodes, edges
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_build_matches_fresh_build(fake_neo4j, seed):
+    """
+    分批插入新的、修改的、未变化的和失效的经历(中途保存并读取快照, 压缩一次), 与由最终的经历集合一次建成的树相同,
+    按apply_delta写入neo4j的结果也与一次写入最终的树相同
+    """
+    rng = random.Random(seed)
+    n = 150
+    current = {}
+    first = [random_exp(rng, "u{}".format(i), "p{}".format(i // 3)) for i in range(n)]
+    for exp in first:
+        current[exp.uuid + '+' + str(exp.splitnum)] = exp
+    tree = CTree()
+    fake_neo4j.tree_to_neo4j(tree.build_tree(first), tree.interval_dict, init=True)
+
+    for batch in range(6):
+        exp_list = []
+        for _ in range(rng.randrange(1, 40)):
+            r = rng.random()
+            if r < 0.4:     # 新的经历
+                exp = random_exp(rng, "u{}".format(n), "p{}".format(n // 3))
+                n += 1
+            elif r < 0.7:   # 修改已有的经历
+                old = current[rng.choice(list(current))]
+                exp = random_exp(rng, old.uuid, old.person_uuid, old.splitnum)
+            elif r < 0.85:  # 未变化的经历
+                exp = current[rng.choice(list(current))].copy()
+            else:           # 失效的经历
+                exp = current[rng.choice(list(current))].copy()
+                exp.text_token = None
+            exp_list.append(exp)
+            exp_id = exp.uuid + '+' + str(exp.splitnum)
+            if exp.text_token:
+                current[exp_id] = exp
+            else:
+                current.pop(exp_id, None)
+        if batch == 3:
+            tree.save_tree(str(fake_neo4j.tmp_path / "snapshot.pkl"))
+            tree = CTree.load_tree(str(fake_neo4j.tmp_path / "snapshot.pkl"))
+        delta = tree.build_tree(exp_list, init=False)
+        assert set(delta["added"]).isdisjoint(delta["updated"]) and set(delta["added"]).isdisjoint(delta["removed"])
+        fake_neo4j.apply_delta(delta, tree.interval_dict)
+        if batch == 4:
+            fake_neo4j.renumber_nodes(tree.compact())
+
+    fresh = CTree()
+    fresh_graph = new_adapter(fake_neo4j)
+    fresh_graph.tree_to_neo4j(fresh.build_tree(list(current.values())), fresh.interval_dict, init=True)
+
+    nodes = {path_key(tree, nid): nid for nid in alive_nodes(tree)}
+    fresh_nodes = {path_key(fresh, nid): nid for nid in alive_nodes(fresh)}
+    assert nodes.keys() == fresh_nodes.keys()
+    for key, nid in nodes.items():
+        fid = fresh_nodes[key]
+        assert (tree.trie.count[nid], tree.trie.score[nid]) == (fresh.trie.count[fid], fresh.trie.score[fid])
+        assert tree.interval_dict.get(nid) == fresh.interval_dict.get(fid)
+        assert sorted(tree.resume_record.get(nid, [])) == sorted(fresh.resume_record.get(fid, []))
+        assert sorted(path_key(tree, c) for c in tree.get_children(nid)) == \
+               sorted(path_key(fresh, c) for c in fresh.get_children(fid))
+    assert len(tree.interval_dict) == len(fresh.interval_dict)
+    assert tree.rank_record == fresh.rank_record
+    assert sorted(tree.exp_nid) == sorted(current)
+    assert {k: path_key(tree, v) for k, v in tree.exp_nid.items()} == {k: path_key(fresh, v) for k, v in fresh.exp_nid.items()}
+    assert graph_state(tree, fake_neo4j.GraphDatabase) == graph_state(fresh, fresh_graph.GraphDatabase)
+
+
+def random_csn_exp(rng, uuid, person_uuid, splitnum=0):
+    """
+    比random_exp更集中的经历, 以职位结尾, 同一叶结点和相邻叶结点下常有时间重合的多条经历.
+    职位下还可能有职位, 其Leaf标签随经历的插入和移除而改变
+    """
+    tokens = ["深圳市L", "w{}O".format(rng.randrange(2))] + ["w{}S".format(rng.randrange(2))] * rng.randrange(2) + \
+             ["w{}P".format(rng.randrange(3)) for _ in range(rng.choice([1, 1, 1, 2]))]
+    year = rng.randint(1995, 2010)
+    return Experience(uuid=uuid, splitnum=splitnum, person_uuid=person_uuid, text="".join(tokens),
+                      text_token=" ".join(tokens), time_start=datetime.date(year, rng.randint(1, 12), 1),
+                      time_end=datetime.date(year + rng.randint(0, 6), rng.randint(1, 12), 1),
+                      adminrank=rng.choice(ADMINRANKS))
+
+
+def user_state(graph):
+    """YearUser结点, 以及轨迹和社会关系的列表(同事关系不区分方向)"""
+    relations = [(rel_type,) + (tuple(sorted((a, b))) if rel_type == "Col" else (a, b)) + (properties,)
+                 for rel_type, a, b, properties in graph.relations]
+    return graph.users, sorted(relations)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_incremental_csn_matches_fresh_build(fake_neo4j, seed):
+    """
+    分批插入新的、修改的、未变化的、失效的、只改了职级或文本的经历后, 增量计算的YearUser结点、轨迹和社会关系
+    与由最终的经历集合重新计算的相同. 增量计算时只查询与受影响的叶结点相关的结点对
+    """
+    rng = random.Random(seed)
+    uid2name = {"p{}".format(i): "n{}".format(i) for i in range(100)}
+    n = 60
+    first = [random_csn_exp(rng, "u{}".format(i), "p{}".format(i // 3)) for i in range(n)]
+    current = {exp.uuid + '+' + str(exp.splitnum): exp for exp in first}
+    tree = CTree()
+    fake_neo4j.tree_to_neo4j(tree.build_tree(first), tree.interval_dict, init=True)
+    compute_csn(fake_neo4j, tree, first, uid2name)
+    graph = fake_neo4j.GraphDatabase
+    full_queries = len(graph.queries)
+
+    for batch in range(5):
+        exp_list = []
+        for _ in range(rng.randrange(1, 15)):
+            r = rng.random()
+            old = current[rng.choice(sorted(current))]
+            if r < 0.2:     # 新的人员或已有人员的新经历
+                exp = random_csn_exp(rng, "u{}".format(n), rng.choice(["p{}".format(n // 3), old.person_uuid]))
+                n += 1
+            elif r < 0.45:  # 修改已有的经历
+                exp = random_csn_exp(rng, old.uuid, old.person_uuid, old.splitnum)
+            elif r < 0.55:  # 未变化的经历
+                exp = old.copy()
+            elif r < 0.7:   # 只改了职级
+                exp = old.copy()
+                exp.adminrank = rng.choice(ADMINRANKS)
+            elif r < 0.85:  # 只改了文本或失去文本
+                exp = old.copy()
+                exp.text = rng.choice([None, "{}改".format(exp.text)])
+            else:           # 失效的经历
+                exp = old.copy()
+                exp.text_token = None
+            exp_list.append(exp)
+            current[exp.uuid + '+' + str(exp.splitnum)] = exp
+        delta = tree.build_tree(exp_list, init=False)
+        fake_neo4j.apply_delta(delta, tree.interval_dict)
+        compute_csn(fake_neo4j, tree, exp_list, uid2name, delta=delta)
+        if batch == 2:
+            fake_neo4j.renumber_nodes(tree.compact())
+
+    exp_list = [current[exp_id] for exp_id in sorted(current)]
+    fresh = CTree()
+    fresh_graph = new_adapter(fake_neo4j)
+    fresh_graph.tree_to_neo4j(fresh.build_tree(exp_list), fresh.interval_dict, init=True)
+    compute_csn(fresh_graph, fresh, exp_list, uid2name)
+    assert {rel_type for rel_type, _, _, _ in fresh_graph.GraphDatabase.relations} >= {"trajectory", "Col", "Rank"}
+    assert user_state(graph) == user_state(fresh_graph.GraphDatabase)
+    assert all("leaf_ids" in params for cypher, params in graph.queries[full_queries:] if "return m,n" in cypher)
+
+
+def test_compact_renumbers_tree_and_neo4j(fake_neo4j):
+    rng = random.Random(0)
+    exp_list = [random_exp(rng, "u{}".format(i), "p{}".format(i // 3)) for i in range(200)]
+    tree = CTree()
+    fake_neo4j.tree_to_neo4j(tree.build_tree(exp_list), tree.interval_dict, init=True)
+    # 修改一半的经历, 留下死结点
+    changed = [random_exp(rng, exp.uuid, exp.person_uuid, exp.splitnum) for exp in exp_list[::2]]
+    fake_neo4j.apply_delta(tree.build_tree(changed, init=False), tree.interval_dict)
+    assert tree.dead_num() > 0
+    before = {exp_id: (path_key(tree, nid), sorted(tree.resume_record[nid])) for exp_id, nid in tree.exp_nid.items()}
+    intervals = {path_key(tree, nid): tree.interval_dict[nid] for nid in alive_nodes(tree)}
+    alive_num = len(alive_nodes(tree))
+
+    new_ids = tree.compact()
+    fake_neo4j.renumber_nodes(new_ids)
+    assert len(tree) == alive_num == tree.alive_num and tree.dead_num() == 0
+    assert all(tree.trie.score[nid] > 0 for nid in range(1, len(tree)))
+    assert all(tree.trie.parent[nid] < nid for nid in range(1, len(tree)))
+    assert all(tree.trie.depth(nid) == len(tree.trie.path(nid)) for nid in range(len(tree)))
+    # 没有depths数组的旧快照, 读取时由parent重新计算
+    state = dict(tree.trie.__dict__)
+    del state["depths"]
+    old_trie = type(tree.trie).__new__(type(tree.trie))
+    old_trie.__setstate__(state)
+    assert old_trie.depths == tree.trie.depths
+    assert {exp_id: (path_key(tree, nid), sorted(tree.resume_record[nid])) for exp_id, nid in tree.exp_nid.items()} == before
+    assert {path_key(tree, nid): tree.interval_dict[nid] for nid in alive_nodes(tree)} == intervals
+    assert set(tree.resume_record) <= set(range(len(tree))) and set(tree.leaf_tag) <= set(range(len(tree)))
+    # neo4j中的id与压缩后的树一致
+    full = new_adapter(fake_neo4j)
+    full.tree_to_neo4j({"nodes": tree.trie, "rel": [((tree.trie.parent[n], ""), {}, (n, "")) for n in range(1, len(tree))]},
+                       tree.interval_dict, init=True)
+    assert fake_neo4j.GraphDatabase.nodes == full.GraphDatabase.nodes
+    assert fake_neo4j.GraphDatabase.edges == full.GraphDatabase.edges
+
+    # 压缩后继续增量插入
+    more = [random_exp(rng, "v{}".format(i), "q{}".format(i)) for i in range(50)]
+    fake_neo4j.apply_delta(tree.build_tree(more, init=False), tree.interval_dict)
+    fresh = CTree()
+    fresh_graph = new_adapter(fake_neo4j)
+    fresh_graph.tree_to_neo4j(fresh.build_tree(exp_list[1::2] + changed + more), fresh.interval_dict, init=True)
+    assert graph_state(tree, fake_neo4j.GraphDatabase) == graph_state(fresh, fresh_graph.GraphDatabase)
+
+
+def tree_state(tree):
+    """与结点编号无关的树的内容"""
+    return ({path_key(tree, nid): (tree.trie.count[nid], tree.trie.score[nid], tree.interval_dict.get(nid),
+                                   sorted(tree.resume_record.get(nid, []))) for nid in alive_nodes(tree)},
+            {exp_id: path_key(tree, nid) for exp_id, nid in tree.exp_nid.items()},
+            tree.rank_record, {exp_id: exp.text for exp_id, exp in tree.user_exps.items()}, tree.uid_userName_map,
+            tree.log_seq)
+
+
+def test_store_replays_log(fake_neo4j, monkeypatch):
+    """
+    OCTreeStore只在第一次load时读取快照, 之后每批经历追加一行日志. 重新load(快照+日志)得到与内存中相同的树,
+    保存快照后日志被清空, 没有写完的最后一行被忽略
+    """
+    monkeypatch.setattr(octree_module, "Neo4jAdapter", lambda: fake_neo4j)
+    rng = random.Random(1)
+    path = str(fake_neo4j.tmp_path / "octree_snapshot.pkl")
+    store = octree_module.OCTreeStore(path, snapshot_interval=3)
+    exp_list = [random_exp(rng, "u{}".format(i), "p{}".format(i // 3)) for i in range(100)]
+    octree_module.octree(exp_list, [Person(uuid="p{}".format(i), name="n{}".format(i)) for i in range(34)],
+                         export_json=False, store=store)
+    tree = store.tree
+    assert store.load() is tree and store.logged_num() == 0
+
+    for batch in range(5):
+        more = [random_exp(rng, "v{}{}".format(batch, i), "q{}".format(batch)) for i in range(10)] + \
+               [random_exp(rng, exp.uuid, exp.person_uuid, exp.splitnum) for exp in rng.sample(exp_list, 5)]
+        octree_module.octree(more, [Person(uuid="q{}".format(batch), name="m{}".format(batch))],
+                             export_json=False, store=store)
+        assert store.tree is tree
+        # 第3批之后保存了快照, 日志只保留之后的批次
+        with open(store.log_path, encoding="utf-8") as f:
+            assert len(f.readlines()) == store.logged_num() == (batch + 1) % 3
+    assert tree.log_seq == 5 and tree.uid_userName_map["q4"] == "m4"
+
+    loaded = octree_module.OCTreeStore(path).load()
+    assert tree_state(loaded) == tree_state(tree)
+
+    with open(store.log_path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 6, "uid2name": {}, "exps": [["w')
+    other = octree_module.OCTreeStore(path)
+    assert tree_state(other.load()) == tree_state(tree)
+    assert other.logged_num() == 0 and os.path.getsize(store.log_path) == 0
+    assert tree_state(octree_module.OCTreeStore(path).load()) == tree_state(tree)
+
+
+@pytest.mark.parametrize("failing", ["apply_delta", "compute_csn"])
+def test_failed_batch_is_inserted_again(fake_neo4j, monkeypatch, failing):
+    """
+    写neo4j失败的一批经历不写入日志, store重新读取快照和日志, 再次提交同样的经历时不会被当作未变化而跳过
+    """
+    monkeypatch.setattr(octree_module, "Neo4jAdapter", lambda: fake_neo4j)
+    rng = random.Random(2)
+    store = octree_module.OCTreeStore(str(fake_neo4j.tmp_path / "octree_snapshot.pkl"))
+    exp_list = [random_exp(rng, "u{}".format(i), "p{}".format(i // 3)) for i in range(60)]
+    persons = [Person(uuid="p{}".format(i), name="n{}".format(i)) for i in range(20)]
+    octree_module.octree(exp_list, persons, export_json=False, store=store)
+    more = [random_exp(rng, "v{}".format(i), "q0") for i in range(10)] + \
+           [random_exp(rng, exp.uuid, exp.person_uuid, exp.splitnum) for exp in exp_list[:5]]
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("neo4j is unavailable")
+    with monkeypatch.context() as m:
+        m.setattr(fake_neo4j, failing, fail, raising=False)
+        with pytest.raises(ConnectionError):
+            octree_module.octree(more, [Person(uuid="q0", name="m0")], export_json=False, store=store)
+    assert store.logged_num() == 0 and os.path.getsize(store.log_path) == 0
+    assert "v0+0" not in store.load().exp_nid
+
+    octree_module.octree(more, [Person(uuid="q0", name="m0")], export_json=False, store=store)
+    fresh = CTree()
+    fresh_graph = new_adapter(fake_neo4j)
+    fresh_graph.tree_to_neo4j(fresh.build_tree(exp_list[5:] + more), fresh.interval_dict, init=True)
+    assert tree_state(store.tree)[:4] == tree_state(fresh)[:4] and store.logged_num() == 1
+    assert graph_state(store.tree, fake_neo4j.GraphDatabase) == graph_state(fresh, fresh_graph.GraphDatabase)